@@ -0,0 +1,118 @@
+"""
+Range-read benchmark for the metars table: the original layout (ISO text
+times, JSON clouds/weather decoded with literal_eval) against the current
+schema after migrating the same data with ogimet_utils.create_db.
+
+    python benchmarks/bench_db.py [--years 10] [--stations 4]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from ast import literal_eval
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from ogimet_model import Metar  # noqa: E402
+from ogimet_utils import create_db, iter_metar_rows  # noqa: E402
+from bench_parse import SAMPLE_BODIES  # noqa: E402
+
+V1_METARS = """
+    CREATE TABLE metars (
+        station TEXT, time TEXT, raw TEXT, wind_direction TEXT, wind_speed INTEGER,
+        wind_gust INTEGER, visibility INTEGER, clouds TEXT, base INTEGER, ceiling INTEGER,
+        weather TEXT, qnh INTEGER, temperature INTEGER, dewpoint INTEGER,
+        PRIMARY KEY (station, time)
+    )
+"""
+
+
+def build_v1(path, stations, years):
+    conn = sqlite3.connect(path)
+    conn.execute(V1_METARS)
+    start = datetime(2025 - years, 1, 1)
+    rows = []
+    for s, station in enumerate(stations):
+        t = start
+        n = s
+        while t < datetime(2025, 1, 1):
+            body = SAMPLE_BODIES[n % len(SAMPLE_BODIES)].format(icao=station, dt=t.strftime("%d%H%M"))
+            m = Metar(f"{t:%Y%m%d%H%M} {body}")
+            rows.append((m.station, m.time.isoformat(), m.raw, m.wind_direction, m.wind_speed, m.wind_gust,
+                         m.visibility, json.dumps(m.clouds), m.ceiling, m.base, json.dumps(m.weather),
+                         m.qnh, m.temperature, m.dewpoint))
+            t += timedelta(minutes=30)
+            n += 1
+    # Insert in time order across stations, as fetching interleaves them
+    rows.sort(key=lambda r: r[1])
+    conn.executemany("INSERT INTO metars (station, time, raw, wind_direction, wind_speed, wind_gust, visibility, "
+                     "clouds, ceiling, base, weather, qnh, temperature, dewpoint) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return len(rows), start
+
+
+def read_v1(conn, station, start, end):
+    c = conn.cursor()
+    c.execute("SELECT * FROM metars WHERE station = ? AND time BETWEEN ? AND ?",
+              (station, start.isoformat(), end.isoformat()))
+    count = 0
+    for row in c.fetchall():
+        datetime.fromisoformat(row['time'])
+        literal_eval(row['clouds']) if row['clouds'] != "null" else None
+        literal_eval(row['weather']) if row['weather'] != "null" else None
+        count += 1
+    return count
+
+
+def read_v2(conn, station, start, end):
+    count = 0
+    for row in iter_metar_rows(conn, station, start, end):
+        Metar.from_db_row(row)
+        count += 1
+    return count
+
+
+def timed(label, func, *args):
+    started = time.perf_counter()
+    count = func(*args)
+    seconds = time.perf_counter() - started
+    print(f"{label:<28} {count:>9} rows {seconds:>7.3f}s {count / seconds:>12,.0f} rows/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--stations", type=int, default=4)
+    args = parser.parse_args()
+
+    stations = [f"EG{chr(65 + i // 26)}{chr(65 + i % 26)}" for i in range(args.stations)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "metars.db")
+        started = time.perf_counter()
+        total, start = build_v1(path, stations, args.years)
+        print(f"Built v1 database with {total} rows in {time.perf_counter() - started:.1f}s")
+        end = datetime(2025, 1, 1)
+        one_year = (end - timedelta(days=365), end)
+
+        v1 = sqlite3.connect(path)
+        v1.row_factory = sqlite3.Row
+        timed("v1 one station, all years", read_v1, v1, stations[0], start, end)
+        timed("v1 one station, one year", read_v1, v1, stations[0], *one_year)
+        v1.close()
+
+        started = time.perf_counter()
+        v2 = create_db(path)
+        print(f"Migrated to current schema in {time.perf_counter() - started:.1f}s")
+        timed("v2 one station, all years", read_v2, v2, stations[0], start, end)
+        timed("v2 one station, one year", read_v2, v2, stations[0], *one_year)
+        v2.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Flyability evaluation benchmark: Metar.is_flyable per observation against
+metar_eval.evaluate_flyable over a MetarBatch, checking both agree.
+
+    python benchmarks/bench_eval.py [--count 1000000] [--rulesets 4]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from ogimet_model import Metar  # noqa: E402
+from metar_batch import MetarBatch  # noqa: E402
+from metar_eval import evaluate_rulesets  # noqa: E402
+from metar_rulesets import DEFAULT_RULESET  # noqa: E402
+
+WEATHER = [None, None, None, ["-RA"], ["BR"], ["+TS"], ["TS", "RA"], ["VCSH"], ["FG"], ["-SH", "BR"]]
+CLOUDS = [None, [("FEW", "035")], [("SCT", "012"), ("BKN", "020")], [("OVC", "005")], [("BKN", "045")]]
+
+
+def random_metars(count, seed=1):
+    rng = random.Random(seed)
+    t = datetime(2010, 1, 1)
+    metars = []
+    for _ in range(count):
+        m = Metar(raw=None, parse=False)
+        m.station = "EGKA"
+        m.time = t
+        m.wind_direction = rng.choice(["VRB", "270", "090", None])
+        m.wind_speed = rng.choice([None, rng.randint(0, 35)])
+        m.wind_gust = rng.choice([None, None, rng.randint(15, 50)])
+        m.visibility = rng.choice([None, 9999, rng.randint(100, 9999)])
+        m.clouds = rng.choice(CLOUDS)
+        m.base = m.get_base()
+        m.ceiling = m.get_ceiling()
+        m.weather = rng.choice(WEATHER)
+        m.qnh = rng.randint(970, 1040)
+        m.temperature = rng.choice([None, rng.randint(-15, 35)])
+        m.dewpoint = m.temperature
+        metars.append(m)
+        t += timedelta(minutes=30)
+    return metars
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--rulesets", type=int, default=4)
+    args = parser.parse_args()
+
+    metars = random_metars(args.count)
+    rulesets = {}
+    for n in range(args.rulesets):
+        rules = dict(DEFAULT_RULESET.flyable)
+        rules["min_visibility"] -= 1000 * n
+        rules["max_wind_speed"] += 2 * n
+        rulesets[f"rules{n}"] = rules
+
+    started = time.perf_counter()
+    batch = MetarBatch.from_metars(metars, keep_raw=False)
+    print(f"Built batch of {len(batch)} in {time.perf_counter() - started:.2f}s")
+
+    started = time.perf_counter()
+    results = evaluate_rulesets(batch, rulesets)
+    print(f"Vectorised: {len(rulesets)} rulesets in {time.perf_counter() - started:.3f}s")
+
+    started = time.perf_counter()
+    expected = {name: [m.is_flyable(**rules) for m in metars] for name, rules in rulesets.items()}
+    print(f"is_flyable: {len(rulesets)} rulesets in {time.perf_counter() - started:.3f}s")
+
+    mismatches = sum(int((results[name][0] != expected[name]).sum()) for name in rulesets)
+    print(f"Disagreements: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Narrow-query benchmark for lazy Metar decoding: reads one field (visibility)
+from every report in a range, from raw strings and from database rows, with
+eager Metar objects and with Metar.lazy / from_db_row(lazy=True), and then
+all fields the same ways for comparison.
+
+    python benchmarks/bench_lazy.py [--days 730]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import metar_db  # noqa: E402
+from ogimet_model import Metar  # noqa: E402
+from ogimet_utils import iter_metar_rows  # noqa: E402
+from metar_ingest import ingest_lines  # noqa: E402
+from synthetic import getmetar_lines, raw_metars  # noqa: E402
+
+BEGIN = datetime(2020, 1, 1)
+
+
+def narrow(metars):
+    return sum(1 for m in metars if m.visibility is not None and m.visibility < 5000)
+
+
+def wide(metars):
+    return sum(1 for m in metars if m.is_flyable(min_visibility=5000, min_ceiling=1500, max_wind_speed=20,
+                                                 max_wind_gust=25, bad_weather=["TS", "SN"]))
+
+
+def timed(label, count, func):
+    started = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - started
+    print(f"{label:<36} {count:>9} reports {seconds:>7.3f}s {count / seconds:>12,.0f} reports/sec")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=730)
+    args = parser.parse_args()
+    end = BEGIN + timedelta(days=args.days)
+
+    raws = list(raw_metars(["EGKA"], BEGIN, end))
+    n = len(raws)
+    eager = timed("raw, eager, visibility only", n, lambda: narrow(Metar(raw) for raw in raws))
+    lazy = timed("raw, lazy, visibility only", n, lambda: narrow(Metar.lazy(raw) for raw in raws))
+    print(f"  speedup {eager / lazy:.2f}x")
+    timed("raw, eager, all fields", n, lambda: wide(Metar(raw) for raw in raws))
+    timed("raw, lazy, all fields", n, lambda: wide(Metar.lazy(raw) for raw in raws))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = metar_db.connect(os.path.join(tmp, "lazy.db"))
+        ingest_lines(conn, getmetar_lines(["EGKA"], BEGIN, end), workers=1)
+        rows = list(iter_metar_rows(conn, "EGKA", BEGIN, end))
+        eager = timed("rows, eager, visibility only", n, lambda: narrow(Metar.from_db_row(row) for row in rows))
+        lazy = timed("rows, lazy, visibility only", n,
+                     lambda: narrow(Metar.from_db_row(row, lazy=True) for row in rows))
+        print(f"  speedup {eager / lazy:.2f}x")
+        timed("rows, eager, all fields", n, lambda: wide(Metar.from_db_row(row) for row in rows))
+        timed("rows, lazy, all fields", n, lambda: wide(Metar.from_db_row(row, lazy=True) for row in rows))
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Parse throughput benchmark for ogimet_model.Metar.parse.
+
+Compares the current single-pass tokenizer with the previous multi-regex
+parser (kept below as legacy_parse) on the same corpus, and reports how many
+reports the two disagree on.
+
+    python benchmarks/bench_parse.py [--db metars.db] [--count 200000]
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from ogimet_model import Metar  # noqa: E402
+
+FIELDS = ("station", "time", "wind_direction", "wind_speed", "wind_gust", "visibility", "clouds",
+          "base", "ceiling", "weather", "qnh", "temperature", "dewpoint")
+
+SAMPLE_BODIES = [
+    "METAR {icao} {dt}Z 27010KT 9999 FEW035 12/08 Q1015=",
+    "METAR {icao} {dt}Z AUTO VRB03KT 9999 NCD 08/06 Q1021=",
+    "METAR COR {icao} {dt}Z 24018G29KT 8000 -RA SCT012 BKN020 OVC035 10/09 Q0998=",
+    "METAR {icao} {dt}Z 36005KT 0800 R26/1200 FG VV002 M01/M02 Q1030=",
+    "METAR {icao} {dt}Z 21022G35KT 4000 +TSRA BKN008 FEW020CB 15/14 Q1002 TEMPO 2000 TSRA=",
+    "METAR {icao} {dt}Z 00000KT CAVOK M05/M09 Q1035 NOSIG=",
+    "METAR {icao} {dt}Z 31012KT 280V350 6000 VCSH BR SCT015 BKN025 05/04 Q1012=",
+]
+
+
+def legacy_parse(metar):
+    """The multi-regex parser that Metar.parse replaced."""
+    parts = metar.raw.split()
+    if parts[2] == 'COR':
+        parts.pop(2)
+    metar.station = parts[2]
+    metar.time = datetime.strptime(parts[0], '%Y%m%d%H%M')
+    wind_match = re.findall(r'(\d{3}|VRB)(\d{2,3})G?(\d{2,3})?KT', metar.raw)
+    if wind_match:
+        metar.wind_direction = wind_match[0][0]
+        metar.wind_speed = int(wind_match[0][1])
+        if wind_match[0][2]:
+            metar.wind_gust = int(wind_match[0][2])
+    vis_match = re.search(r'\s(\d{4})\s', metar.raw)
+    if vis_match:
+        metar.visibility = int(vis_match.group(1))
+    clouds = re.findall(r'(FEW|SCT|BKN|OVC)(\d{3})', metar.raw)
+    if clouds != []:
+        metar.clouds = clouds
+    metar.base = metar.get_base()
+    metar.ceiling = metar.get_ceiling()
+    qnh = re.findall(r'Q(\d{4})', metar.raw)
+    # Compared as the single int Metar.qnh has been since schema v2
+    metar.qnh = int(qnh[0]) if qnh else None
+    temp_dew = re.findall(r'(\d{2}|M\d{2})\/(\d{2}|M\d{2})', metar.raw)
+    if temp_dew:
+        metar.temperature = metar.get_temperature(temp_dew[0])
+        metar.dewpoint = metar.get_dewpoint(temp_dew[0])
+    wx_match = re.findall(r'\s(-|\+)?(VC)?(RA|SN|BR|FG|HZ|TS|DZ|SH|PL|GR|GS|UP)', metar.raw)
+    if wx_match:
+        metar.weather = [f'{wx[0]}{wx[1]}{wx[2]}' for wx in wx_match]
+
+
+def sample_corpus(count):
+    raws = []
+    t = datetime(2015, 1, 1)
+    for n in range(count):
+        body = SAMPLE_BODIES[n % len(SAMPLE_BODIES)].format(icao="EGKA", dt=t.strftime("%d%H%M"))
+        raws.append(f"{t:%Y%m%d%H%M} {body}")
+        t += timedelta(minutes=30)
+    return raws
+
+
+def db_corpus(path, count):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT raw FROM metars LIMIT ?", (count,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def run(label, raws, parse):
+    started = time.perf_counter()
+    for raw in raws:
+        parse(raw)
+    seconds = time.perf_counter() - started
+    print(f"{label:<10} {len(raws) / seconds:>12,.0f} reports/sec ({seconds:.2f}s)")
+    return seconds
+
+
+def parse_legacy(raw):
+    metar = Metar(raw, parse=False)
+    legacy_parse(metar)
+    return metar
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="read the corpus from the raw column of this metars.db")
+    parser.add_argument("--count", type=int, default=200000)
+    args = parser.parse_args()
+
+    raws = db_corpus(args.db, args.count) if args.db else sample_corpus(args.count)
+    print(f"Corpus: {len(raws)} reports")
+    before = run("legacy", raws, parse_legacy)
+    after = run("tokenizer", raws, Metar)
+    print(f"Speed-up: {before / after:.2f}x")
+
+    differing = 0
+    for raw in raws:
+        old, new = parse_legacy(raw), Metar(raw)
+        if any(getattr(old, f) != getattr(new, f) for f in FIELDS):
+            differing += 1
+    print(f"Reports parsed differently: {differing}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Local stand-in for Ogimet's getmetar CGI and display_metars2.php pages,
+serving synthetic reports.
+
+Answers /cgi-bin/getmetar?icao=...&begin=...&end=...&header=... with the
+reports benchmarks/synthetic.py generates for that range, and
+/display_metars2.php with the same reports as an HTML page, newest first,
+the way ogimet_utils.get_metar_from_ogimet requests it. Responses can be
+delayed, and some answered by the quota-limit message or an HTTP 500
+instead. Pages can also be answered with a script challenge for clients
+that are not a browser, to exercise the ScraperPool fallback. Point the
+code at it with OGIMET_URL or ogimet_cgi.set_base_url.
+
+    python benchmarks/ogimet_standin.py [--port 8765] [--latency 0.2] [--quota-rate 0.05]
+"""
+import argparse
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from synthetic import getmetar_lines, raw_metars
+
+QUOTA_MESSAGE = "#Sorry, Your quota limit for slow queries rate has been reached"
+HEADER = "# ICAO,YEAR,MONTH,DAY,HOUR,MIN,REPORT"
+CHALLENGE_PAGE = ("<html><head><script>document.cookie='verified=1';location.reload()</script></head>"
+                  "<body>Checking your browser...</body></html>")
+
+# Stations returned for state=... requests
+STATES = {
+    "United Kingdom": ["EGKA", "EGKK", "EGLL", "EGHI"],
+}
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status, body, content_type="text/plain"):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        url = urlsplit(self.path)
+        if url.path not in ("/cgi-bin/getmetar", "/display_metars2.php"):
+            self._send(404, "Not found\n")
+            return
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        with server.lock:
+            server.requests += 1
+            roll = server.rng.random()
+            challenge = server.rng.random() < server.challenge_rate
+        if server.latency:
+            time.sleep(server.latency)
+        if roll < server.error_rate:
+            self._send(500, "Internal Server Error\n")
+            return
+        quota = roll < server.error_rate + server.quota_rate
+        if quota:
+            with server.lock:
+                server.quota_responses += 1
+        if url.path == "/display_metars2.php":
+            self._display_page(params, quota, challenge)
+            return
+        if quota:
+            self._send(200, server.quota_message() + "\n")
+            return
+        try:
+            begin = datetime.strptime(params["begin"], "%Y%m%d%H%M")
+            end = datetime.strptime(params["end"], "%Y%m%d%H%M")
+        except (KeyError, ValueError):
+            self._send(400, "Bad begin/end\n")
+            return
+        if "icao" in params:
+            stations = params["icao"].split(",")
+        else:
+            stations = STATES.get(params.get("state"), [])
+        lines = list(getmetar_lines(stations, begin, end, step=server.step))
+        if params.get("header") == "yes":
+            lines.insert(0, HEADER)
+        self._send(200, "\n".join(lines) + "\n")
+
+    def _display_page(self, params, quota, challenge):
+        server = self.server
+        if challenge and "Chrome" not in self.headers.get("User-Agent", ""):
+            with server.lock:
+                server.challenges += 1
+            self._send(200, CHALLENGE_PAGE, "text/html")
+            return
+        if quota:
+            self._send(200, f"<html><body><p>{server.quota_message()}</p></body></html>", "text/html")
+            return
+        try:
+            begin = datetime(int(params["ano"]), int(params["mes"]), int(params["day"]), int(params["hora"]))
+            end = datetime(int(params["anof"]), int(params["mesf"]), int(params["dayf"]), int(params["horaf"]),
+                           int(params.get("minf", 59)))
+            station = params["lugar"]
+        except (KeyError, ValueError):
+            self._send(400, "Bad request\n")
+            return
+        reports = list(raw_metars([station], begin, end, step=server.step))
+        if not reports:
+            self._send(200, "<html><body><p>No METARs found</p></body></html>", "text/html")
+            return
+        reports.reverse()
+        body = "\n".join(reports)
+        self._send(200, f"<html><body><h2>METARs from {station}</h2><pre>\n{body}\n</pre></body></html>",
+                   "text/html")
+
+
+class StandinServer(ThreadingHTTPServer):
+    '''
+    :param latency: Seconds to wait before answering each request.
+    :param quota_rate: Fraction of requests answered with the quota message.
+    :param error_rate: Fraction of requests answered with HTTP 500.
+    :param challenge_rate: Fraction of page requests from clients without
+        "Chrome" in their User-Agent answered with a script challenge.
+    :param quota_reset: Seconds the quota message says to wait, if set.
+    :param step: Minutes between generated reports.'''
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, quota_rate=0.0, error_rate=0.0, challenge_rate=0.0,
+                 quota_reset=None, step=30, seed=1, verbose=False):
+        super().__init__(("127.0.0.1", port), StandinHandler)
+        self.latency = latency
+        self.quota_rate = quota_rate
+        self.error_rate = error_rate
+        self.challenge_rate = challenge_rate
+        self.quota_reset = quota_reset
+        self.step = step
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.quota_responses = 0
+        self.challenges = 0
+
+    def quota_message(self):
+        if self.quota_reset is None:
+            return QUOTA_MESSAGE
+        return f"{QUOTA_MESSAGE}. Please try again in {self.quota_reset} seconds"
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+def start_standin(**kwargs):
+    '''Starts a StandinServer on a background thread and returns it. Call shutdown() when done.'''
+    server = StandinServer(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="fraction of quota-limit answers")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of HTTP 500 answers")
+    parser.add_argument("--challenge-rate", type=float, default=0.0,
+                        help="fraction of non-browser page requests given a script challenge")
+    parser.add_argument("--quota-reset", type=int, default=None, help="seconds the quota message asks to wait")
+    parser.add_argument("--step", type=int, default=30, help="minutes between reports")
+    args = parser.parse_args()
+
+    server = StandinServer(port=args.port, latency=args.latency, quota_rate=args.quota_rate,
+                           error_rate=args.error_rate, challenge_rate=args.challenge_rate,
+                           quota_reset=args.quota_reset, step=args.step, verbose=True)
+    print(f"Serving getmetar on {server.url} (OGIMET_URL={server.url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+Benchmark suite: parse throughput (eager and lazy), ingest rate, range-read
+latency, batch evaluation and end-to-end analyze_metars against the local
+Ogimet stand-in. Nothing touches ogimet.com or the real metars.db.
+
+Results are written as JSON tagged with the git commit, so two runs can be
+compared:
+
+    python benchmarks/run.py [--quick] [--output results.json]
+    python benchmarks/run.py --compare before.json after.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, os.pardir)
+sys.path.insert(0, ROOT)
+
+import ogimet_cgi  # noqa: E402
+import metar_db  # noqa: E402
+from ogimet_model import Metar  # noqa: E402
+from ogimet_utils import iter_metar_rows  # noqa: E402
+from ogimet_throttle import TokenBucket  # noqa: E402
+from metar_ingest import ingest_lines  # noqa: E402
+from metar_batch import MetarBatch  # noqa: E402
+from metar_analysis import analyze_metars, evaluate_batch  # noqa: E402
+from metar_rulesets import DEFAULT_RULESET  # noqa: E402
+from synthetic import getmetar_lines, raw_metars  # noqa: E402
+from ogimet_standin import start_standin  # noqa: E402
+
+BEGIN = datetime(2020, 1, 1)
+
+
+def git_commit():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def best_of(repeat, func):
+    '''Runs func repeat times and returns (fastest seconds, its result).'''
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - started
+        if best is None or seconds < best[0]:
+            best = (seconds, result)
+    return best
+
+
+def bench_parse(days, repeat):
+    raws = list(raw_metars(["EGKA"], BEGIN, BEGIN + timedelta(days=days)))
+    seconds, _ = best_of(repeat, lambda: [Metar(raw=raw, parse=True) for raw in raws])
+    lazy_seconds, _ = best_of(repeat, lambda: [Metar.lazy(raw).visibility for raw in raws])
+    return {
+        "parse": (len(raws) / seconds, "reports/sec", True),
+        "parse_lazy_visibility": (len(raws) / lazy_seconds, "reports/sec", True),
+    }
+
+
+def bench_ingest_and_read(tmp, days, repeat):
+    path = os.path.join(tmp, "ingest.db")
+    conn = metar_db.connect(path)
+    lines = list(getmetar_lines(["EGKA", "EGLL"], BEGIN, BEGIN + timedelta(days=days)))
+    started = time.perf_counter()
+    totals = ingest_lines(conn, lines, workers=1)
+    ingest_seconds = time.perf_counter() - started
+
+    end = BEGIN + timedelta(days=min(days, 365))
+
+    def read():
+        return [Metar.from_db_row(row) for row in iter_metar_rows(conn, "EGKA", BEGIN, end)]
+    read_seconds, metars = best_of(repeat, read)
+
+    def read_visibility():
+        return [Metar.from_db_row(row, lazy=True).visibility for row in iter_metar_rows(conn, "EGKA", BEGIN, end)]
+    narrow_seconds, _ = best_of(repeat, read_visibility)
+
+    def evaluate():
+        batch = MetarBatch.from_db_rows(iter_metar_rows(conn, "EGKA", BEGIN, end), keep_raw=False)
+        return evaluate_batch(batch, DEFAULT_RULESET)
+    evaluate_seconds, _ = best_of(repeat, evaluate)
+    conn.close()
+    return {
+        "ingest": (totals["inserted"] / ingest_seconds, "rows/sec", True),
+        "range_read_year": (read_seconds * 1000, "ms", False),
+        "range_read": (len(metars) / read_seconds, "rows/sec", True),
+        "range_read_lazy_visibility": (len(metars) / narrow_seconds, "rows/sec", True),
+        "read_and_evaluate_year": (evaluate_seconds * 1000, "ms", False),
+    }
+
+
+def bench_analyze(tmp, days, latency):
+    server = start_standin(latency=latency)
+    ogimet_cgi.set_base_url(server.url)
+    conn = metar_db.connect(os.path.join(tmp, "analyze.db"))
+    limiter = TokenBucket(rate=1000, capacity=1000)
+    end = BEGIN + timedelta(days=days - 1)
+
+    def analyze():
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_metars(start_date=f"{BEGIN:%d-%m-%Y}", end_date=f"{end:%d-%m-%Y}", conn=conn, limiter=limiter)
+    try:
+        cold, _ = best_of(1, analyze)
+        warm, _ = best_of(1, analyze)
+    finally:
+        ogimet_cgi.set_base_url(None)
+        server.shutdown()
+        conn.close()
+    return {
+        "analyze_cold": (cold, "s", False),
+        "analyze_cached": (warm * 1000, "ms", False),
+        "analyze_requests": (server.requests, "requests", False),
+    }
+
+
+def run_suite(quick=False, latency=0.0):
+    days = 60 if quick else 365
+    repeat = 1 if quick else 3
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, func in [
+            ("parse", lambda: bench_parse(days, repeat)),
+            ("ingest/read", lambda: bench_ingest_and_read(tmp, days * 2, repeat)),
+            ("analyze", lambda: bench_analyze(tmp, days, latency)),
+        ]:
+            print(f"Running {name}...", flush=True)
+            for key, (value, unit, higher_is_better) in func().items():
+                results[key] = {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+                print(f"  {key:<24} {value:>14,.2f} {unit}")
+    commit, dirty = git_commit()
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def compare(before, after):
+    print(f"{'':<24} {before['commit']:>14} {after['commit']:>14} {'change':>9}")
+    for key, new in after["results"].items():
+        old = before["results"].get(key)
+        if old is None:
+            print(f"{key:<24} {'-':>14} {new['value']:>14,.2f}")
+            continue
+        change = (new["value"] - old["value"]) / old["value"] * 100 if old["value"] else 0.0
+        better = change > 0 if new["higher_is_better"] else change < 0
+        mark = "" if abs(change) < 5 else (" better" if better else " worse")
+        print(f"{key:<24} {old['value']:>14,.2f} {new['value']:>14,.2f} {change:>+8.1f}%{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller data sets and single runs")
+    parser.add_argument("--latency", type=float, default=0.0, help="stand-in seconds per request")
+    parser.add_argument("--output", help="JSON file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        compare(before, after)
+        return
+
+    report = run_suite(quick=args.quick, latency=args.latency)
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(HERE, "results"), exist_ok=True)
+        output = os.path.join(HERE, "results", f"{report['commit']}{'-dirty' if report['dirty'] else ''}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
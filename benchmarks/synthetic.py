@@ -0,0 +1,158 @@
+"""
+Synthetic METAR generator for the benchmarks and the Ogimet stand-in.
+
+Reports follow a seasonal and daily temperature cycle with random weather
+on top, and cover the forms the parser has to deal with: COR and AUTO
+reports, VRB and variable-sector winds, gusts, CAVOK and NCD, several
+cloud layers and CB/TCU, vertical visibility, negative temperatures,
+weather groups with intensity and descriptors, and TEMPO/NOSIG trends.
+Each report only depends on the station and its time, so the same range
+always gives the same reports.
+
+    python benchmarks/synthetic.py out.csv [--stations EGKA,EGLL] [--years 2]
+"""
+import argparse
+import math
+import random
+from datetime import datetime, timedelta
+
+# (weight, weather groups, visibility range, cloud layers)
+CONDITIONS = [
+    (40, [], (9999, 9999), "fair"),
+    (12, [], (6000, 9999), "cloudy"),
+    (8, ["-RA"], (5000, 9999), "low"),
+    (4, ["RA"], (3000, 7000), "low"),
+    (2, ["+RA"], (1500, 4000), "low"),
+    (6, ["BR"], (1500, 4500), "low"),
+    (3, ["FG"], (100, 900), "fog"),
+    (1, ["FZFG"], (100, 700), "fog"),
+    (2, ["HZ"], (3000, 6000), "fair"),
+    (3, ["-SHRA"], (6000, 9999), "showers"),
+    (2, ["VCSH"], (9999, 9999), "showers"),
+    (1, ["TS"], (4000, 9999), "storm"),
+    (1, ["+TSRA"], (1500, 4000), "storm"),
+    (1, ["TSRA", "BR"], (2000, 4500), "storm"),
+    (1, ["-SN"], (2000, 6000), "low"),
+    (1, ["-DZ", "BR"], (2500, 4500), "low"),
+    (1, ["GS"], (3000, 7000), "showers"),
+]
+_WEIGHTS = [c[0] for c in CONDITIONS]
+
+
+def _clouds(rng, kind):
+    if kind == "fair":
+        return rng.choice(["CAVOK", "NCD", "NSC", f"FEW{rng.randint(25, 50):03d}",
+                           f"SCT{rng.randint(30, 60):03d}"])
+    if kind == "fog":
+        return rng.choice([f"VV{rng.randint(0, 3):03d}", "OVC001", "BKN002"])
+    if kind == "storm":
+        return f"FEW{rng.randint(15, 30):03d}CB SCT{rng.randint(20, 40):03d} BKN{rng.randint(60, 100):03d}"
+    if kind == "showers":
+        return f"FEW{rng.randint(15, 30):03d}TCU SCT{rng.randint(25, 45):03d}"
+    layers = []
+    height = rng.randint(4, 20) if kind == "low" else rng.randint(12, 40)
+    for cover in rng.sample(["FEW", "SCT", "BKN", "OVC"], rng.randint(1, 3)):
+        layers.append((height, cover))
+        height += rng.randint(5, 30)
+    order = {"FEW": 0, "SCT": 1, "BKN": 2, "OVC": 3}
+    layers.sort(key=lambda layer: (layer[0], order[layer[1]]))
+    return " ".join(f"{cover}{height:03d}" for height, cover in layers)
+
+
+def _temperature(station, t, rng):
+    day = t.timetuple().tm_yday
+    seasonal = 10 - 8 * math.cos(2 * math.pi * (day - 20) / 365)
+    daily = -4 * math.cos(2 * math.pi * (t.hour + t.minute / 60 - 3) / 24)
+    offset = (sum(map(ord, station)) % 7) - 3
+    return round(seasonal + daily + offset + rng.gauss(0, 2))
+
+
+def _temp_group(value):
+    return f"M{-value:02d}" if value < 0 else f"{value:02d}"
+
+
+def metar_body(station, t):
+    '''The report text, from "METAR" to "=", for a station at time t.'''
+    rng = random.Random(f"{station}{t:%Y%m%d%H%M}")
+    _, weather, (vis_low, vis_high), kind = rng.choices(CONDITIONS, weights=_WEIGHTS)[0]
+
+    parts = ["METAR"]
+    if rng.random() < 0.01:
+        parts.append("COR")
+    parts += [station, f"{t:%d%H%M}Z"]
+    if rng.random() < 0.05:
+        parts.append("AUTO")
+
+    speed = max(0, round(rng.gauss(9, 5) + (10 if kind == "storm" else 0)))
+    if speed <= 3 and rng.random() < 0.6:
+        parts.append(f"VRB{speed:02d}KT")
+    else:
+        direction = rng.randrange(0, 360, 10) or 360
+        gust = f"G{speed + rng.randint(10, 20):02d}" if speed >= 12 and rng.random() < 0.4 else ""
+        parts.append(f"{direction:03d}{speed:02d}{gust}KT")
+        if speed >= 4 and rng.random() < 0.1:
+            parts.append(f"{(direction - 40) % 360 or 360:03d}V{(direction + 40) % 360 or 360:03d}")
+
+    clouds = _clouds(rng, kind)
+    if clouds != "CAVOK":
+        visibility = vis_high if vis_low == vis_high else rng.randint(vis_low, vis_high) // 100 * 100
+        parts.append(f"{visibility:04d}")
+        if visibility < 1500 and rng.random() < 0.5:
+            parts.append(f"R26/{visibility + 200:04d}")
+        parts += weather
+    parts.append(clouds)
+
+    temperature = _temperature(station, t, rng)
+    dewpoint = temperature - (rng.randint(0, 1) if kind in ("fog", "low") else rng.randint(1, 9))
+    parts.append(f"{_temp_group(temperature)}/{_temp_group(dewpoint)}")
+    parts.append(f"Q{round(1013 + rng.gauss(0, 10)):04d}")
+    if kind == "storm" and rng.random() < 0.5:
+        parts.append("TEMPO 3000 TSRA")
+    elif rng.random() < 0.3:
+        parts.append("NOSIG")
+    return " ".join(parts) + "="
+
+
+def report_times(begin, end, step=30):
+    '''Report times from begin to end inclusive, on step-minute boundaries.'''
+    t = begin.replace(second=0, microsecond=0)
+    t += timedelta(minutes=-t.minute % step)
+    while t <= end:
+        yield t
+        t += timedelta(minutes=step)
+
+
+def getmetar_lines(stations, begin, end, step=30):
+    '''Yields "icao,YYYY,mm,dd,HH,MM,METAR..." lines as Ogimet's getmetar gives them.'''
+    for station in stations:
+        for t in report_times(begin, end, step):
+            yield f"{station},{t:%Y,%m,%d,%H,%M},{metar_body(station, t)}"
+
+
+def raw_metars(stations, begin, end, step=30):
+    '''Yields reports in the "YYYYmmddHHMM METAR..." form Metar parses.'''
+    for station in stations:
+        for t in report_times(begin, end, step):
+            yield f"{t:%Y%m%d%H%M} {metar_body(station, t)}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output", help="CSV file to write in getmetar format")
+    parser.add_argument("--stations", default="EGKA")
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--start", default="2020-01-01", help="first day, YYYY-mm-dd")
+    args = parser.parse_args()
+
+    begin = datetime.fromisoformat(args.start)
+    end = begin.replace(year=begin.year + args.years) - timedelta(minutes=1)
+    count = 0
+    with open(args.output, "w") as f:
+        for line in getmetar_lines(args.stations.split(","), begin, end):
+            f.write(line + "\n")
+            count += 1
+    print(f"Wrote {count} reports to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,45 @@
 import time
-from ogimet_model import Metar
-from ogimet_utils import create_db
-from metar_fetcher import fetch_metars
+from datetime import datetime
+from metar_db import get_connection
+from metar_fetcher import fill_cache
+from metar_batch import MetarBatch
+from metar_eval import failure_masks, failure_bits, evaluate_vfr
+from metar_rulesets import resolve_ruleset
+from metar_rollup import refresh_rollup, rollup_rulesets
+from metar_pipeline import read_analysis_stage, aggregate, FlyableCounter, FailureCounter
+from metar_time import to_epoch_minutes, from_epoch_minutes
+from metar_stations import DAYLIGHT, station_utc_windows
+import metar_metrics
 
+INSERT_ANALYSIS_SQL = """
+    INSERT OR REPLACE INTO metar_analysis (
+        station, time, ruleset, ruleset_version, vfr, flyable, failed
+    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
 
-def analyze_metars(ruleset="default", station='EGKA', start_date="01-01-2024", end_date="31-12-2024", local_start_hour=8, local_end_hour=18, local_start_hour_summer=8, local_end_hour_summer=20):
+
+def analyze_metars(ruleset="default", station='EGKA', start_date="01-01-2024", end_date="31-12-2024", local_start_hour=8, local_end_hour=18, local_start_hour_summer=8, local_end_hour_summer=20, conn=None, limiter=None, daylight=False):
     start_time = time.time()
+    if conn is None:
+        conn = get_connection()
+    ruleset = resolve_ruleset(conn, ruleset)
+
+    start = datetime.strptime(start_date, "%d-%m-%Y")
+    end = datetime.strptime(end_date, "%d-%m-%Y")
+    hours = DAYLIGHT if daylight else (local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer)
+    windows = station_utc_windows(station, start, end, hours)
+    if not windows:
+        raise ValueError(f"No days from {start_date} to {end_date}")
+
+    with metar_metrics.timer("analyze.fetch"):
+        fill_cache(conn, station, windows, limiter=limiter)
+    with metar_metrics.timer("analyze.evaluate"):
+        update_analysis(conn, station, windows[0][0], windows[-1][1], ruleset)
+    with metar_metrics.timer("analyze.aggregate"):
+        counts = aggregate_analysis(conn, station, windows, ruleset)
 
-    fetched_metars = fetch_metars(
-        station=station,
-        start_date=start_date,
-        end_date=end_date,
-        local_start_hour=local_start_hour,
-        local_end_hour=local_end_hour,
-        local_start_hour_summer=local_start_hour_summer,
-        local_end_hour_summer=local_end_hour_summer
-    )
-
-    flyable_count = 0
-    nonflyable_count = 0
-    for metar in fetched_metars:
-
-        if metar.is_flyable(
-            min_visibility=8000,
-            min_ceiling=1500,
-            max_wind_speed=14,
-            min_base=1000,
-            max_wind_gust=25,
-            min_temperature=1,
-            max_temperature=30,
-            bad_weather=["FZFG", "+TSRA", "TS",
-                         "TSRA", "BR", "HZ", "FG", "GR", "GS"]
-        ) == True:
-            flyable_count += 1
-        else:
-            nonflyable_count += 1
+    flyable_count = counts["flyable"]
+    nonflyable_count = counts["total"] - flyable_count
     end_time = time.time()
     print(
         f"\nFor the period {start_date} to {end_date} at {station}, the following analysis was made:")
@@ -42,47 +47,129 @@ def analyze_metars(ruleset="default", station='EGKA', start_date="01-01-2024", e
         f"Total METARs analyzed in {end_time-start_time:.2f} seconds: {flyable_count + nonflyable_count}")
     # print(
     #     f"Flyable METARs: {flyable_count}, Non-flyable METARs: {nonflyable_count}")
+    print("METARs failing each criterion: " +
+          ", ".join(f"{criterion} {count}" for criterion, count in counts["failures"].items()))
     print(
         f'This means that {flyable_count / (flyable_count + nonflyable_count) * 100:.2f}% of the METARs were flyable.\n')
+    if metar_metrics.enabled:
+        metar_metrics.print_summary()
 
 
-def save_metar_analysis(conn, metar_objs, ruleset="default"):
-    conn = create_db()
+def evaluate_batch(batch, ruleset):
+    '''
+    Evaluates a ruleset over a MetarBatch.
+    :return: Tuple of (flyable, vfr, failed) arrays, failed holding the
+        metar_eval.FAILURE_BITS of the criteria each observation failed.'''
+    with metar_metrics.timer("eval"):
+        failed = failure_masks(batch, **ruleset.flyable)
+        bits = failure_bits(failed, len(batch))
+        vfr = evaluate_vfr(batch, **ruleset.vfr)
+    metar_metrics.count("eval.observations", len(batch))
+    return bits == 0, vfr, bits
+
+
+def _analysis_rows(batch, ruleset):
+    flyable, vfr, failed = evaluate_batch(batch, ruleset)
+    for i, minutes in enumerate(batch.time):
+        yield (
+            batch.station_codes[batch.station[i]],
+            minutes,
+            ruleset.name,
+            ruleset.version,
+            int(vfr[i]),
+            int(flyable[i]),
+            int(failed[i])
+        )
+
+
+def update_analysis(conn, station, start_dt, end_dt, ruleset, chunk_size=5000):
+    '''
+    Evaluates a ruleset for every stored METAR of a station in
+    [start_dt, end_dt] that has no cached result for that ruleset version
+    yet, and caches the results in metar_analysis, refreshing the hourly
+    rollups of the days they fall on. Works through the range chunk_size
+    observations at a time.
+    :return: Number of observations evaluated.'''
     c = conn.cursor()
-    for m in metar_objs:
-        try:
+    evaluated = 0
+    after = to_epoch_minutes(start_dt) - 1
+    end = to_epoch_minutes(end_dt)
+    while True:
+        with metar_metrics.timer("db.query"):
             c.execute("""
-                INSERT OR REPLACE INTO metar_analysis (
-                    station, obs_time, vfr, flyable, ruleset
-                ) VALUES (?, ?, ?, ?, ?)
-            """, (
-                m.station,
-                m.time.isoformat(),
-                int(m.is_vfr()),
-                int(m.is_flyable()),
-                ruleset
-            ))
-        except Exception as e:
-            print(f"Error saving analysis: {m.raw} -> {e}")
-    conn.commit()
+                SELECT m.* FROM metars m
+                LEFT JOIN metar_analysis a
+                    ON a.station = m.station AND a.ruleset = ? AND a.ruleset_version = ? AND a.time = m.time
+                WHERE m.station = ? AND m.time > ? AND m.time <= ? AND a.time IS NULL
+                ORDER BY m.time
+                LIMIT ?
+            """, (ruleset.name, ruleset.version, station, after, end, chunk_size))
+            rows = c.fetchall()
+        if not rows:
+            break
+        batch = MetarBatch.from_db_rows(rows, keep_raw=False)
+        with conn:
+            c.executemany(INSERT_ANALYSIS_SQL, _analysis_rows(batch, ruleset))
+            refresh_rollup(conn, station, ruleset, rows[0]["time"], rows[-1]["time"])
+        evaluated += len(rows)
+        after = rows[-1]["time"]
+    return evaluated
+
+
+def extend_spans(spans, station, minutes):
+    '''Widens spans[station], a [first, last] epoch-minute pair, to take in minutes.'''
+    span = spans.get(station)
+    if span is None:
+        spans[station] = [minutes, minutes]
+    elif minutes < span[0]:
+        span[0] = minutes
+    elif minutes > span[1]:
+        span[1] = minutes
+
+
+def analyse_ingested(conn, spans):
+    '''
+    Keeps the rollups current as METARs are ingested: evaluates the stored
+    reports in each station's [first, last] span (epoch minutes, see
+    extend_spans) with every ruleset version the station already has
+    rollups for, which refreshes them. Reports evaluated before are skipped,
+    and stations never analysed are left for update_analysis.
+    :return: Number of observations evaluated.'''
+    evaluated = 0
+    for station, (first, last) in spans.items():
+        for ruleset in rollup_rulesets(conn, station):
+            evaluated += update_analysis(conn, station, from_epoch_minutes(first), from_epoch_minutes(last), ruleset)
+    return evaluated
+
+
+def aggregate_analysis(conn, station, windows, ruleset):
+    '''
+    Counts cached results for a station inside the given UTC windows,
+    streaming them from metar_analysis through running aggregators.
+    :return: Dict with total, flyable and vfr counts and failures, the number
+        of observations failing each criterion of the ruleset.'''
+    return aggregate(read_analysis_stage(conn, station, windows, ruleset),
+                     [FlyableCounter(), FailureCounter(ruleset)])
+
+
+def save_metar_analysis(conn, metar_objs, ruleset="default"):
+    '''Evaluates a ruleset for the given Metar objects and caches the results.'''
+    ruleset = resolve_ruleset(conn, ruleset)
+    batch = MetarBatch.from_metars(metar_objs, keep_raw=False)
+    c = conn.cursor()
+    with conn:
+        c.executemany(INSERT_ANALYSIS_SQL, _analysis_rows(batch, ruleset))
+        spans = {}
+        for code, minutes in zip(batch.station, batch.time):
+            first, last = spans.get(code, (minutes, minutes))
+            spans[code] = (min(first, minutes), max(last, minutes))
+        for code, (first, last) in spans.items():
+            refresh_rollup(conn, batch.station_codes[code], ruleset, first, last)
 
 
 if __name__ == "__main__":
-    analyze_metars(start_date="1-12-2016",
-                   end_date="30-11-2017", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2017",
-    #                end_date="30-11-2018", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2018",
-    #                end_date="30-11-2019", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2019",
-    #                end_date="30-11-2020", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2020",
-    #                end_date="30-11-2021", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2021",
-    #                end_date="30-11-2022", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2022",
-    #                end_date="30-11-2023", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2023",
-    #                end_date="30-11-2024", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
-    # analyze_metars(start_date="1-12-2024",
-    #                end_date="28-5-2025", station="EGKA", local_start_hour=9, local_end_hour=17, local_start_hour_summer=9, local_end_hour_summer=19)
+    # December-to-November years for EGKA up to the end of May 2025, fetched,
+    # read and evaluated in one pass
+    from metar_runner import run_matrix, yearly_periods, print_results
+    periods = yearly_periods(2016, 2023, month=12) + [("01-12-2024", "28-05-2025")]
+    print_results(run_matrix(["EGKA"], periods, hours=(9, 17, 9, 19)))
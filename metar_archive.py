@@ -0,0 +1,261 @@
+import argparse
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta
+from ogimet_model import Metar
+from ogimet_utils import save_metar_rows_bulk
+from metar_rulesets import get_ruleset
+from metar_rollup import refresh_rollup
+from metar_time import to_epoch_minutes
+import metar_metrics
+
+# Each partition is <root>/<station>/<YYYYMM>.dat, a sequence of zlib
+# blocks of newline-separated "YYYYmmddHHMM METAR ..." reports sorted by
+# time, and <YYYYMM>.idx, one INDEX_RECORD per block. Blocks are only ever
+# appended; the data is written before its index record, so an interrupted
+# append leaves unreferenced bytes rather than a broken partition.
+INDEX_RECORD = struct.Struct("<iiQII")  # first minute, last minute, offset, length, reports
+BLOCK_REPORTS = 512
+COMPRESSION_LEVEL = 6
+
+_default_root = None
+
+
+def set_archive_root(path):
+    '''Turns archiving of fetched and ingested reports on (or off with None).'''
+    global _default_root
+    _default_root = path
+
+
+def archive_root():
+    '''The configured archive directory, from set_archive_root or METAR_ARCHIVE, or None.'''
+    return _default_root or os.environ.get("METAR_ARCHIVE") or None
+
+
+def default_archive():
+    root = archive_root()
+    return MetarArchive(root) if root else None
+
+
+def _minutes(stamp):
+    return to_epoch_minutes(datetime(int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                                     int(stamp[8:10]), int(stamp[10:12])))
+
+
+class MetarArchive:
+    '''
+    Append-only store of raw reports, partitioned by station and month and
+    compressed in blocks. Reads only decompress the blocks whose time range
+    overlaps the request, straight out of a memory map.'''
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def _paths(self, station, month):
+        base = os.path.join(self.root, station, month)
+        return base + ".dat", base + ".idx"
+
+    def _index(self, index_path):
+        try:
+            with open(index_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return []
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        return list(INDEX_RECORD.iter_unpack(data[:usable]))
+
+    def append(self, reports):
+        '''
+        Adds reports given as (station, raw) pairs, raw in the
+        "YYYYmmddHHMM METAR ..." form. Reports already in the archive are
+        skipped. Returns the number added.'''
+        partitions = {}
+        for station, raw in reports:
+            partitions.setdefault((station, raw[:6]), {})[raw[:12]] = raw
+        added = 0
+        with self.lock, metar_metrics.timer("archive.append"):
+            for (station, month), by_stamp in partitions.items():
+                added += self._append_partition(station, month, by_stamp)
+        metar_metrics.count("archive.reports_added", added)
+        return added
+
+    def _append_partition(self, station, month, by_stamp):
+        data_path, index_path = self._paths(station, month)
+        stamps = sorted(by_stamp)
+        first, last = _minutes(stamps[0]), _minutes(stamps[-1])
+        index = self._index(index_path)
+        overlapping = [block for block in index if block[0] <= last and block[1] >= first]
+        if overlapping:
+            existing = {stamp for block in overlapping for stamp, _ in self._read_block(data_path, block)}
+            stamps = [stamp for stamp in stamps if stamp not in existing]
+            if not stamps:
+                return 0
+
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        records = []
+        with open(data_path, "ab") as f:
+            offset = f.tell()
+            for i in range(0, len(stamps), BLOCK_REPORTS):
+                block = stamps[i:i + BLOCK_REPORTS]
+                payload = zlib.compress("\n".join(by_stamp[s] for s in block).encode(), COMPRESSION_LEVEL)
+                f.write(payload)
+                records.append(INDEX_RECORD.pack(_minutes(block[0]), _minutes(block[-1]), offset,
+                                                 len(payload), len(block)))
+                offset += len(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(index_path, "ab") as f:
+            f.write(b"".join(records))
+        return len(stamps)
+
+    def _read_block(self, data_path, block):
+        _, _, offset, length, _ = block
+        with open(data_path, "rb") as f:
+            f.seek(offset)
+            return self._decode(f.read(length))
+
+    def _decode(self, payload):
+        return [(line[:12], line[13:]) for line in zlib.decompress(payload).decode().split("\n")]
+
+    def stations(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def months(self, station):
+        '''The YYYYMM partitions stored for a station, in order.'''
+        directory = os.path.join(self.root, station)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-4] for name in os.listdir(directory) if name.endswith(".idx"))
+
+    def iter_reports(self, station, start_dt=None, end_dt=None):
+        '''
+        Yields (stamp, body) for a station's reports in [start_dt, end_dt],
+        partition by partition. Within a partition reports come in time order
+        when they were appended in order, which is the usual case.'''
+        start = f"{start_dt:%Y%m%d%H%M}" if start_dt is not None else "000000000000"
+        end = f"{end_dt:%Y%m%d%H%M}" if end_dt is not None else "999999999999"
+        first = _minutes(start) if start_dt is not None else None
+        last = _minutes(end) if end_dt is not None else None
+        for month in self.months(station):
+            if month < start[:6] or month > end[:6]:
+                continue
+            data_path, index_path = self._paths(station, month)
+            blocks = [block for block in self._index(index_path)
+                      if (first is None or block[1] >= first) and (last is None or block[0] <= last)]
+            if not blocks:
+                continue
+            with open(data_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for _, _, offset, length, _ in blocks:
+                        # Decompresses straight from the mapped pages, no copy of the block
+                        for stamp, body in self._decode(view[offset:offset + length]):
+                            if start <= stamp <= end:
+                                yield stamp, body
+                finally:
+                    view.release()
+
+    def iter_raw(self, station, start_dt=None, end_dt=None):
+        '''Same as iter_reports, giving "YYYYmmddHHMM METAR ..." strings.'''
+        for stamp, body in self.iter_reports(station, start_dt, end_dt):
+            yield f"{stamp} {body}"
+
+    def import_db(self, conn, stations=None, chunk_size=10000):
+        '''Copies the raw column of the metars table into the archive.'''
+        c = conn.cursor()
+        if stations is None:
+            c.execute("SELECT DISTINCT station FROM metars")
+            stations = [row[0] for row in c.fetchall()]
+        added = 0
+        for station in stations:
+            c.execute("SELECT station, raw FROM metars WHERE station = ? AND raw IS NOT NULL ORDER BY time",
+                      (station,))
+            for rows in iter(lambda: c.fetchmany(chunk_size), []):
+                added += self.append((row[0], row[1]) for row in rows)
+        return added
+
+    def rebuild_metars(self, conn, stations=None, start_dt=None, end_dt=None, batch_size=5000):
+        '''
+        Re-parses archived reports with the current Metar parser and writes
+        them over the parsed rows in the metars table. Cached analysis
+        results for the rebuilt partitions are dropped, with their rollups,
+        so the next analysis re-evaluates them.
+        :return: Dict with parsed and failed counts.'''
+        totals = {"parsed": 0, "failed": 0}
+        for station in stations or self.stations():
+            for month in self.months(station):
+                rows = []
+                for stamp, body in self._month_reports(station, month, start_dt, end_dt):
+                    try:
+                        rows.append(Metar.from_parts(stamp, body).to_db_row())
+                    except Exception:
+                        totals["failed"] += 1
+                if not rows:
+                    continue
+                save_metar_rows_bulk(conn, rows, batch_size, replace=True)
+                totals["parsed"] += len(rows)
+                self._invalidate_analysis(conn, station, min(r[1] for r in rows), max(r[1] for r in rows))
+        return totals
+
+    def _month_reports(self, station, month, start_dt, end_dt):
+        month_start = datetime(int(month[:4]), int(month[4:]), 1)
+        month_end = datetime(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1) \
+            - timedelta(minutes=1)
+        begin = max(start_dt, month_start) if start_dt is not None else month_start
+        end = min(end_dt, month_end) if end_dt is not None else month_end
+        if begin > end:
+            return iter(())
+        return self.iter_reports(station, begin, end)
+
+    def _invalidate_analysis(self, conn, station, first, last):
+        c = conn.cursor()
+        c.execute("""
+            SELECT DISTINCT ruleset, ruleset_version FROM metar_analysis
+            WHERE station = ? AND time BETWEEN ? AND ?
+        """, (station, first, last))
+        rulesets = [get_ruleset(conn, name, version) for name, version in c.fetchall()]
+        with conn:
+            c.execute("DELETE FROM metar_analysis WHERE station = ? AND time BETWEEN ? AND ?",
+                      (station, first, last))
+            for ruleset in rulesets:
+                refresh_rollup(conn, station, ruleset, first, last)
+
+    def nbytes(self):
+        '''Total size of the archive files on disk.'''
+        total = 0
+        for directory, _, files in os.walk(self.root):
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+        return total
+
+
+def main():
+    from metar_db import get_connection
+
+    parser = argparse.ArgumentParser(description="Raw METAR archive maintenance")
+    parser.add_argument("command", choices=["import-db", "rebuild"],
+                        help="import-db: archive the raw reports in the database; "
+                             "rebuild: re-parse the archive into the metars table")
+    parser.add_argument("--archive", default=archive_root() or "archive", help="archive directory")
+    parser.add_argument("--db", default=None, help="database file")
+    parser.add_argument("--stations", default=None, help="comma-separated stations (default: all)")
+    args = parser.parse_args()
+
+    archive = MetarArchive(args.archive)
+    conn = get_connection(args.db)
+    stations = args.stations.split(",") if args.stations else None
+    if args.command == "import-db":
+        added = archive.import_db(conn, stations)
+        print(f"Archived {added} reports, archive is now {archive.nbytes() / 1e6:.1f} MB")
+    else:
+        totals = archive.rebuild_metars(conn, stations)
+        print(f"Re-parsed {totals['parsed']} reports ({totals['failed']} failed)")
+
+
+if __name__ == "__main__":
+    main()
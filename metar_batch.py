@@ -0,0 +1,197 @@
+from array import array
+from ogimet_model import Metar, decode_clouds, decode_weather
+from metar_time import to_epoch_minutes, from_epoch_minutes
+
+# Stored in integer columns for a field the report did not have
+MISSING = -32768
+# wind_direction column value for variable wind
+VRB = -1
+
+_INT_COLUMNS = (
+    # name, typecode
+    ("time", "i"),
+    ("wind_direction", "h"),
+    ("wind_speed", "h"),
+    ("wind_gust", "h"),
+    ("visibility", "h"),
+    ("base", "i"),
+    ("ceiling", "i"),
+    ("temperature", "h"),
+    ("dewpoint", "h"),
+    ("qnh", "h"),
+)
+
+
+def _int_or_missing(value):
+    return MISSING if value is None else int(value)
+
+
+def _value_or_none(value):
+    return None if value == MISSING else value
+
+
+class MetarBatch:
+    '''
+    Columnar store for many METARs. Numeric fields live in typed arrays
+    (missing values are MISSING), time is in epoch minutes, and stations,
+    cloud layers and weather groups are interned so each row only holds a
+    small integer code for them. Indexing or iterating gives Metar views.
+    :param keep_raw: Keep the raw report strings. They dominate memory, so
+        leave this off when only the decoded fields are needed.'''
+
+    def __init__(self, keep_raw=True):
+        for name, typecode in _INT_COLUMNS:
+            setattr(self, name, array(typecode))
+        self.station = array("H")
+        self.clouds = array("H")
+        self.weather = array("H")
+        self.raw = [] if keep_raw else None
+
+        self.station_codes = []
+        self.cloud_codes = [None]
+        self.weather_codes = [None]
+        self._station_index = {}
+        self._cloud_index = {None: 0}
+        self._weather_index = {None: 0}
+        # Cache of DB text -> interned code, so each distinct clouds/weather
+        # string is only decoded once
+        self._cloud_text_index = {None: 0}
+        self._weather_text_index = {None: 0}
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        wind_direction = self.wind_direction[i]
+        qnh = self.qnh[i]
+        m = Metar(raw=self.raw[i] if self.raw is not None else None, parse=False)
+        m.station = self.station_codes[self.station[i]]
+        m.time = from_epoch_minutes(self.time[i])
+        m.wind_direction = None if wind_direction == MISSING else (
+            "VRB" if wind_direction == VRB else f"{wind_direction:03d}")
+        m.wind_speed = _value_or_none(self.wind_speed[i])
+        m.wind_gust = _value_or_none(self.wind_gust[i])
+        m.visibility = _value_or_none(self.visibility[i])
+        clouds = self.cloud_codes[self.clouds[i]]
+        m.clouds = list(clouds) if clouds is not None else None
+        m.base = _value_or_none(self.base[i])
+        m.ceiling = _value_or_none(self.ceiling[i])
+        weather = self.weather_codes[self.weather[i]]
+        m.weather = list(weather) if weather is not None else None
+        m.qnh = _value_or_none(qnh)
+        m.temperature = _value_or_none(self.temperature[i])
+        m.dewpoint = _value_or_none(self.dewpoint[i])
+        return m
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _intern(self, value, index, codes):
+        code = index.get(value)
+        if code is None:
+            code = len(codes)
+            index[value] = code
+            codes.append(value)
+        return code
+
+    def _intern_text(self, text, decode, text_index, index, codes):
+        code = text_index.get(text)
+        if code is None:
+            value = decode(text)
+            code = self._intern(tuple(value) if value else None, index, codes)
+            text_index[text] = code
+        return code
+
+    def _append_values(self, station, minutes, raw, wind_direction, wind_speed, wind_gust, visibility,
+                       cloud_code, base, ceiling, weather_code, qnh, temperature, dewpoint):
+        self.station.append(self._intern(station, self._station_index, self.station_codes))
+        self.time.append(minutes)
+        if wind_direction is None:
+            self.wind_direction.append(MISSING)
+        else:
+            self.wind_direction.append(VRB if wind_direction == "VRB" else int(wind_direction))
+        self.wind_speed.append(_int_or_missing(wind_speed))
+        self.wind_gust.append(_int_or_missing(wind_gust))
+        self.visibility.append(_int_or_missing(visibility))
+        self.clouds.append(cloud_code)
+        self.base.append(_int_or_missing(base))
+        self.ceiling.append(_int_or_missing(ceiling))
+        self.weather.append(weather_code)
+        self.qnh.append(_int_or_missing(qnh))
+        self.temperature.append(_int_or_missing(temperature))
+        self.dewpoint.append(_int_or_missing(dewpoint))
+        if self.raw is not None:
+            self.raw.append(raw)
+
+    def append(self, metar):
+        clouds = tuple(tuple(layer) for layer in metar.clouds) if metar.clouds else None
+        weather = tuple(metar.weather) if metar.weather else None
+        self._append_values(
+            metar.station, to_epoch_minutes(metar.time), metar.raw, metar.wind_direction, metar.wind_speed,
+            metar.wind_gust, metar.visibility,
+            self._intern(clouds, self._cloud_index, self.cloud_codes),
+            metar.base, metar.ceiling,
+            self._intern(weather, self._weather_index, self.weather_codes),
+            metar.qnh, metar.temperature, metar.dewpoint)
+
+    def extend(self, metars):
+        for metar in metars:
+            self.append(metar)
+
+    def append_row(self, row):
+        '''
+        Appends a row in Metar.to_db_row order, e.g. from the parser workers in
+        metar_ingest, without building a Metar.'''
+        (station, time, raw, wind_direction, wind_speed, wind_gust, visibility,
+         clouds, ceiling, base, weather, qnh, temperature, dewpoint) = row
+        self._append_values(
+            station, time, raw, wind_direction, wind_speed, wind_gust, visibility,
+            self._intern_text(clouds, decode_clouds, self._cloud_text_index, self._cloud_index,
+                              self.cloud_codes),
+            base, ceiling,
+            self._intern_text(weather, decode_weather, self._weather_text_index, self._weather_index,
+                              self.weather_codes),
+            qnh, temperature, dewpoint)
+
+    def append_db_row(self, row):
+        '''Appends a sqlite3.Row from the metars table.'''
+        self._append_values(
+            row['station'], row['time'], row['raw'], row['wind_direction'],
+            row['wind_speed'], row['wind_gust'], row['visibility'],
+            self._intern_text(row['clouds'], decode_clouds, self._cloud_text_index, self._cloud_index,
+                              self.cloud_codes),
+            row['base'], row['ceiling'],
+            self._intern_text(row['weather'], decode_weather, self._weather_text_index, self._weather_index,
+                              self.weather_codes),
+            row['qnh'], row['temperature'], row['dewpoint'])
+
+    @classmethod
+    def from_metars(cls, metars, keep_raw=True):
+        batch = cls(keep_raw=keep_raw)
+        batch.extend(metars)
+        return batch
+
+    @classmethod
+    def from_rows(cls, rows, keep_raw=True):
+        batch = cls(keep_raw=keep_raw)
+        for row in rows:
+            batch.append_row(row)
+        return batch
+
+    @classmethod
+    def from_db_rows(cls, rows, keep_raw=True):
+        batch = cls(keep_raw=keep_raw)
+        for row in rows:
+            batch.append_db_row(row)
+        return batch
+
+    def nbytes(self):
+        '''Approximate size of the numeric and code columns in bytes.'''
+        total = 0
+        for name in [name for name, _ in _INT_COLUMNS] + ["station", "clouds", "weather"]:
+            column = getattr(self, name)
+            total += column.itemsize * len(column)
+        return total
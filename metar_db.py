@@ -0,0 +1,142 @@
+import os
+import sqlite3
+import threading
+import ogimet_utils
+
+# Used when no path is given; the METAR_DB environment variable overrides it
+DEFAULT_PATH = "metars.db"
+
+# Applied to every connection. WAL lets readers run alongside the writer,
+# and synchronous=NORMAL is safe with WAL (a crash can only lose the last
+# commits, never corrupt the file).
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    # Negative means KiB rather than pages
+    "cache_size": -32 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 10000,
+}
+
+_default_path = None
+_prepared = set()
+_prepare_lock = threading.Lock()
+
+
+def set_default_path(path):
+    '''Sets the database used by connect and get_connection when none is given.'''
+    global _default_path
+    _default_path = path
+
+
+def default_path():
+    return _default_path or os.environ.get("METAR_DB") or DEFAULT_PATH
+
+
+def _resolve(path):
+    return os.path.abspath(path or default_path())
+
+
+def prepare(path=None):
+    '''
+    Switches the database to WAL and brings its schema up to date. Only does
+    the work the first time a path is seen in this process.'''
+    path = _resolve(path)
+    if path in _prepared:
+        return path
+    with _prepare_lock:
+        if path not in _prepared:
+            conn = sqlite3.connect(path)
+            conn.row_factory = sqlite3.Row
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                ogimet_utils.migrate_db(conn)
+            finally:
+                conn.close()
+            _prepared.add(path)
+    return path
+
+
+def connect(path=None, readonly=False, check_same_thread=True):
+    '''
+    Opens a new tuned connection, setting up the schema on first use.
+    :param readonly: Open the file read-only, for analysis workers that only
+        read. Any write on such a connection raises sqlite3.OperationalError.
+        The file is used as it is: it must exist, and is neither migrated
+        nor switched to WAL, so prepare it from a read-write connection first.'''
+    if readonly:
+        path = _resolve(path)
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=check_same_thread)
+    else:
+        path = prepare(path)
+        conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    if readonly:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+class ConnectionPool:
+    '''
+    One connection per thread to one database, opened on first use and reused
+    after that. sqlite3 connections must not be shared between threads, and
+    after a fork the child opens its own rather than reusing the parent's.'''
+
+    def __init__(self, path=None, readonly=False):
+        self.path = _resolve(path)
+        self.readonly = readonly
+        self.lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.connections = []
+
+    def get(self):
+        if self.pid != os.getpid():
+            self._reset()
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Each connection is only used by its own thread, but close_all
+            # may run on another one
+            conn = connect(self.path, readonly=self.readonly, check_same_thread=False)
+            self.local.conn = conn
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def close_all(self):
+        '''Closes every connection the pool opened. Only call once no thread uses them.'''
+        with self.lock:
+            connections, self.connections = self.connections, []
+        for conn in connections:
+            conn.close()
+        self.local = threading.local()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection(path=None, readonly=False):
+    '''
+    The calling thread's shared connection to the database, from a pool per
+    (path, readonly). Use this instead of opening a connection per call.'''
+    key = (_resolve(path), readonly)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(key, ConnectionPool(*key))
+    return pool.get()
+
+
+def close_all():
+    '''Closes every pooled connection, e.g. before the program exits.'''
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
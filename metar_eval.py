@@ -0,0 +1,114 @@
+import numpy as np
+from metar_batch import MISSING
+
+# is_flyable criteria, with the column each one checks and the comparison
+# a present value has to pass
+CRITERIA = {
+    "min_visibility": ("visibility", np.greater_equal),
+    "min_ceiling": ("ceiling", np.greater_equal),
+    "min_base": ("base", np.greater_equal),
+    "max_wind_speed": ("wind_speed", np.less_equal),
+    "max_wind_gust": ("wind_gust", np.less_equal),
+    "bad_weather": ("weather", None),
+    "min_temperature": ("temperature", np.greater_equal),
+    "max_temperature": ("temperature", np.less_equal),
+}
+
+# Bit of each criterion in the failed column of metar_analysis
+FAILURE_BITS = {criterion: 1 << i for i, criterion in enumerate(CRITERIA)}
+
+
+def column(batch, name):
+    '''Zero-copy NumPy view of one of the batch's array columns.'''
+    values = getattr(batch, name)
+    kind = "u" if values.typecode.isupper() else "i"
+    return np.frombuffer(values, dtype=f"{kind}{values.itemsize}")
+
+
+def weather_masks(batch):
+    '''
+    Gives every distinct weather group in the batch a bit and returns
+    (bits, masks): the group -> bit mapping, and for each interned weather
+    code the OR of its groups' bits.'''
+    bits = {}
+    masks = []
+    for groups in batch.weather_codes:
+        mask = 0
+        for group in groups or ():
+            if group not in bits:
+                bits[group] = 1 << len(bits)
+            mask |= bits[group]
+        masks.append(mask)
+    return bits, masks
+
+
+def _bad_weather_mask(batch, bad_weather, masks=None):
+    if masks is None:
+        masks = weather_masks(batch)
+    bits, code_masks = masks
+    bad = 0
+    for group in bad_weather:
+        bad |= bits.get(group, 0)
+    bad_codes = np.fromiter(((m & bad) != 0 for m in code_masks), dtype=bool, count=len(code_masks))
+    return bad_codes[column(batch, "weather")]
+
+
+def failure_masks(batch, weather=None, **kwargs):
+    '''
+    Evaluates each is_flyable criterion given in kwargs over the whole batch.
+    :param weather: Result of weather_masks(batch), to reuse across rulesets.
+    :return: Dict of criterion -> boolean array, True where the observation
+        fails that criterion. Missing values never fail, as in is_flyable.'''
+    failed = {}
+    for criterion, limit in kwargs.items():
+        if criterion not in CRITERIA:
+            raise TypeError(f"Unknown flyability criterion: {criterion}")
+        if limit is None:
+            continue
+        name, passes = CRITERIA[criterion]
+        if criterion == "bad_weather":
+            failed[criterion] = _bad_weather_mask(batch, limit, weather)
+        else:
+            values = column(batch, name)
+            failed[criterion] = (values != MISSING) & ~passes(values, limit)
+    return failed
+
+
+def evaluate_flyable(batch, weather=None, **kwargs):
+    '''
+    Vectorised Metar.is_flyable over a MetarBatch, taking the same keyword
+    arguments.
+    :return: Tuple of (flags, failures): a boolean array that is True for
+        flyable observations, and a dict of criterion -> number of
+        observations failing it.'''
+    failed = failure_masks(batch, weather=weather, **kwargs)
+    flags = np.ones(len(batch), dtype=bool)
+    for mask in failed.values():
+        flags &= ~mask
+    return flags, {criterion: int(mask.sum()) for criterion, mask in failed.items()}
+
+
+def failure_bits(failed, size):
+    '''
+    Packs a failure_masks result into one integer per observation, with the
+    FAILURE_BITS of every criterion it failed set.'''
+    bits = np.zeros(size, dtype=np.uint16)
+    for criterion, mask in failed.items():
+        bits[mask] |= FAILURE_BITS[criterion]
+    return bits
+
+
+def evaluate_vfr(batch, min_visibility=1500, min_ceiling=1500):
+    '''Vectorised Metar.is_vfr over a MetarBatch.'''
+    flags, _ = evaluate_flyable(batch, min_visibility=min_visibility, min_ceiling=min_ceiling)
+    return flags
+
+
+def evaluate_rulesets(batch, rulesets):
+    '''
+    Evaluates several rulesets over the same batch, sharing the weather
+    bitmasks.
+    :param rulesets: Dict of name -> is_flyable keyword arguments.
+    :return: Dict of name -> (flags, failures) as from evaluate_flyable.'''
+    weather = weather_masks(batch)
+    return {name: evaluate_flyable(batch, weather=weather, **rules) for name, rules in rulesets.items()}
@@ -0,0 +1,263 @@
+import argparse
+import os
+from datetime import datetime, timezone
+from metar_time import to_epoch_minutes
+
+# pyarrow is only needed here, so it is imported on first use and the rest
+# of the package works without it
+_pa = None
+
+DATASETS = ("metars", "analysis")
+
+METAR_COLUMNS = ("time", "raw", "wind_direction", "wind_speed", "wind_gust", "visibility", "clouds",
+                 "base", "ceiling", "weather", "qnh", "temperature", "dewpoint")
+ANALYSIS_COLUMNS = ("time", "ruleset", "ruleset_version", "vfr", "flyable", "failed")
+
+# UTC year of an epoch-minutes time column, for grouping rows by year
+_YEAR_SQL = "CAST(strftime('%Y', time * 60, 'unixepoch') AS INTEGER)"
+
+
+def _arrow():
+    global _pa
+    if _pa is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.dataset
+            import pyarrow.fs
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("metar_export needs pyarrow: pip install pyarrow") from None
+        _pa = pyarrow
+    return _pa
+
+
+def _schema(dataset, raw=False):
+    pa = _arrow()
+    if dataset == "analysis":
+        return pa.schema([
+            ("time", pa.timestamp("s")),
+            ("ruleset", pa.dictionary(pa.int16(), pa.string())),
+            ("ruleset_version", pa.int32()),
+            ("vfr", pa.bool_()),
+            ("flyable", pa.bool_()),
+            ("failed", pa.int32()),
+        ])
+    fields = [
+        ("time", pa.timestamp("s")),
+        ("wind_direction", pa.string()),
+        ("wind_speed", pa.int16()),
+        ("wind_gust", pa.int16()),
+        ("visibility", pa.int16()),
+        ("clouds", pa.string()),
+        ("base", pa.int32()),
+        ("ceiling", pa.int32()),
+        ("weather", pa.string()),
+        ("qnh", pa.int16()),
+        ("temperature", pa.int16()),
+        ("dewpoint", pa.int16()),
+    ]
+    if raw:
+        fields.insert(1, ("raw", pa.string()))
+    return pa.schema(fields)
+
+
+def _year_bounds(year):
+    return to_epoch_minutes(datetime(year, 1, 1)), to_epoch_minutes(datetime(year + 1, 1, 1)) - 1
+
+
+def partition_path(target, dataset, station, year):
+    '''Directory of one station-year, in the hive layout pyarrow.dataset reads partition keys from.'''
+    return os.path.join(target, dataset, f"station={station}", f"year={year}")
+
+
+def _current_partitions(conn, dataset, stations=None):
+    # (station, year) -> (rows, last_time) for what the database holds now
+    table = "metar_analysis" if dataset == "analysis" else "metars"
+    c = conn.cursor()
+    sql = f"SELECT station, {_YEAR_SQL} AS year, COUNT(*), MAX(time) FROM {table}"
+    params = ()
+    if stations:
+        sql += f" WHERE station IN ({', '.join('?' * len(stations))})"
+        params = tuple(stations)
+    c.execute(sql + " GROUP BY station, year", params)
+    return {(row[0], row[1]): (row[2], row[3]) for row in c.fetchall()}
+
+
+def _exported_partitions(conn, target, dataset):
+    # (station, year) -> (rows, last_time, raw) as last written to target
+    c = conn.cursor()
+    c.execute("""
+        SELECT station, year, rows, last_time, raw FROM metar_export_state WHERE target = ? AND dataset = ?
+    """, (target, dataset))
+    return {(row[0], row[1]): (row[2], row[3], bool(row[4])) for row in c.fetchall()}
+
+
+def _read_partition(conn, dataset, station, year, raw=False):
+    pa = _arrow()
+    first, last = _year_bounds(year)
+    c = conn.cursor()
+    if dataset == "analysis":
+        columns = ANALYSIS_COLUMNS
+        c.execute(f"""
+            SELECT {', '.join(columns)} FROM metar_analysis
+            WHERE station = ? AND time BETWEEN ? AND ?
+            ORDER BY ruleset, ruleset_version, time
+        """, (station, first, last))
+    else:
+        columns = [name for name in METAR_COLUMNS if raw or name != "raw"]
+        c.execute(f"""
+            SELECT {', '.join(columns)} FROM metars
+            WHERE station = ? AND time BETWEEN ? AND ?
+            ORDER BY time
+        """, (station, first, last))
+    rows = c.fetchall()
+    schema = _schema(dataset, raw)
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    arrays = []
+    for name, column in zip(columns, values):
+        field = schema.field(name)
+        if name == "time":
+            minutes = pa.array(column, pa.int64())
+            arrays.append(pa.compute.multiply(minutes, 60).cast(field.type))
+        elif pa.types.is_boolean(field.type):
+            arrays.append(pa.array(column, pa.int8()).cast(field.type))
+        elif pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(column, pa.string()).dictionary_encode())
+        else:
+            arrays.append(pa.array(column, field.type))
+    return pa.Table.from_arrays(arrays, schema=schema), len(rows)
+
+
+def _write_partition(table, directory):
+    pa = _arrow()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "part-0.parquet")
+    # Written next to the old file and swapped in, so readers never see half
+    # a file; dataset discovery skips names starting with "_"
+    tmp = os.path.join(directory, "_part-0.parquet.tmp")
+    pa.parquet.write_table(table, tmp, compression="zstd", row_group_size=65536)
+    os.replace(tmp, path)
+
+
+def export(conn, target, datasets=("metars",), stations=None, full=False, raw=False):
+    '''
+    Writes the metars table, and with "analysis" in datasets the cached
+    analysis results, to Parquet under target, one file per station and UTC
+    year (target/<dataset>/station=XXXX/year=YYYY/). Only station-years whose
+    row count or latest time changed since the last export to target, or
+    that were written with a different raw setting, are rewritten, unless
+    full=True; use full=True after rows were rewritten in place, e.g. by
+    MetarArchive.rebuild_metars.
+    :param raw: Include the raw report text in the metars files.
+    :return: Dict of dataset -> (partitions written, rows written).'''
+    target = os.path.abspath(target)
+    written = {}
+    for dataset in datasets:
+        if dataset not in DATASETS:
+            raise ValueError(f"Unknown dataset {dataset!r}, expected one of {DATASETS}")
+        current = _current_partitions(conn, dataset, stations)
+        exported = {} if full else _exported_partitions(conn, target, dataset)
+        with_raw = raw and dataset == "metars"
+        partitions = rows = 0
+        for (station, year), state in sorted(current.items()):
+            if exported.get((station, year)) == state + (with_raw,):
+                continue
+            table, count = _read_partition(conn, dataset, station, year, raw)
+            _write_partition(table, partition_path(target, dataset, station, year))
+            with conn:
+                conn.execute("""
+                    INSERT OR REPLACE INTO metar_export_state
+                        (target, dataset, station, year, rows, last_time, exported, raw)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (target, dataset, station, year, state[0], state[1],
+                      datetime.now(timezone.utc).isoformat(timespec="seconds"), int(with_raw)))
+            partitions += 1
+            rows += count
+        written[dataset] = (partitions, rows)
+    return written
+
+
+def open_dataset(target, dataset="metars"):
+    '''
+    The exported files as a pyarrow Dataset, read through memory maps. The
+    raw column is always part of the metars schema, null in files written
+    without it, so exports with and without it can share a target.'''
+    pa = _arrow()
+    keys = pa.schema([("station", pa.string()), ("year", pa.int32())])
+    schema = pa.unify_schemas([_schema(dataset, raw=True), keys])
+    return pa.dataset.dataset(os.path.join(target, dataset), schema=schema, format="parquet",
+                              partitioning=pa.dataset.partitioning(keys, flavor="hive"),
+                              filesystem=pa.fs.LocalFileSystem(use_mmap=True))
+
+
+def _filter(stations, start_dt, end_dt):
+    pa = _arrow()
+    field = pa.dataset.field
+    conditions = []
+    if stations:
+        conditions.append(field("station").isin(list(stations)))
+    # The year conditions prune whole partitions, the time ones row groups
+    if start_dt is not None:
+        conditions.append(field("year") >= start_dt.year)
+        conditions.append(field("time") >= pa.scalar(start_dt, pa.timestamp("s")))
+    if end_dt is not None:
+        conditions.append(field("year") <= end_dt.year)
+        conditions.append(field("time") <= pa.scalar(end_dt, pa.timestamp("s")))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def load(target, dataset="metars", stations=None, start_dt=None, end_dt=None, columns=None, pandas=False):
+    '''
+    Loads exported rows for the given stations and UTC range [start_dt,
+    end_dt] as a pyarrow Table, or a pandas DataFrame with pandas=True. The
+    station and time conditions are pushed down into the scan, so only the
+    matching partitions and row groups are read.
+    :param columns: Optional list of columns to read; station and year are
+        the partition columns.'''
+    table = open_dataset(target, dataset).to_table(columns=columns, filter=_filter(stations, start_dt, end_dt))
+    return table.to_pandas() if pandas else table
+
+
+def load_metars(target, stations=None, start_dt=None, end_dt=None, columns=None, pandas=False):
+    return load(target, "metars", stations, start_dt, end_dt, columns, pandas)
+
+
+def load_analysis(target, stations=None, start_dt=None, end_dt=None, ruleset=None, pandas=False):
+    '''Like load_metars for the analysis results, optionally of one ruleset (name or Ruleset).'''
+    table = load(target, "analysis", stations, start_dt, end_dt)
+    if ruleset is not None:
+        pa = _arrow()
+        name = getattr(ruleset, "name", ruleset)
+        mask = pa.compute.equal(table["ruleset"].cast(pa.string()), name)
+        version = getattr(ruleset, "version", None)
+        if version is not None:
+            mask = pa.compute.and_(mask, pa.compute.equal(table["ruleset_version"], version))
+        table = table.filter(mask)
+    return table.to_pandas() if pandas else table
+
+
+def main():
+    from metar_db import get_connection
+
+    parser = argparse.ArgumentParser(description="Export parsed METARs to partitioned Parquet files")
+    parser.add_argument("target", help="export directory")
+    parser.add_argument("--db", default=None, help="database file")
+    parser.add_argument("--analysis", action="store_true", help="also export the cached analysis results")
+    parser.add_argument("--stations", default=None, help="comma-separated stations (default: all)")
+    parser.add_argument("--raw", action="store_true", help="include the raw report text")
+    parser.add_argument("--full", action="store_true", help="rewrite every partition, not only changed ones")
+    args = parser.parse_args()
+
+    conn = get_connection(args.db)
+    datasets = ("metars", "analysis") if args.analysis else ("metars",)
+    stations = args.stations.split(",") if args.stations else None
+    for dataset, (partitions, rows) in export(conn, args.target, datasets, stations, args.full, args.raw).items():
+        print(f"{dataset}: wrote {rows} rows to {partitions} station-year files")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,14 @@
-import pytz
 from datetime import datetime, timedelta
 from ogimet_model import Metar
 from ogimet_utils import (
-    create_db,
-    save_metars_from_objects,
-    get_cached_metars,
+    iter_metar_rows,
+    get_coverage,
 )
-import ogimet_cgi
+from metar_time import filter_to_windows, windows_to_epoch, window_gaps
+from metar_pipeline import ingest
+from metar_db import get_connection
+from metar_stations import DAYLIGHT, group_by_timezone, station_utc_windows
+import metar_metrics
 
 
 def merge_consecutive_metar_requests(requests):
@@ -27,24 +29,27 @@ def merge_consecutive_metar_requests(requests):
                 "end": end_dt
             }
         else:
-            # Check if the current request is consecutive with the last one
+            # Check if the current request is consecutive with the last one,
+            # i.e. starts within a day of its end
             if (req["icao"] == current["icao"] and
-                    end_dt <= current["end"] + timedelta(days=1)):
+                    begin_dt <= current["end"] + timedelta(days=1)):
                 # Extend the current group
                 if end_dt > current["end"]:
                     current["end"] = end_dt
-                if current["begin"] + timedelta(weeks=4) < current["end"]:
-                    # If the gap is too large, push the current group
+                while current["begin"] + timedelta(weeks=4) < current["end"]:
+                    # If the group is too long, push its first four weeks and
+                    # carry on from the minute after, so nothing is requested twice
+                    cut = current["begin"] + timedelta(weeks=4)
                     merged.append({
                         "icao": current["icao"],
                         "begin": current["begin"].strftime("%Y%m%d%H%M"),
-                        "end": current["end"].strftime("%Y%m%d%H%M"),
+                        "end": cut.strftime("%Y%m%d%H%M"),
                         "header": "no"
                     })
                     current = {
-                        "icao": req["icao"],
-                        "begin": begin_dt,
-                        "end": end_dt
+                        "icao": current["icao"],
+                        "begin": cut + timedelta(minutes=1),
+                        "end": current["end"]
                     }
             else:
                 # Push the current group and start a new one
@@ -72,84 +77,127 @@ def merge_consecutive_metar_requests(requests):
     return merged
 
 
-def fetch_metars(station, start_date, end_date, local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer):
-    list_of_metars = []
-    conn = create_db()
-    c = conn.cursor()
-    tz_local = pytz.timezone("Europe/London")
-    tz_utc = pytz.UTC
+def plan_station_requests(conn, station, windows):
+    '''
+    Returns the merged Ogimet requests needed to cover the not yet fetched
+    parts of a station's windows.'''
+    if not windows:
+        return []
+    covered = get_coverage(conn, station, windows[0][0], windows[-1][1])
+    requests = []
+    for gap_start, gap_end in window_gaps(windows, covered):
+        requests.append({
+            "icao": station,
+            "begin": gap_start.strftime("%Y%m%d%H%M"),
+            "end": gap_end.strftime("%Y%m%d%H%M"),
+            "header": "no"
+        })
+    if not requests:
+        return []
+    return merge_consecutive_metar_requests(requests)
+
+
+def print_progress(done, total, job, result):
+    name = job["icao"] or f"{job['state']} ({len(job['stations'])} stations)"
+    label = f"{name} {job['begin'][:8]}-{job['end'][:8]}"
+    if "error" in result:
+        print(f"[{done}/{total}] {label}: failed ({result['error']})")
+    else:
+        unparsed = f", {result['unparsed']} unparsable" if result.get("unparsed") else ""
+        print(f"[{done}/{total}] {label}: {result['inserted']} new, "
+              f"{result['ignored']} already cached{unparsed}, {result['seconds']:.1f}s")
+
+
+def fetch_jobs(conn, jobs, workers=4, limiter=None, retries=5, progress=print_progress):
+    '''
+    Runs Ogimet requests concurrently on a thread pool sharing one keep-alive
+    session and one rate limiter. Each job's reports are parsed and written to
+    the DB in batches, and its range recorded as covered, as soon as it
+    finishes; the DB is only touched from the calling thread.
+    :param jobs: Request dicts as returned by merge_consecutive_metar_requests.
+    :param limiter: ogimet_throttle.TokenBucket, shared if several calls run at once.
+    :param progress: Callback(done, total, job, result) or None.
+    :return: Dict of totals: jobs, inserted, ignored, unparsed and the list of failed jobs.'''
+    summary = {"jobs": len(jobs), "inserted": 0, "ignored": 0, "unparsed": 0, "failed": []}
+    if not jobs:
+        return summary
+    for done, (job, result) in enumerate(ingest(conn, jobs, workers, limiter, retries), start=1):
+        if "error" in result:
+            summary["failed"].append(job)
+        else:
+            summary["inserted"] += result["inserted"]
+            summary["ignored"] += result["ignored"]
+            summary["unparsed"] += result["unparsed"]
+        if progress is not None:
+            progress(done, len(jobs), job, result)
+    return summary
+
+
+def fetch_stations(stations, start_date, end_date, local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer, workers=4, limiter=None, conn=None, states=None, daylight=False):
+    '''
+    Fills the cache for several stations over the same period, running the
+    requests for all of them on one pool. Stations of the same state are
+    fetched together with state requests where metar_planner finds that
+    cheaper; states optionally maps stations to Ogimet state names. The
+    local hours are those of each station's time zone; with daylight=True
+    each station's sunrise to sunset is fetched instead.'''
+    from metar_planner import plan_requests
+
+    if conn is None:
+        conn = get_connection()
+    start = datetime.strptime(start_date, "%d-%m-%Y")
+    end = datetime.strptime(end_date, "%d-%m-%Y")
+    hours = DAYLIGHT if daylight else (local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer)
+    # Stations in one zone share their windows, but daylight differs per station
+    groups = {station: [station] for station in stations} if daylight else group_by_timezone(stations)
+    jobs = []
+    for members in groups.values():
+        windows = station_utc_windows(members[0], start, end, hours)
+        jobs.extend(plan_requests(conn, members, windows, states=states))
+    return fetch_jobs(conn, jobs, workers=workers, limiter=limiter)
+
+
+def fill_cache(conn, station, windows, workers=4, limiter=None):
+    '''Fetches whatever parts of a station's windows are not covered yet.'''
+    return fetch_jobs(conn, plan_station_requests(conn, station, windows), workers=workers, limiter=limiter)
+
+
+def iter_metars(station, start_date, end_date, local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer, conn=None, lazy=False, daylight=False):
+    '''
+    Like fetch_metars, but yields the METARs one at a time from a streamed
+    range read instead of building a list. With lazy=True each field group is
+    only decoded from its row when first read, for callers that need few.
+    With daylight=True the windows run from sunrise to sunset instead of
+    over the local hours (see metar_stations.daylight_windows).'''
+    if conn is None:
+        conn = get_connection()
 
     start = datetime.strptime(start_date, "%d-%m-%Y")
     end = datetime.strptime(end_date, "%d-%m-%Y")
 
-    # Build requests for each day
-    requests = []
-    for day in range((end - start).days + 1):
-        current_date = start + timedelta(days=day)
-        local_start = tz_local.localize(datetime(
-            current_date.year, current_date.month, current_date.day, local_start_hour))
-        local_end = tz_local.localize(datetime(
-            current_date.year, current_date.month, current_date.day, local_end_hour))
-
-        if local_start.dst() != timedelta(0):
-            local_start = local_start.replace(hour=local_start_hour_summer)
-            local_end = local_end.replace(hour=local_end_hour_summer)
-
-        utc_start = local_start.astimezone(tz_utc)
-        utc_end = local_end.astimezone(tz_utc)
-
-        # Only fetch if not cached
-        cached_raws = get_cached_metars(conn, station, utc_start, utc_end)
-        if not cached_raws:
-            requests.append({
-                "icao": station,
-                "begin": utc_start.strftime("%Y%m%d%H%M"),
-                "end": utc_end.strftime("%Y%m%d%H%M"),
-                "header": "no"
-            })
-    # Merge consecutive requests and fetch METARs from Ogimet
-    if requests:
-        merged_requests = merge_consecutive_metar_requests(requests)
-        for req in merged_requests:
-            print(
-                f"Fetching METARs for {req['icao']} from {req['begin'][:4]}-{req['begin'][4:6]}-{req['begin'][6:8]} to {req['end'][:4]}-{req['end'][4:6]}-{req['end'][6:8]}")
-            metars = ogimet_cgi.fetch_metar(
-                icao=req["icao"],
-                begin=req["begin"],
-                end=req["end"],
-                header=req["header"]
-            )
-
-            # Parse and save each METAR
-            for raw in metars:
-                metar = Metar(raw=raw, parse=True)
-                list_of_metars.append(metar)
-                save_metars_from_objects(conn, [metar])
-
-    # Now collect all metars for the requested period from the DB
-    for day in range((end - start).days + 1):
-        current_date = start + timedelta(days=day)
-        local_start = tz_local.localize(datetime(
-            current_date.year, current_date.month, current_date.day, local_start_hour))
-        local_end = tz_local.localize(datetime(
-            current_date.year, current_date.month, current_date.day, local_end_hour))
-
-        if local_start.dst() != timedelta(0):
-            local_start = local_start.replace(hour=local_start_hour_summer)
-            local_end = local_end.replace(hour=local_end_hour_summer)
-
-        utc_start = local_start.astimezone(tz_utc)
-        utc_end = local_end.astimezone(tz_utc)
-
-        c.execute("SELECT * FROM metars WHERE station = ? AND time BETWEEN ? AND ?",
-                  (station, utc_start.isoformat(), utc_end.isoformat()))
-        rows = c.fetchall()
-        for row in rows:
-            metar = Metar.from_db_row(row)
-            list_of_metars.append(metar)
-        # print(f"Fetched {len(rows)} METARs for {current_date.strftime('%Y-%m-%d')}")
-
-    return list_of_metars
+    # UTC intervals for the local hours of every day in the station's zone,
+    # sliced from the schedule cached per zone and year
+    hours = DAYLIGHT if daylight else (local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer)
+    windows = station_utc_windows(station, start, end, hours)
+    if not windows:
+        return
+
+    # Only request the parts of each window not already fetched, including
+    # windows that were fetched and turned out to be empty
+    fill_cache(conn, station, windows)
+
+    # Now collect all metars for the requested period from the DB in one
+    # range scan, keeping only rows inside the daily windows
+    rows = iter_metar_rows(conn, station, windows[0][0], windows[-1][1])
+    for row in filter_to_windows(rows, windows_to_epoch(windows), key=lambda r: r["time"]):
+        yield Metar.from_db_row(row, lazy=lazy)
+
+
+def fetch_metars(station, start_date, end_date, local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer, conn=None, lazy=False, daylight=False):
+    with metar_metrics.timer("fetch_metars"):
+        return list(iter_metars(station, start_date, end_date, local_start_hour, local_end_hour,
+                                local_start_hour_summer, local_end_hour_summer, conn=conn, lazy=lazy,
+                                daylight=daylight))
 
 # Example usage:
 # if __name__ == "__main__":
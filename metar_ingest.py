@@ -0,0 +1,158 @@
+import argparse
+import glob
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from ogimet_model import Metar
+from ogimet_cgi import parse_getmetar_line
+from ogimet_utils import save_metar_rows_bulk
+from metar_db import get_connection, default_path
+from metar_archive import default_archive, set_archive_root
+from metar_analysis import analyse_ingested, extend_spans
+import metar_metrics
+
+
+def _parse_chunk(lines):
+    # Runs in a worker process. Rows go back as plain tuples, which pickle far
+    # smaller and faster than Metar objects.
+    rows = []
+    failed = 0
+    for line in lines:
+        report = parse_getmetar_line(line.rstrip("\r\n"))
+        if report is None:
+            continue
+        try:
+            rows.append(Metar.from_parts(report[1], report[2]).to_db_row())
+        except Exception:
+            failed += 1
+    return rows, failed
+
+
+def _chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_many(lines, workers=None, chunk_size=5000):
+    '''
+    Parses raw getmetar CSV lines across a process pool.
+    :param lines: Iterable of "icao,year,month,day,hour,minute,metar" lines.
+    :param workers: Number of processes, defaults to the number of CPUs.
+        With 1 the lines are parsed in this process.
+    :param chunk_size: Lines handed to a worker at a time.
+    :return: Generator of (rows, failed) per chunk, in input order, where rows
+        are Metar.to_db_row tuples and failed counts unparseable reports.
+        At most two chunks per worker are in flight, so memory stays bounded
+        however large the input is.'''
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for chunk in _chunks(lines, chunk_size):
+            yield _parse_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for chunk in _chunks(lines, chunk_size):
+            pending.append(pool.submit(_parse_chunk, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def ingest_lines(conn, lines, workers=None, chunk_size=5000, archive=None, rollups=True):
+    '''
+    Parses getmetar CSV lines in parallel and bulk-writes them to the metars
+    table as each chunk comes back. Raw reports also go to archive, or to the
+    configured archive if there is one. With rollups, the new reports are
+    then evaluated with the rulesets their stations have rollups for
+    (metar_analysis.analyse_ingested), keeping the rollups current.
+    :return: Dict with parsed, failed, inserted and ignored counts.'''
+    archive = archive or default_archive()
+    totals = {"parsed": 0, "failed": 0, "inserted": 0, "ignored": 0}
+    spans = {}
+    for rows, failed in parse_many(lines, workers=workers, chunk_size=chunk_size):
+        if archive is not None:
+            archive.append((row[0], row[2]) for row in rows)
+        inserted, ignored = save_metar_rows_bulk(conn, rows)
+        if rollups and inserted:
+            for row in rows:
+                extend_spans(spans, row[0], row[1])
+        totals["parsed"] += len(rows)
+        totals["failed"] += failed
+        metar_metrics.count("ingest.parsed", len(rows))
+        metar_metrics.count("ingest.failed", failed)
+        totals["inserted"] += inserted
+        totals["ignored"] += ignored
+    if spans:
+        analyse_ingested(conn, spans)
+    return totals
+
+
+def ingest_archive_file(conn, path, workers=None, chunk_size=5000):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return ingest_lines(conn, f, workers=workers, chunk_size=chunk_size)
+
+
+def ingest_archive_dir(conn, paths, pattern="*.csv", workers=None, chunk_size=5000):
+    '''
+    Ingests every dump file given, expanding directories to the files in them
+    matching pattern. Prints one line per file.
+    :return: Dict of totals over all files.'''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            files.append(path)
+
+    totals = {"files": 0, "parsed": 0, "failed": 0, "inserted": 0, "ignored": 0}
+    for path in files:
+        started = time.perf_counter()
+        result = ingest_archive_file(conn, path, workers=workers, chunk_size=chunk_size)
+        seconds = time.perf_counter() - started
+        print(f"{path}: {result['parsed']} parsed ({result['failed']} failed), "
+              f"{result['inserted']} new, {result['ignored']} already stored, "
+              f"{result['parsed'] / seconds if seconds else 0:,.0f} reports/sec")
+        totals["files"] += 1
+        for key in result:
+            totals[key] += result[key]
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest raw Ogimet getmetar CSV dumps into the METAR database")
+    parser.add_argument("paths", nargs="+", help="dump files or directories of dump files")
+    parser.add_argument("--db", default=None, help=f"database file (default: {default_path()})")
+    parser.add_argument("--pattern", default="*.csv", help="file pattern used inside directories")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="lines per worker task")
+    parser.add_argument("--archive", metavar="DIR", help="also keep the raw reports in this archive directory")
+    parser.add_argument("--metrics", metavar="PATH", help="write a JSON timing summary")
+    parser.add_argument("--profile", metavar="PATH", help="write cProfile stats")
+    args = parser.parse_args()
+    if args.archive:
+        set_archive_root(args.archive)
+    if args.metrics or args.profile:
+        metar_metrics.enable(profile=bool(args.profile))
+
+    conn = get_connection(args.db)
+    totals = ingest_archive_dir(conn, args.paths, pattern=args.pattern,
+                                workers=args.workers, chunk_size=args.chunk_size)
+    print(f"Ingested {totals['files']} files: {totals['inserted']} new METARs, "
+          f"{totals['ignored']} already stored, {totals['failed']} failed to parse")
+    if args.profile:
+        metar_metrics.dump_profile(args.profile)
+    if args.metrics:
+        metar_metrics.write_summary(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
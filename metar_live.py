@@ -0,0 +1,230 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from metar_db import get_connection
+from metar_analysis import update_analysis
+from metar_eval import FAILURE_BITS
+from metar_fetcher import plan_station_requests
+from metar_pipeline import ingest
+from metar_rulesets import resolve_ruleset
+from metar_time import from_epoch_minutes, to_epoch_minutes
+from ogimet_throttle import TokenBucket
+import metar_metrics
+
+# Seconds between two polls of the same station
+DEFAULT_INTERVAL = 600
+# How far back to start for a station with nothing stored yet
+INITIAL_LOOKBACK = timedelta(hours=6)
+
+
+def latest_times(conn, stations):
+    '''Latest stored report time per station in epoch minutes, None if it has none.'''
+    c = conn.cursor()
+    latest = {}
+    for station in stations:
+        c.execute("SELECT MAX(time) FROM metars WHERE station = ?", (station,))
+        latest[station] = c.fetchone()[0]
+    return latest
+
+
+def _day_windows(begin, end):
+    # [begin, end] cut at UTC midnights, so the planner can skip covered days
+    # and merge the rest into normally sized requests
+    windows = []
+    while begin <= end:
+        day_end = min(datetime(begin.year, begin.month, begin.day) + timedelta(days=1, minutes=-1), end)
+        windows.append((begin, day_end))
+        begin = day_end + timedelta(minutes=1)
+    return windows
+
+
+def _utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None, second=0, microsecond=0)
+
+
+def print_status(status):
+    failed = f" - update failed ({'; '.join(status['errors'])})" if status["errors"] else ""
+    if status["time"] is None:
+        print(f"{status['station']}: no reports yet{failed}")
+        return
+    verdicts = []
+    for name, result in status["rulesets"].items():
+        if result is None:
+            verdicts.append(f"{name}: not evaluated")
+        elif result["flyable"]:
+            verdicts.append(f"{name}: flyable")
+        else:
+            verdicts.append(f"{name}: not flyable ({', '.join(result['failures'])})")
+    new = f", {status['new']} new" if status["new"] else ""
+    print(f"{status['station']} {status['time']:%d %H:%MZ}{new} - {'; '.join(verdicts)}{failed}")
+
+
+class LiveUpdater:
+    '''
+    Keeps a watch list of stations up to date by asking Ogimet only for
+    reports newer than the latest one stored for each station, then
+    evaluating just those reports for every ruleset, which also refreshes
+    the rollups of the days they fall on. Stations are polled in batches
+    spread evenly over the interval, each batch with random jitter, so
+    requests trickle out instead of bursting at the quota. Only the last
+    lookback is polled with one request; a station whose latest report is
+    older has the rest backfilled through the fetch planner, in requests
+    of the usual size. When a request fails the station is next polled from
+    where that request began, the planner skipping whatever did arrive.
+    :param interval: Seconds between polls of the same station.
+    :param batch_size: Stations polled together.
+    :param jitter: Up to this many seconds of random delay per batch.
+    :param on_update: Callback(status) after each station is polled, see
+        status(); prints a line by default.'''
+
+    def __init__(self, stations, rulesets=("default",), conn=None, interval=DEFAULT_INTERVAL, batch_size=10,
+                 jitter=30.0, limiter=None, workers=2, lookback=INITIAL_LOOKBACK, on_update=print_status):
+        self.conn = conn or get_connection()
+        self.stations = list(stations)
+        self.rulesets = [resolve_ruleset(self.conn, ruleset) for ruleset in rulesets]
+        self.interval = interval
+        self.batches = [self.stations[i:i + batch_size] for i in range(0, len(self.stations), batch_size)]
+        self.jitter = jitter
+        self.limiter = limiter or TokenBucket()
+        self.workers = workers
+        self.lookback = lookback
+        self.on_update = on_update
+        self.latest = latest_times(self.conn, self.stations)
+
+    def _jobs(self, stations, now):
+        floor = now - self.lookback
+        for station in stations:
+            last = self.latest.get(station)
+            begin = from_epoch_minutes(last + 1) if last is not None else floor
+            if begin < floor:
+                yield from plan_station_requests(self.conn, station, _day_windows(begin, floor - timedelta(minutes=1)))
+                begin = floor
+            if begin <= now:
+                yield {"icao": station, "begin": f"{begin:%Y%m%d%H%M}", "end": f"{now:%Y%m%d%H%M}", "header": "no"}
+
+    def poll(self, stations=None):
+        '''
+        Fetches, stores and evaluates the new reports of the given stations
+        (all by default) once.
+        :return: List of status dicts, one per station polled, with the
+            errors of any of its requests that failed.'''
+        now = _utc_now()
+        jobs = list(self._jobs(stations or self.stations, now))
+        new = {}
+        begins = {}
+        errors = {}
+        failed = {}
+        for job, result in ingest(self.conn, jobs, workers=self.workers, limiter=self.limiter):
+            station = job["icao"]
+            begin = datetime.strptime(job["begin"], "%Y%m%d%H%M")
+            metar_metrics.count("live.polls")
+            if "error" in result:
+                metar_metrics.count("live.failures")
+                errors.setdefault(station, []).append(str(result["error"]))
+                failed[station] = min(failed.get(station, begin), begin)
+                continue
+            new[station] = new.get(station, 0) + result["inserted"]
+            if result["inserted"]:
+                begins[station] = min(begins.get(station, begin), begin)
+
+        statuses = []
+        for station in dict.fromkeys(job["icao"] for job in jobs):
+            if new.get(station):
+                metar_metrics.count("live.new_reports", new[station])
+                with metar_metrics.timer("live.evaluate"):
+                    for ruleset in self.rulesets:
+                        update_analysis(self.conn, station, begins[station], now, ruleset)
+            if new.get(station) or station in failed:
+                self._advance(station, failed.get(station))
+            status = self.status(station)
+            status["new"] = new.get(station, 0)
+            status["errors"] = errors.get(station, [])
+            statuses.append(status)
+            if self.on_update is not None:
+                self.on_update(status)
+        return statuses
+
+    def _advance(self, station, failed_begin=None):
+        # Moves the station on to its latest stored report, but never past
+        # the start of a failed request, so the next poll asks for it again
+        latest = latest_times(self.conn, [station])[station]
+        if failed_begin is not None:
+            held = to_epoch_minutes(failed_begin) - 1
+            latest = held if latest is None else min(latest, held)
+        self.latest[station] = latest
+
+    def status(self, station):
+        '''
+        The latest stored report of a station and its result for each ruleset.
+        :return: Dict with station, time (naive UTC datetime or None), raw
+            and rulesets, a dict of ruleset name -> None if not evaluated, or
+            a dict with flyable, vfr and failures, the criteria it failed.
+            poll fills in new, the reports it stored, and errors.'''
+        c = self.conn.cursor()
+        c.execute("SELECT time, raw FROM metars WHERE station = ? ORDER BY time DESC LIMIT 1", (station,))
+        row = c.fetchone()
+        status = {"station": station, "time": None, "raw": None, "rulesets": {}, "new": 0, "errors": []}
+        if row is None:
+            return status
+        status["time"] = from_epoch_minutes(row[0])
+        status["raw"] = row[1]
+        for ruleset in self.rulesets:
+            c.execute("""
+                SELECT vfr, flyable, failed FROM metar_analysis
+                WHERE station = ? AND ruleset = ? AND ruleset_version = ? AND time = ?
+            """, (station, ruleset.name, ruleset.version, row[0]))
+            result = c.fetchone()
+            status["rulesets"][ruleset.name] = None if result is None else {
+                "vfr": bool(result[0]),
+                "flyable": bool(result[1]),
+                "failures": [criterion for criterion, bit in FAILURE_BITS.items() if result[2] & bit],
+            }
+        return status
+
+    def run(self, cycles=None):
+        '''
+        Polls every batch once per interval until interrupted, or for the
+        given number of cycles.'''
+        slot = self.interval / len(self.batches) if self.batches else self.interval
+        cycle = 0
+        try:
+            while cycles is None or cycle < cycles:
+                started = time.monotonic()
+                for i, batch in enumerate(self.batches):
+                    delay = started + i * slot + random.uniform(0, self.jitter) - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    self.poll(batch)
+                cycle += 1
+                if cycles is None or cycle < cycles:
+                    remaining = started + self.interval - time.monotonic()
+                    if remaining > 0:
+                        time.sleep(remaining)
+        except KeyboardInterrupt:
+            print("Stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a watch list of stations up to date with new METARs")
+    parser.add_argument("stations", help="comma-separated stations")
+    parser.add_argument("--rulesets", default="default", help="comma-separated ruleset names")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls of a station")
+    parser.add_argument("--batch-size", type=int, default=10, help="stations polled together")
+    parser.add_argument("--jitter", type=float, default=30.0, help="maximum random delay per batch, in seconds")
+    parser.add_argument("--rate", type=float, default=0.2, help="Ogimet requests per second")
+    parser.add_argument("--once", action="store_true", help="poll every station once and exit")
+    parser.add_argument("--db", default=None, help="database file")
+    args = parser.parse_args()
+
+    updater = LiveUpdater(args.stations.split(","), args.rulesets.split(","), conn=get_connection(args.db),
+                          interval=args.interval, batch_size=args.batch_size, jitter=args.jitter,
+                          limiter=TokenBucket(rate=args.rate))
+    if args.once:
+        updater.poll()
+    else:
+        updater.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import cProfile
+import json
+import os
+import threading
+import time
+
+# Checked by every hook before doing any work, so instrumentation costs one
+# attribute lookup while it is off. Turned on by enable() or METAR_METRICS=1.
+enabled = False
+
+_lock = threading.Lock()
+_counters = {}
+# name -> [calls, errors, total seconds, max seconds]
+_timers = {}
+_started = None
+_profiler = None
+
+
+def enable(profile=False):
+    '''
+    Starts collecting timers and counters, and with profile=True also runs
+    cProfile on the calling thread until disable() or dump_profile().'''
+    global enabled, _started, _profiler
+    reset()
+    _started = time.perf_counter()
+    if profile:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+    if _profiler is not None:
+        _profiler.disable()
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def count(name, n=1):
+    if not enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def add_time(name, seconds, error=False):
+    if not enabled:
+        return
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            stats = _timers[name] = [0, 0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += error
+        stats[2] += seconds
+        if seconds > stats[3]:
+            stats[3] = seconds
+
+
+class _Timer:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        add_time(self.name, time.perf_counter() - self.started, error=exc_type is not None)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name):
+    '''
+    Context manager timing a stage. Every use adds one call, and one error
+    if an exception leaves the block.'''
+    if not enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def summary():
+    '''
+    Returns the collected counters and timers as a JSON-ready dict, timers
+    with calls, errors, total_s, mean_ms and max_ms.'''
+    with _lock:
+        counters = dict(sorted(_counters.items()))
+        timers = {
+            name: {
+                "calls": calls,
+                "errors": errors,
+                "total_s": round(total, 6),
+                "mean_ms": round(total / calls * 1000, 3) if calls else 0.0,
+                "max_ms": round(longest * 1000, 3),
+            }
+            for name, (calls, errors, total, longest) in sorted(_timers.items())
+        }
+    return {
+        "wall_s": round(time.perf_counter() - _started, 6) if _started is not None else None,
+        "counters": counters,
+        "timers": timers,
+    }
+
+
+def write_summary(path):
+    with open(path, "w") as f:
+        json.dump(summary(), f, indent=2)
+
+
+def print_summary():
+    report = summary()
+    print(f"Instrumented run: {report['wall_s'] or 0:.2f}s wall time")
+    for name, stats in report["timers"].items():
+        errors = f", {stats['errors']} failed" if stats["errors"] else ""
+        print(f"  {name:<24} {stats['calls']:>8} calls {stats['total_s']:>9.3f}s "
+              f"(mean {stats['mean_ms']:.3f} ms, max {stats['max_ms']:.1f} ms{errors})")
+    for name, value in report["counters"].items():
+        print(f"  {name:<24} {value:>8}")
+
+
+def dump_profile(path):
+    '''Stops the profiler started by enable(profile=True) and writes its stats for pstats/snakeviz.'''
+    global _profiler
+    if _profiler is None:
+        return
+    _profiler.disable()
+    _profiler.dump_stats(path)
+    _profiler = None
+
+
+if os.environ.get("METAR_METRICS") == "1":
+    enable()
@@ -0,0 +1,233 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ogimet_model import Metar
+from ogimet_utils import save_metars_bulk, record_coverage, settled_range
+from ogimet_throttle import TokenBucket, call_with_retry
+from metar_eval import CRITERIA, FAILURE_BITS
+from metar_time import filter_to_windows, windows_to_epoch, to_epoch_minutes
+import ogimet_cgi
+from metar_archive import default_archive
+import metar_metrics
+
+# Stages are generators chained fetch/parse -> store on the ingest side,
+# and read -> aggregate on the analysis side. Each stage only holds what it
+# is working on, so memory does not grow with the length of the period.
+
+
+class JobDone:
+    '''
+    Marker sent down the ingest stages after the last report of a job.
+    unparsed counts the reports of the job that could not be parsed, error
+    is the exception if the fetch failed.'''
+    __slots__ = ("job", "seconds", "error", "unparsed")
+
+    def __init__(self, job, seconds, error=None, unparsed=0):
+        self.job = job
+        self.seconds = seconds
+        self.error = error
+        self.unparsed = unparsed
+
+
+def _fetch_job(job, limiter, retries):
+    started = time.monotonic()
+
+    def on_retry(error, delay):
+        if isinstance(error, ogimet_cgi.OgimetQuotaError):
+            limiter.pause(delay)
+
+    def fetch():
+        limiter.acquire()
+        reports = ogimet_cgi.iter_metar(
+            icao=job["icao"],
+            state=job.get("state"),
+            begin=job["begin"],
+            end=job["end"],
+            header=job["header"]
+        )
+        # Parsed as the lines arrive, so parsing overlaps the download
+        metars = []
+        unparsed = 0
+        for icao, stamp, body in reports:
+            try:
+                metars.append(Metar.from_parts(stamp, body))
+            except Exception:
+                unparsed += 1
+        return metars, unparsed
+
+    metars, unparsed = call_with_retry(fetch, retry_on=ogimet_cgi.RETRYABLE_ERRORS, retries=retries,
+                                       on_retry=on_retry, max_wait=ogimet_cgi.MAX_QUOTA_WAIT)
+    metar_metrics.count("pipeline.unparsed", unparsed)
+    return metars, unparsed, time.monotonic() - started
+
+
+def fetch_stage(jobs, workers=4, limiter=None, retries=5):
+    '''
+    Runs Ogimet requests on a thread pool sharing one session and one rate
+    limiter, parsing each response as it streams in, and yields (job, metars,
+    unparsed, seconds, error) as each one finishes, unparsed counting the
+    reports that could not be parsed. No more than two requests per
+    worker are queued or held at a time.'''
+    if limiter is None:
+        limiter = TokenBucket()
+    ogimet_cgi.get_session(pool_size=max(workers, 1))
+    jobs = iter(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        while True:
+            for job in jobs:
+                pending[pool.submit(_fetch_job, job, limiter, retries)] = (job, time.monotonic())
+                if len(pending) >= workers * 2:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, submitted = pending.pop(future)
+                try:
+                    metars, unparsed, seconds = future.result()
+                except Exception as e:
+                    yield job, [], 0, time.monotonic() - submitted, e
+                else:
+                    yield job, metars, unparsed, seconds, None
+
+
+def report_stage(fetched):
+    '''Flattens fetched jobs into their Metar objects, each followed by a JobDone.'''
+    for job, metars, unparsed, seconds, error in fetched:
+        yield from metars
+        yield JobDone(job, seconds, error, unparsed)
+
+
+def store_stage(conn, items, batch_size=500, archive=None, rollups=True):
+    '''
+    Writes parsed METARs in batches of batch_size and, once all of a job's
+    reports are stored, records its range as covered. Yields (job, result)
+    per job, result holding inserted, ignored, unparsed and seconds, or error.
+    With rollups, a job's new reports are evaluated with the rulesets their
+    stations have rollups for (metar_analysis.analyse_ingested), keeping
+    the rollups current.
+    A state job's range is recorded for every station it was planned for,
+    including ones without reports in the response, so a station that
+    genuinely did not report is not planned again on every run.
+    :param archive: Optional MetarArchive that also gets the raw reports.'''
+    from metar_analysis import analyse_ingested, extend_spans
+
+    batch = []
+    inserted = 0
+    ignored = 0
+    spans = {}
+    for item in items:
+        if isinstance(item, JobDone):
+            if item.error is not None:
+                batch.clear()
+                result = {"error": item.error}
+            else:
+                if batch:
+                    if archive is not None:
+                        archive.append((m.station, m.raw) for m in batch)
+                    counts = save_metars_bulk(conn, batch, batch_size)
+                    inserted += counts[0]
+                    ignored += counts[1]
+                    batch.clear()
+                covered = [settled_range(item.job["begin"], item.job["end"])]
+                if item.job.get("state"):
+                    for station in item.job["stations"]:
+                        record_coverage(conn, station, covered)
+                else:
+                    record_coverage(conn, item.job["icao"], covered)
+                if rollups and inserted:
+                    analyse_ingested(conn, spans)
+                result = {"inserted": inserted, "ignored": ignored, "unparsed": item.unparsed,
+                          "seconds": item.seconds}
+            inserted = 0
+            ignored = 0
+            spans.clear()
+            yield item.job, result
+            continue
+        extend_spans(spans, item.station, to_epoch_minutes(item.time))
+        batch.append(item)
+        if len(batch) >= batch_size:
+            if archive is not None:
+                archive.append((m.station, m.raw) for m in batch)
+            counts = save_metars_bulk(conn, batch, batch_size)
+            inserted += counts[0]
+            ignored += counts[1]
+            batch.clear()
+
+
+def ingest(conn, jobs, workers=4, limiter=None, retries=5, batch_size=500, archive=None, rollups=True):
+    '''
+    The fetch and parse -> store chain, yielding (job, result) per job. Raw
+    reports also go to archive, or to the configured archive if there is one.'''
+    fetched = fetch_stage(jobs, workers=workers, limiter=limiter, retries=retries)
+    return store_stage(conn, report_stage(fetched), batch_size=batch_size, archive=archive or default_archive(),
+                       rollups=rollups)
+
+
+def read_analysis_stage(conn, station, windows, ruleset, chunk_size=5000):
+    '''
+    Streams (time, vfr, flyable, failed) cached results for a station and
+    ruleset that fall inside the windows, from one range query.'''
+    if not windows:
+        return
+    c = conn.cursor()
+    c.execute("""
+        SELECT time, vfr, flyable, failed FROM metar_analysis
+        WHERE station = ? AND ruleset = ? AND ruleset_version = ? AND time BETWEEN ? AND ?
+        ORDER BY time
+    """, (station, ruleset.name, ruleset.version, to_epoch_minutes(windows[0][0]), to_epoch_minutes(windows[-1][1])))
+
+    def rows():
+        while True:
+            chunk = c.fetchmany(chunk_size)
+            if not chunk:
+                return
+            yield from chunk
+
+    yield from filter_to_windows(rows(), windows_to_epoch(windows), key=lambda r: r[0])
+
+
+class FlyableCounter:
+    '''Running total, flyable and VFR counts.'''
+
+    def __init__(self):
+        self.total = 0
+        self.flyable = 0
+        self.vfr = 0
+
+    def add(self, time, vfr, flyable, failed):
+        self.total += 1
+        self.flyable += flyable
+        self.vfr += vfr
+
+    def result(self):
+        return {"total": self.total, "flyable": self.flyable, "vfr": self.vfr}
+
+
+class FailureCounter:
+    '''Running count of observations failing each criterion of a ruleset.'''
+
+    def __init__(self, ruleset):
+        self.counts = {criterion: 0 for criterion in CRITERIA if ruleset.flyable.get(criterion) is not None}
+        self.bits = [(criterion, FAILURE_BITS[criterion]) for criterion in self.counts]
+
+    def add(self, time, vfr, flyable, failed):
+        if failed:
+            for criterion, bit in self.bits:
+                if failed & bit:
+                    self.counts[criterion] += 1
+
+    def result(self):
+        return {"failures": dict(self.counts)}
+
+
+def aggregate(rows, aggregators):
+    '''Pushes every row into each aggregator and merges their results.'''
+    adders = [aggregator.add for aggregator in aggregators]
+    for row in rows:
+        for add in adders:
+            add(*row)
+    result = {}
+    for aggregator in aggregators:
+        result.update(aggregator.result())
+    return result
@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from ogimet_utils import get_coverage
+from metar_time import window_gaps
+from metar_fetcher import merge_consecutive_metar_requests
+from metar_stations import get_station
+
+# Rough number of stations reporting in each state, for sizing state
+# requests; anything not listed is assumed to have DEFAULT_STATE_STATIONS
+STATE_STATIONS = {
+    "United Kingdom": 130,
+    "Ireland": 20,
+    "France": 200,
+    "Germany": 180,
+}
+DEFAULT_STATE_STATIONS = 100
+
+# Half-hourly reports
+REPORTS_PER_DAY = 48
+# Largest response to ask Ogimet for in one request, in reports
+MAX_REPORTS_PER_REQUEST = 50000
+
+
+def station_state(station, states=None):
+    '''
+    The Ogimet state a station belongs to, from states, the metar_stations
+    registry or its ICAO prefix, or None.'''
+    if states and station in states:
+        return states[station]
+    return get_station(station).state
+
+
+def state_chunk(state, max_reports=MAX_REPORTS_PER_REQUEST):
+    '''Longest period one state request can cover while staying under max_reports.'''
+    stations = STATE_STATIONS.get(state, DEFAULT_STATE_STATIONS)
+    return timedelta(days=max(1, max_reports // (stations * REPORTS_PER_DAY)))
+
+
+def _station_jobs(station, gaps):
+    requests = [{
+        "icao": station,
+        "begin": begin.strftime("%Y%m%d%H%M"),
+        "end": end.strftime("%Y%m%d%H%M"),
+        "header": "no"
+    } for begin, end in gaps]
+    return merge_consecutive_metar_requests(requests) if requests else []
+
+
+def _clip(gaps, begin, end):
+    # The parts of sorted gaps inside [begin, end)
+    last = end - timedelta(minutes=1)
+    return [(max(b, begin), min(e, last)) for b, e in gaps if b < end and e >= begin]
+
+
+def plan_requests(conn, stations, windows, states=None, min_state_stations=3,
+                  max_reports=MAX_REPORTS_PER_REQUEST):
+    '''
+    Plans the Ogimet requests needed to fill the uncovered parts of several
+    stations' windows. Where at least min_state_stations stations of the same
+    state are missing data in the same period, one state= request replaces
+    their station requests; everything else is requested per station.
+    :param states: Optional dict of station -> Ogimet state name, overriding
+        the guess from the ICAO prefix.
+    :param max_reports: Upper bound on the reports a state request may return,
+        which sets how long a period each one covers.
+    :return: List of jobs for metar_fetcher.fetch_jobs. State jobs have icao
+        None, the state name under "state" and the planned stations under
+        "stations".'''
+    if not windows:
+        return []
+    gaps = {}
+    for station in stations:
+        covered = get_coverage(conn, station, windows[0][0], windows[-1][1])
+        station_gaps = window_gaps(windows, covered)
+        if station_gaps:
+            gaps[station] = station_gaps
+
+    by_state = {}
+    leftover = {}
+    for station, station_gaps in gaps.items():
+        state = station_state(station, states)
+        if state is None:
+            leftover[station] = station_gaps
+        else:
+            by_state.setdefault(state, []).append(station)
+
+    jobs = []
+    for state, members in sorted(by_state.items()):
+        if len(members) < min_state_stations:
+            for station in members:
+                leftover[station] = gaps[station]
+            continue
+        chunk = state_chunk(state, max_reports)
+        start = min(gaps[station][0][0] for station in members)
+        chunk_begin = datetime(start.year, start.month, start.day)
+        end = max(gaps[station][-1][1] for station in members)
+        while chunk_begin <= end:
+            chunk_end = chunk_begin + chunk
+            clipped = {station: _clip(gaps[station], chunk_begin, chunk_end) for station in members}
+            needing = sorted(station for station, pieces in clipped.items() if pieces)
+            if len(needing) >= min_state_stations:
+                jobs.append({
+                    "icao": None,
+                    "state": state,
+                    "stations": needing,
+                    "begin": min(clipped[s][0][0] for s in needing).strftime("%Y%m%d%H%M"),
+                    "end": max(clipped[s][-1][1] for s in needing).strftime("%Y%m%d%H%M"),
+                    "header": "no"
+                })
+            else:
+                for station in needing:
+                    leftover.setdefault(station, []).extend(clipped[station])
+            chunk_begin = chunk_end
+
+    for station, station_gaps in sorted(leftover.items()):
+        jobs.extend(_station_jobs(station, station_gaps))
+    return jobs
+
+
+def describe_plan(jobs):
+    '''Counts of state and station requests in a plan.'''
+    state_jobs = [job for job in jobs if job.get("state")]
+    return {
+        "requests": len(jobs),
+        "state_requests": len(state_jobs),
+        "station_requests": len(jobs) - len(state_jobs),
+        "stations_in_state_requests": len({s for job in state_jobs for s in job["stations"]}),
+    }
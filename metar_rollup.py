@@ -0,0 +1,182 @@
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from metar_time import EPOCH, to_epoch_minutes
+from metar_rulesets import resolve_ruleset, get_ruleset
+from metar_stations import station_timezone
+
+INSERT_ROLLUP_SQL = """
+    INSERT OR REPLACE INTO metar_rollup (
+        station, ruleset, ruleset_version, local_date, local_hour, total, flyable, vfr
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Period expression for each way climatology can group the hourly rows
+GROUP_BY = {
+    "day": "local_date",
+    "month": "substr(local_date, 1, 7)",
+    "year": "substr(local_date, 1, 4)",
+    "calendar_month": "CAST(substr(local_date, 6, 2) AS INTEGER)",
+    "hour": "local_hour",
+}
+
+
+def _local_hour_function(tz):
+    # Maps epoch minutes to (local ISO date, local hour). The UTC offset only
+    # changes on the hour, so it is looked up once per UTC hour.
+    offsets = {}
+
+    def local_hour(minutes):
+        hour = minutes // 60
+        offset = offsets.get(hour)
+        if offset is None:
+            local = tz.fromutc((EPOCH + timedelta(hours=hour)).replace(tzinfo=tz))
+            offset = int(local.utcoffset().total_seconds()) // 60
+            offsets[hour] = offset
+        local = minutes + offset
+        return (EPOCH + timedelta(days=local // 1440)).date().isoformat(), local % 1440 // 60
+
+    return local_hour
+
+
+def _local_midnight(tz, day):
+    local = datetime.combine(day, time(), tzinfo=tz)
+    return to_epoch_minutes(local.astimezone(timezone.utc).replace(tzinfo=None))
+
+
+def refresh_rollup(conn, station, ruleset, start_minutes, end_minutes):
+    '''
+    Recounts the rollup rows of every local day touched by
+    [start_minutes, end_minutes] (epoch minutes) from metar_analysis. Days
+    and hours are those of the station's time zone (metar_stations). Whole
+    days are recounted, so calling this again for the same range is safe.
+    Does not commit; call it inside the transaction that wrote the results.'''
+    tz = ZoneInfo(station_timezone(station))
+    local_hour = _local_hour_function(tz)
+    first_date = local_hour(start_minutes)[0]
+    last_date = local_hour(end_minutes)[0]
+    begin = _local_midnight(tz, date.fromisoformat(first_date))
+    end = _local_midnight(tz, date.fromisoformat(last_date) + timedelta(days=1)) - 1
+
+    c = conn.cursor()
+    c.execute("""
+        SELECT time, vfr, flyable FROM metar_analysis
+        WHERE station = ? AND ruleset = ? AND ruleset_version = ? AND time BETWEEN ? AND ?
+    """, (station, ruleset.name, ruleset.version, begin, end))
+    counts = {}
+    for minutes, vfr, flyable in c:
+        key = local_hour(minutes)
+        bucket = counts.get(key)
+        if bucket is None:
+            bucket = counts[key] = [0, 0, 0]
+        bucket[0] += 1
+        bucket[1] += flyable
+        bucket[2] += vfr
+
+    c.execute("""
+        DELETE FROM metar_rollup
+        WHERE station = ? AND ruleset = ? AND ruleset_version = ? AND local_date BETWEEN ? AND ?
+    """, (station, ruleset.name, ruleset.version, first_date, last_date))
+    c.executemany(INSERT_ROLLUP_SQL, [
+        (station, ruleset.name, ruleset.version, local_date, hour, total, flyable, vfr)
+        for (local_date, hour), (total, flyable, vfr) in counts.items()
+    ])
+    return len(counts)
+
+
+def rollup_rulesets(conn, station):
+    '''The ruleset versions a station has rollups for, as Ruleset objects.'''
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT ruleset, ruleset_version FROM metar_rollup WHERE station = ?", (station,))
+    return [get_ruleset(conn, name, version) for name, version in c.fetchall()]
+
+
+def rebuild_rollup(conn, station=None, ruleset=None, commit=True):
+    '''
+    Recounts the rollups from metar_analysis, for one station and/or ruleset
+    or for everything cached.'''
+    if ruleset is not None:
+        ruleset = resolve_ruleset(conn, ruleset)
+    c = conn.cursor()
+    c.execute("""
+        SELECT station, ruleset, ruleset_version, MIN(time), MAX(time) FROM metar_analysis
+        WHERE (? IS NULL OR station = ?) AND (? IS NULL OR (ruleset = ? AND ruleset_version = ?))
+        GROUP BY station, ruleset, ruleset_version
+    """, (station, station) + ((None, None, None) if ruleset is None else
+                               (ruleset.name, ruleset.name, ruleset.version)))
+    for group_station, name, version, first, last in c.fetchall():
+        refresh_rollup(conn, group_station, get_ruleset(conn, name, version), first, last)
+    if commit:
+        conn.commit()
+
+
+def _date_arg(value):
+    # Entry points take dates as "dd-mm-YYYY" like analyze_metars
+    if isinstance(value, date):
+        return value.isoformat()
+    return datetime.strptime(value, "%d-%m-%Y").date().isoformat()
+
+
+def climatology(conn, station, ruleset="default", by="month", start_date=None, end_date=None, hours=None, months=None):
+    '''
+    Flyable and VFR percentages straight from the rollups, without touching
+    the individual observations.
+    :param ruleset: Ruleset or ruleset name. Only observations analysed
+        with it are counted: those update_analysis evaluated, and any stored
+        after the station first had rollups for it, which are evaluated as
+        they are ingested.
+    :param by: One of GROUP_BY: day, month, year, calendar_month or hour.
+    :param start_date: First local day to include, "dd-mm-YYYY" or a date.
+    :param end_date: Last local day to include.
+    :param hours: Optional (first, last) local hours; only observations with
+        first <= hour < last are counted, e.g. (9, 17) for 09:00 to 16:59.
+    :param months: Optional calendar months (1-12) to include.
+    :return: List of dicts with period, total, flyable, vfr, flyable_pct and
+        vfr_pct, ordered by period.'''
+    if by not in GROUP_BY:
+        raise ValueError(f"Unknown grouping {by!r}, expected one of {', '.join(GROUP_BY)}")
+    ruleset = resolve_ruleset(conn, ruleset)
+    where = ["station = ?", "ruleset = ?", "ruleset_version = ?"]
+    params = [station, ruleset.name, ruleset.version]
+    if start_date is not None:
+        where.append("local_date >= ?")
+        params.append(_date_arg(start_date))
+    if end_date is not None:
+        where.append("local_date <= ?")
+        params.append(_date_arg(end_date))
+    if hours is not None:
+        where.append("local_hour >= ? AND local_hour < ?")
+        params.extend(hours)
+    if months:
+        where.append(f"CAST(substr(local_date, 6, 2) AS INTEGER) IN ({', '.join('?' * len(months))})")
+        params.extend(months)
+
+    period = GROUP_BY[by]
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT {period} AS period, SUM(total), SUM(flyable), SUM(vfr) FROM metar_rollup
+        WHERE {' AND '.join(where)}
+        GROUP BY period ORDER BY period
+    """, params)
+    return [
+        {
+            "period": period,
+            "total": total,
+            "flyable": flyable,
+            "vfr": vfr,
+            "flyable_pct": flyable / total * 100 if total else 0.0,
+            "vfr_pct": vfr / total * 100 if total else 0.0,
+        }
+        for period, total, flyable, vfr in c.fetchall()
+    ]
+
+
+def best_hours(conn, station, ruleset="default", start_date=None, end_date=None, months=None):
+    '''Local hours of the day ordered from most to least often flyable.'''
+    rows = climatology(conn, station, ruleset, by="hour", start_date=start_date, end_date=end_date, months=months)
+    return sorted(rows, key=lambda row: row["flyable_pct"], reverse=True)
+
+
+def print_climatology(rows, label="Period"):
+    print(f"{label:>10} {'METARs':>8} {'Flyable':>8} {'VFR':>8}")
+    for row in rows:
+        print(f"{row['period']:>10} {row['total']:>8} {row['flyable_pct']:>7.1f}% {row['vfr_pct']:>7.1f}%")
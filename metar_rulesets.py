@@ -0,0 +1,97 @@
+import json
+from datetime import datetime, timezone
+
+
+class Ruleset:
+    '''
+    A named, versioned set of thresholds. Analysis results are cached per
+    (name, version), so any change to the thresholds needs a new version.
+    :param flyable: Keyword arguments for Metar.is_flyable.
+    :param vfr: Keyword arguments for Metar.is_vfr.'''
+
+    def __init__(self, name, version, flyable, vfr=None, description=""):
+        self.name = name
+        self.version = version
+        self.flyable = dict(flyable)
+        self.vfr = dict(vfr) if vfr is not None else {"min_visibility": 1500, "min_ceiling": 1500}
+        self.description = description
+
+    def __repr__(self):
+        return f"Ruleset({self.name!r}, {self.version})"
+
+    def params_json(self):
+        return json.dumps({"flyable": self.flyable, "vfr": self.vfr}, sort_keys=True)
+
+    @classmethod
+    def from_db_row(cls, row):
+        params = json.loads(row["params"])
+        return cls(row["name"], row["version"], params["flyable"], params["vfr"], row["description"])
+
+
+DEFAULT_RULESET = Ruleset("default", 1, {
+    "min_visibility": 8000,
+    "min_ceiling": 1500,
+    "max_wind_speed": 14,
+    "min_base": 1000,
+    "max_wind_gust": 25,
+    "min_temperature": 1,
+    "max_temperature": 30,
+    "bad_weather": ["FZFG", "+TSRA", "TS",
+                    "TSRA", "BR", "HZ", "FG", "GR", "GS"]
+}, description="Club local flying minima")
+
+BUILTIN_RULESETS = {DEFAULT_RULESET.name: DEFAULT_RULESET}
+
+
+def save_ruleset(conn, ruleset):
+    '''
+    Stores a ruleset. Saving the same name and version again is a no-op, but
+    saving different thresholds under an existing version raises ValueError.'''
+    c = conn.cursor()
+    c.execute("SELECT params FROM rulesets WHERE name = ? AND version = ?", (ruleset.name, ruleset.version))
+    row = c.fetchone()
+    if row is not None:
+        if row[0] != ruleset.params_json():
+            raise ValueError(
+                f"Ruleset {ruleset.name} v{ruleset.version} is already stored with different "
+                f"thresholds; save the change as a new version")
+        return
+    c.execute("""
+        INSERT INTO rulesets (name, version, params, description, created)
+        VALUES (?, ?, ?, ?, ?)
+    """, (ruleset.name, ruleset.version, ruleset.params_json(), ruleset.description,
+          datetime.now(timezone.utc).replace(tzinfo=None).isoformat(timespec="seconds")))
+    conn.commit()
+
+
+def get_ruleset(conn, name, version=None):
+    '''
+    Loads a ruleset by name, the latest version unless one is given. Built-in
+    rulesets are stored on first use. Raises KeyError if there is none.'''
+    c = conn.cursor()
+    if version is None:
+        c.execute("SELECT * FROM rulesets WHERE name = ? ORDER BY version DESC LIMIT 1", (name,))
+    else:
+        c.execute("SELECT * FROM rulesets WHERE name = ? AND version = ?", (name, version))
+    row = c.fetchone()
+    if row is not None:
+        return Ruleset.from_db_row(row)
+    builtin = BUILTIN_RULESETS.get(name)
+    if builtin is not None and version in (None, builtin.version):
+        save_ruleset(conn, builtin)
+        return builtin
+    raise KeyError(f"No ruleset named {name!r}" + (f" with version {version}" if version is not None else ""))
+
+
+def resolve_ruleset(conn, ruleset):
+    '''Accepts a Ruleset (stored if new) or a ruleset name.'''
+    if isinstance(ruleset, Ruleset):
+        save_ruleset(conn, ruleset)
+        return ruleset
+    return get_ruleset(conn, ruleset)
+
+
+def list_rulesets(conn):
+    c = conn.cursor()
+    c.execute("SELECT * FROM rulesets ORDER BY name, version")
+    return [Ruleset.from_db_row(row) for row in c.fetchall()]
@@ -0,0 +1,230 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+import metar_db
+from metar_batch import MetarBatch
+from metar_eval import column, weather_masks, failure_masks, evaluate_vfr
+from metar_fetcher import fetch_jobs
+from metar_planner import plan_requests, describe_plan
+from metar_rulesets import resolve_ruleset
+from metar_stations import DAYLIGHT, group_by_timezone, station_utc_windows
+from ogimet_utils import iter_metar_rows
+from metar_time import windows_to_epoch, from_epoch_minutes
+
+RESULT_FIELDS = ("station", "ruleset", "ruleset_version", "start_date", "end_date",
+                 "total", "flyable", "vfr", "flyable_pct", "vfr_pct")
+
+
+def yearly_periods(first_year, last_year, month=1, day=1):
+    '''
+    One-year periods as (start_date, end_date) "dd-mm-YYYY" pairs, the first
+    starting on day/month of first_year and the last on day/month of
+    last_year, e.g. month=12 for December to November years.'''
+    periods = []
+    for year in range(first_year, last_year + 1):
+        start = datetime(year, month, day)
+        end = datetime(year + 1, month, day) - timedelta(days=1)
+        periods.append((f"{start:%d-%m-%Y}", f"{end:%d-%m-%Y}"))
+    return periods
+
+
+def parse_period(text):
+    '''"dd-mm-YYYY:dd-mm-YYYY" -> (start_date, end_date).'''
+    start, end = text.split(":")
+    datetime.strptime(start, "%d-%m-%Y")
+    datetime.strptime(end, "%d-%m-%Y")
+    return start, end
+
+
+def _period_windows(periods, hours, station):
+    # Per period the epoch-minute windows, and all their windows merged for fetching
+    per_period = []
+    every = set()
+    for start_date, end_date in periods:
+        windows = station_utc_windows(station, datetime.strptime(start_date, "%d-%m-%Y"),
+                                      datetime.strptime(end_date, "%d-%m-%Y"), hours)
+        every.update(windows)
+        per_period.append(windows_to_epoch(windows))
+    return per_period, sorted(every)
+
+
+def _inside(times, windows):
+    # Boolean mask of the sorted times that fall in one of the sorted windows
+    if not windows:
+        return np.zeros(len(times), dtype=bool)
+    begins = np.array([begin for begin, _ in windows], dtype=np.int64)
+    ends = np.array([end for _, end in windows], dtype=np.int64)
+    index = np.searchsorted(begins, times, side="right") - 1
+    return (index >= 0) & (times <= ends[np.maximum(index, 0)])
+
+
+def evaluate_station(path, station, periods, period_windows, rulesets):
+    '''
+    Reads a station's METARs for the whole matrix once, from a read-only
+    connection, and evaluates every ruleset over every period from that one
+    batch. Runs in a worker process.
+    :return: List of result dicts, one per ruleset and period.'''
+    conn = metar_db.connect(path, readonly=True)
+    first = min((windows[0][0] for windows in period_windows if windows), default=0)
+    last = max((windows[-1][1] for windows in period_windows if windows), default=0)
+    batch = MetarBatch.from_db_rows(
+        iter_metar_rows(conn, station, from_epoch_minutes(first), from_epoch_minutes(last)), keep_raw=False)
+    conn.close()
+
+    times = column(batch, "time").astype(np.int64)
+    masks = [_inside(times, windows) for windows in period_windows]
+    weather = weather_masks(batch)
+    results = []
+    for ruleset in rulesets:
+        failed = failure_masks(batch, weather=weather, **ruleset.flyable)
+        flyable = np.ones(len(batch), dtype=bool)
+        for mask in failed.values():
+            flyable &= ~mask
+        vfr = evaluate_vfr(batch, **ruleset.vfr)
+        for (start_date, end_date), inside in zip(periods, masks):
+            total = int(inside.sum())
+            flyable_count = int((flyable & inside).sum())
+            vfr_count = int((vfr & inside).sum())
+            results.append({
+                "station": station,
+                "ruleset": ruleset.name,
+                "ruleset_version": ruleset.version,
+                "start_date": start_date,
+                "end_date": end_date,
+                "total": total,
+                "flyable": flyable_count,
+                "vfr": vfr_count,
+                "flyable_pct": round(flyable_count / total * 100, 2) if total else 0.0,
+                "vfr_pct": round(vfr_count / total * 100, 2) if total else 0.0,
+                "failures": {criterion: int((mask & inside).sum()) for criterion, mask in failed.items()},
+            })
+    return results
+
+
+def run_matrix(stations, periods, rulesets=("default",), hours=(8, 18, 8, 20), path=None, workers=None,
+               fetch=True, fetch_workers=4, limiter=None, states=None):
+    '''
+    Analyses every station x period x ruleset combination in one pass:
+    one de-duplicated fetch plan covering the whole matrix, then one read per
+    station, evaluated for all periods and rulesets, across a process pool.
+    Results are computed from the stored METARs and not cached in
+    metar_analysis, so the workers only need read-only connections.
+    :param periods: (start_date, end_date) "dd-mm-YYYY" pairs, e.g. from
+        yearly_periods.
+    :param hours: (local_start_hour, local_end_hour, local_start_hour_summer,
+        local_end_hour_summer), as for analyze_metars, in each station's
+        time zone, or metar_stations.DAYLIGHT for sunrise to sunset. Hour
+        windows are built once per zone, daylight ones per station.
+    :param workers: Worker processes, defaults to the number of CPUs. With 1
+        everything runs in this process.
+    :param fetch: Fetch missing data first; False analyses what is stored.
+    :return: List of result dicts (RESULT_FIELDS plus failures, a dict of
+        criterion -> observations failing it), ordered by station, ruleset
+        and period.'''
+    path = os.path.abspath(path or metar_db.default_path())
+    conn = metar_db.get_connection(path)
+    rulesets = [resolve_ruleset(conn, ruleset) for ruleset in rulesets]
+    groups = {station: [station] for station in stations} if hours == DAYLIGHT else group_by_timezone(stations)
+    station_windows = {}
+    jobs = []
+    for members in groups.values():
+        period_windows, all_windows = _period_windows(periods, hours, members[0])
+        for station in members:
+            station_windows[station] = period_windows
+        if fetch and all_windows:
+            jobs.extend(plan_requests(conn, members, all_windows, states=states))
+
+    if jobs:
+        started = time.perf_counter()
+        plan = describe_plan(jobs)
+        print(f"Fetching {plan['requests']} requests ({plan['state_requests']} state, "
+              f"{plan['station_requests']} station) for {len(stations)} stations")
+        summary = fetch_jobs(conn, jobs, workers=fetch_workers, limiter=limiter, progress=None)
+        print(f"Fetched {summary['inserted']} new METARs in {time.perf_counter() - started:.1f}s"
+              + (f", {len(summary['failed'])} requests failed" if summary["failed"] else ""))
+
+    workers = min(workers or os.cpu_count() or 1, len(stations))
+    results = []
+    if workers <= 1:
+        for station in stations:
+            results.extend(evaluate_station(path, station, periods, station_windows[station], rulesets))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(evaluate_station, path, station, periods, station_windows[station], rulesets)
+                       for station in stations]
+            for future in futures:
+                results.extend(future.result())
+    return results
+
+
+def write_csv(results, path):
+    '''Writes results as CSV, with one failed_<criterion> column per criterion.'''
+    criteria = sorted({criterion for result in results for criterion in result["failures"]})
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(RESULT_FIELDS) + [f"failed_{criterion}" for criterion in criteria])
+        for result in results:
+            writer.writerow([result[name] for name in RESULT_FIELDS]
+                            + [result["failures"].get(criterion, "") for criterion in criteria])
+
+
+def write_json(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def print_results(results):
+    print(f"{'Station':<8} {'Ruleset':<12} {'Period':<23} {'METARs':>8} {'Flyable':>8} {'VFR':>8}")
+    for result in results:
+        print(f"{result['station']:<8} {result['ruleset'] + ' v' + str(result['ruleset_version']):<12} "
+              f"{result['start_date'] + ' - ' + result['end_date']:<23} {result['total']:>8} "
+              f"{result['flyable_pct']:>7.2f}% {result['vfr_pct']:>7.2f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyse stations x periods x rulesets in one pass")
+    parser.add_argument("stations", help="comma-separated stations")
+    parser.add_argument("--periods", nargs="*", type=parse_period, default=[],
+                        help="periods as dd-mm-YYYY:dd-mm-YYYY")
+    parser.add_argument("--years", metavar="FIRST-LAST", help="one period per year, e.g. 2016-2024")
+    parser.add_argument("--year-start", default="01-01", metavar="DD-MM",
+                        help="day the --years periods start on, e.g. 01-12 for December to November")
+    parser.add_argument("--rulesets", default="default", help="comma-separated ruleset names")
+    parser.add_argument("--hours", type=int, nargs=2, default=(8, 18), metavar=("FIRST", "LAST"),
+                        help="local hours in winter")
+    parser.add_argument("--summer-hours", type=int, nargs=2, default=(8, 20), metavar=("FIRST", "LAST"),
+                        help="local hours in summer")
+    parser.add_argument("--daylight", action="store_true", help="sunrise to sunset instead of the hours")
+    parser.add_argument("--workers", type=int, default=None, help="analysis processes (default: CPU count)")
+    parser.add_argument("--no-fetch", action="store_true", help="only analyse data already stored")
+    parser.add_argument("--db", default=None, help="database file")
+    parser.add_argument("--output", help="write results to this .csv or .json file")
+    args = parser.parse_args()
+
+    periods = list(args.periods)
+    if args.years:
+        first, last = (int(year) for year in args.years.split("-"))
+        day, month = (int(part) for part in args.year_start.split("-"))
+        periods.extend(yearly_periods(first, last, month, day))
+    if not periods:
+        parser.error("give --periods or --years")
+
+    results = run_matrix(args.stations.split(","), periods, args.rulesets.split(","),
+                         hours=DAYLIGHT if args.daylight else (*args.hours, *args.summer_hours), path=args.db, workers=args.workers,
+                         fetch=not args.no_fetch)
+    print_results(results)
+    if args.output:
+        if args.output.endswith(".json"):
+            write_json(results, args.output)
+        else:
+            write_csv(results, args.output)
+        print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
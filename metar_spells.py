@@ -0,0 +1,231 @@
+import argparse
+import statistics
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from metar_db import get_connection
+from metar_rulesets import resolve_ruleset
+from metar_analysis import update_analysis
+from metar_pipeline import read_analysis_stage
+from metar_stations import DAYLIGHT, station_timezone, station_utc_windows
+from metar_time import windows_to_epoch, to_epoch_minutes
+
+# Minutes a report is taken to hold for when no newer report follows. A spell
+# is cut short where reports stop for longer, instead of bridging the gap.
+MAX_REPORT_GAP = 60
+
+
+def day_spells(rows, windows, max_gap=MAX_REPORT_GAP):
+    '''
+    Finds the continuous flyable spells of every window in one merge pass
+    over time-sorted (time, vfr, flyable, failed) rows and sorted (begin, end)
+    epoch-minute windows, one window per local day. A flyable report counts
+    from its own time until the next report, at most max_gap minutes, and
+    never past the end of its window.
+    :return: Generator of (window index, reports in the window, spells), for
+        every window, spells being a list of (start, end) epoch minutes.'''
+    rows = iter(rows)
+    row = next(rows, None)
+    for index, (begin, end) in enumerate(windows):
+        while row is not None and row[0] < begin:
+            row = next(rows, None)
+        spells = []
+        count = 0
+        start = None
+        previous = None
+        while row is not None and row[0] <= end:
+            t = row[0]
+            if start is not None and t - previous > max_gap:
+                spells.append((start, previous + max_gap))
+                start = None
+            if row[2]:
+                if start is None:
+                    start = t
+            elif start is not None:
+                spells.append((start, t))
+                start = None
+            previous = t
+            count += 1
+            row = next(rows, None)
+        if start is not None:
+            spells.append((start, min(previous + max_gap, end)))
+        yield index, count, [(s, e) for s, e in spells if e > s]
+
+
+def _local_shifts(windows, tz_name):
+    # Per window, what to add to epoch minutes to get the local minute of
+    # that day. Windows lie within one day's local hours, so one offset each
+    tz = ZoneInfo(tz_name)
+    shifts = []
+    for begin, _ in windows:
+        local = begin.replace(tzinfo=timezone.utc).astimezone(tz)
+        shifts.append(local.hour * 60 + local.minute - to_epoch_minutes(begin))
+    return shifts
+
+
+def _hours(minutes):
+    return round(minutes / 60, 2)
+
+
+def _clock(minute_of_day):
+    minute_of_day = int(round(minute_of_day))
+    return f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}"
+
+
+class SpellStatistics:
+    '''
+    Running per-day spell statistics for one station and ruleset, fed from
+    day_spells.
+    :param shifts: Per window, the minutes to add to epoch minutes to get
+        the local time of day.
+    :param durations: Spell lengths in hours to count the days for, e.g.
+        days with at least a 3-hour flyable window.
+    :param start_duration: Length in hours of the window that start times and
+        best start hours are reported for.'''
+
+    def __init__(self, shifts, durations=(1, 2, 3, 4), start_duration=3):
+        self.shifts = shifts
+        self.durations = tuple(sorted(durations))
+        self.start_duration = start_duration
+        self.days = 0
+        self.days_without_data = 0
+        self.days_with = {hours: 0 for hours in self.durations}
+        self.longest = []
+        self.spell_count = 0
+        self.spell_minutes = 0
+        self.spell_starts = []
+        self.start_hours = {}
+
+    def add(self, index, count, spells):
+        if not count:
+            self.days_without_data += 1
+            return
+        self.days += 1
+        longest = max((end - start for start, end in spells), default=0)
+        self.longest.append(longest)
+        for hours in self.durations:
+            if longest >= hours * 60:
+                self.days_with[hours] += 1
+        self.spell_count += len(spells)
+        self.spell_minutes += sum(end - start for start, end in spells)
+
+        shift = self.shifts[index]
+        needed = self.start_duration * 60
+        counted = set()
+        for start, end in spells:
+            if end - start < needed:
+                continue
+            local_start = start + shift
+            local_end = end + shift
+            self.spell_starts.append(local_start)
+            # Every whole hour at which a start_duration window fits in this spell
+            hour = -(-local_start // 60)
+            while hour * 60 + needed <= local_end:
+                if hour not in counted:
+                    counted.add(hour)
+                    self.start_hours[hour] = self.start_hours.get(hour, 0) + 1
+                hour += 1
+
+    def result(self):
+        longest = self.longest
+        histogram = {}
+        for minutes in longest:
+            histogram[minutes // 60] = histogram.get(minutes // 60, 0) + 1
+        best = max(self.start_hours.items(), key=lambda item: (item[1], -item[0]), default=(None, 0))
+        return {
+            "days": self.days,
+            "days_without_data": self.days_without_data,
+            "days_with_window": dict(self.days_with),
+            "days_with_window_pct": {hours: days / self.days * 100 if self.days else 0.0
+                                     for hours, days in self.days_with.items()},
+            "longest_mean_hours": _hours(statistics.fmean(longest)) if longest else 0.0,
+            "longest_median_hours": _hours(statistics.median(longest)) if longest else 0.0,
+            "longest_histogram": dict(sorted(histogram.items())),
+            "spells": self.spell_count,
+            "spell_mean_hours": _hours(self.spell_minutes / self.spell_count) if self.spell_count else 0.0,
+            "window_start_median": _clock(statistics.median(self.spell_starts)) if self.spell_starts else None,
+            "start_hours": dict(sorted(self.start_hours.items())),
+            "best_start_hour": best[0],
+        }
+
+
+def spell_statistics(conn, station, ruleset="default", start_date="01-01-2024", end_date="31-12-2024",
+                     local_start_hour=8, local_end_hour=18, local_start_hour_summer=8, local_end_hour_summer=20,
+                     durations=(1, 2, 3, 4), start_duration=3, max_gap=MAX_REPORT_GAP, tz_name=None, daylight=False):
+    '''
+    Flyable spell statistics for a station over the local-hours windows of
+    every day from start_date to end_date, from stored METARs (evaluating any
+    not yet analysed with the ruleset, but not fetching missing ones).
+    :return: Dict with the days with data, days_with_window (days whose
+        longest spell lasted at least each of durations hours, also as
+        days_with_window_pct), the mean, median and histogram by whole hours
+        of the longest spell per day, spell count and mean length, the median
+        local start of spells of at least start_duration hours, and
+        start_hours: for each local hour, the days a start_duration window
+        starting then was flyable throughout, with the best of them as
+        best_start_hour.
+    :param tz_name: Zone of the local hours, by default the station's.
+    :param daylight: Use each day's sunrise to sunset instead of the local
+        hours (see metar_stations.daylight_windows).'''
+    ruleset = resolve_ruleset(conn, ruleset)
+    tz_name = tz_name or station_timezone(station)
+    start = datetime.strptime(start_date, "%d-%m-%Y")
+    end = datetime.strptime(end_date, "%d-%m-%Y")
+    hours = DAYLIGHT if daylight else (local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer)
+    windows = station_utc_windows(station, start, end, hours, tz_name)
+    stats = SpellStatistics(_local_shifts(windows, tz_name), durations, start_duration)
+    if windows:
+        update_analysis(conn, station, windows[0][0], windows[-1][1], ruleset)
+        rows = read_analysis_stage(conn, station, windows, ruleset)
+        for day in day_spells(rows, windows_to_epoch(windows), max_gap):
+            stats.add(*day)
+    return {"station": station, "ruleset": ruleset.name, "ruleset_version": ruleset.version, **stats.result()}
+
+
+def compare_spells(conn, stations, rulesets=("default",), **kwargs):
+    '''spell_statistics for every station and ruleset, as a list of result dicts.'''
+    return [spell_statistics(conn, station, ruleset, **kwargs) for station in stations for ruleset in rulesets]
+
+
+def print_spells(result):
+    print(f"\n{result['station']} ({result['ruleset']} v{result['ruleset_version']}): "
+          f"{result['days']} days with reports, {result['days_without_data']} without")
+    for hours, days in result["days_with_window"].items():
+        print(f"  Days with a {hours}h flyable window: {days} ({result['days_with_window_pct'][hours]:.1f}%)")
+    print(f"  Longest spell per day: mean {result['longest_mean_hours']}h, median {result['longest_median_hours']}h")
+    print(f"  {result['spells']} spells, mean {result['spell_mean_hours']}h")
+    if result["best_start_hour"] is not None:
+        print(f"  Typical window start {result['window_start_median']}, "
+              f"best start hour {result['best_start_hour']:02d}:00 "
+              f"({result['start_hours'][result['best_start_hour']]} days)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Continuous flyable spells per day")
+    parser.add_argument("stations", help="comma-separated stations")
+    parser.add_argument("--rulesets", default="default", help="comma-separated ruleset names")
+    parser.add_argument("--start", default="01-01-2024", help="first day, dd-mm-YYYY")
+    parser.add_argument("--end", default="31-12-2024", help="last day, dd-mm-YYYY")
+    parser.add_argument("--hours", type=int, nargs=2, default=(8, 18), metavar=("FIRST", "LAST"),
+                        help="local hours in winter")
+    parser.add_argument("--summer-hours", type=int, nargs=2, default=(8, 20), metavar=("FIRST", "LAST"),
+                        help="local hours in summer")
+    parser.add_argument("--daylight", action="store_true", help="sunrise to sunset instead of the hours")
+    parser.add_argument("--durations", default="1,2,3,4", help="window lengths in hours to count days for")
+    parser.add_argument("--start-duration", type=int, default=3, help="window length for best start hour")
+    parser.add_argument("--max-gap", type=int, default=MAX_REPORT_GAP, help="minutes a report holds for")
+    parser.add_argument("--db", default=None, help="database file")
+    args = parser.parse_args()
+
+    conn = get_connection(args.db)
+    results = compare_spells(
+        conn, args.stations.split(","), args.rulesets.split(","), start_date=args.start, end_date=args.end,
+        local_start_hour=args.hours[0], local_end_hour=args.hours[1],
+        local_start_hour_summer=args.summer_hours[0], local_end_hour_summer=args.summer_hours[1],
+        durations=tuple(int(hours) for hours in args.durations.split(",")),
+        start_duration=args.start_duration, max_gap=args.max_gap, daylight=args.daylight)
+    for result in results:
+        print_spells(result)
+
+
+if __name__ == "__main__":
+    main()
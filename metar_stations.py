@@ -0,0 +1,168 @@
+import math
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from metar_time import epoch_windows, to_epoch_minutes, from_epoch_minutes
+
+# Zone of stations that are neither registered nor matched by ICAO prefix,
+# which is what every analysis assumed before stations had their own
+DEFAULT_TIMEZONE = "Europe/London"
+
+# Value of hours asking for sunrise to sunset windows instead of fixed local
+# hours, shrunk by DAYLIGHT_MARGIN minutes at both ends
+DAYLIGHT = "daylight"
+DAYLIGHT_MARGIN = 30
+
+# (Ogimet state= name, IANA zone) by ICAO prefix, for stations not in STATIONS
+ICAO_PREFIXES = {
+    "EG": ("United Kingdom", "Europe/London"),
+    "EI": ("Ireland", "Europe/Dublin"),
+    "EB": ("Belgium", "Europe/Brussels"),
+    "EH": ("Netherlands", "Europe/Amsterdam"),
+    "ED": ("Germany", "Europe/Berlin"),
+    "ET": ("Germany", "Europe/Berlin"),
+    "EK": ("Denmark", "Europe/Copenhagen"),
+    "EN": ("Norway", "Europe/Oslo"),
+    "ES": ("Sweden", "Europe/Stockholm"),
+    "EF": ("Finland", "Europe/Helsinki"),
+    "LF": ("France", "Europe/Paris"),
+    "LE": ("Spain", "Europe/Madrid"),
+    "LP": ("Portugal", "Europe/Lisbon"),
+    "LI": ("Italy", "Europe/Rome"),
+    "LS": ("Switzerland", "Europe/Zurich"),
+    "LO": ("Austria", "Europe/Vienna"),
+}
+
+
+class Station:
+    '''
+    What the analyses need to know about a station beyond its reports.
+    :param tz: IANA time zone its local hours are in.
+    :param state: Ogimet state= name, overriding the ICAO prefix guess.
+    :param lat: Latitude in degrees north, needed for daylight windows.
+    :param lon: Longitude in degrees east.'''
+
+    def __init__(self, icao, tz, state=None, lat=None, lon=None, name=None):
+        self.icao = icao
+        self.tz = tz
+        self.state = state
+        self.lat = lat
+        self.lon = lon
+        self.name = name
+
+    def __repr__(self):
+        return f"Station({self.icao!r}, {self.tz!r})"
+
+
+STATIONS = {}
+
+
+def register_station(icao, tz, state=None, lat=None, lon=None, name=None):
+    '''Adds or replaces a station in the registry, by default in the state of its ICAO prefix.'''
+    if state is None:
+        state = ICAO_PREFIXES.get(icao[:2], (None, None))[0]
+    STATIONS[icao] = Station(icao, tz, state, lat, lon, name)
+    return STATIONS[icao]
+
+
+register_station("EGKA", "Europe/London", "United Kingdom", 50.8356, -0.2972, "Shoreham")
+register_station("EGKK", "Europe/London", "United Kingdom", 51.1481, -0.1903, "London Gatwick")
+register_station("EGLL", "Europe/London", "United Kingdom", 51.4775, -0.4614, "London Heathrow")
+register_station("EGHI", "Europe/London", "United Kingdom", 50.9503, -1.3568, "Southampton")
+register_station("EIDW", "Europe/Dublin", "Ireland", 53.4213, -6.2701, "Dublin")
+register_station("LFPG", "Europe/Paris", "France", 49.0097, 2.5479, "Paris Charles de Gaulle")
+register_station("EHAM", "Europe/Amsterdam", "Netherlands", 52.3086, 4.7639, "Amsterdam Schiphol")
+register_station("EDDF", "Europe/Berlin", "Germany", 50.0333, 8.5706, "Frankfurt")
+
+
+def get_station(icao):
+    '''
+    The registered Station, or one with the state and zone guessed from the
+    ICAO prefix; the state is None for unknown prefixes.'''
+    station = STATIONS.get(icao)
+    if station is None:
+        state, tz = ICAO_PREFIXES.get(icao[:2], (None, DEFAULT_TIMEZONE))
+        station = Station(icao, tz, state)
+    return station
+
+
+def station_timezone(icao):
+    return get_station(icao).tz
+
+
+def group_by_timezone(stations):
+    '''Dict of zone -> the given stations in it, in their original order.'''
+    groups = {}
+    for station in stations:
+        groups.setdefault(station_timezone(station), []).append(station)
+    return groups
+
+
+def station_windows(icao, start, end, hours, tz_name=None):
+    '''
+    A station's daily local-hours windows from start to end (dates or
+    datetimes, inclusive) as epoch-minute (utc_start, utc_end) pairs, from
+    the schedule metar_time caches per zone, hours and year.
+    :param hours: (local_start_hour, local_end_hour, local_start_hour_summer,
+        local_end_hour_summer), or DAYLIGHT for daylight_windows.
+    :param tz_name: Zone of the hours, by default the station's.'''
+    if hours == DAYLIGHT:
+        return daylight_windows(icao, start, end, DAYLIGHT_MARGIN)
+    return epoch_windows(start, end, tuple(hours), tz_name or station_timezone(icao))
+
+
+def station_utc_windows(icao, start, end, hours, tz_name=None):
+    '''station_windows as naive UTC datetime pairs, like metar_time.build_utc_windows.'''
+    return [(from_epoch_minutes(begin), from_epoch_minutes(finish))
+            for begin, finish in station_windows(icao, start, end, hours, tz_name)]
+
+
+def _sun_times(lat, lon, day, zenith):
+    # NOAA's approximation of sunrise and sunset in UTC minutes after
+    # midnight, None when the sun does not cross the zenith that day
+    n = day.timetuple().tm_yday
+    gamma = 2 * math.pi / 365 * (n - 1)
+    eqtime = 229.18 * (0.000075 + 0.001868 * math.cos(gamma) - 0.032077 * math.sin(gamma)
+                       - 0.014615 * math.cos(2 * gamma) - 0.040849 * math.sin(2 * gamma))
+    decl = (0.006918 - 0.399912 * math.cos(gamma) + 0.070257 * math.sin(gamma)
+            - 0.006758 * math.cos(2 * gamma) + 0.000907 * math.sin(2 * gamma)
+            - 0.002697 * math.cos(3 * gamma) + 0.00148 * math.sin(3 * gamma))
+    phi = math.radians(lat)
+    cos_ha = (math.cos(math.radians(zenith)) / (math.cos(phi) * math.cos(decl))
+              - math.tan(phi) * math.tan(decl))
+    if not -1 <= cos_ha <= 1:
+        return None
+    ha = math.degrees(math.acos(cos_ha))
+    return 720 - 4 * (lon + ha) - eqtime, 720 - 4 * (lon - ha) - eqtime
+
+
+@lru_cache(maxsize=64)
+def _year_daylight(icao, year, margin):
+    station = get_station(icao)
+    if station.lat is None or station.lon is None:
+        raise ValueError(f"No coordinates registered for {icao}")
+    windows = []
+    day = date(year, 1, 1)
+    while day.year == year:
+        times = _sun_times(station.lat, station.lon, day, 90.833)
+        if times is not None:
+            midnight = to_epoch_minutes(datetime.combine(day, datetime.min.time()))
+            windows.append((midnight + round(times[0]) + margin, midnight + round(times[1]) - margin))
+        day += timedelta(days=1)
+    return tuple(windows)
+
+
+def daylight_windows(icao, start, end, margin=DAYLIGHT_MARGIN):
+    '''
+    Sunrise to sunset windows of a station per UTC day from start to end,
+    shrunk by margin minutes at both ends, as epoch-minute pairs like
+    station_windows. Needs the station's coordinates; cached per year.
+    Days without a sunrise or sunset (polar day or night) are left out.'''
+    start = start.date() if isinstance(start, datetime) else start
+    end = end.date() if isinstance(end, datetime) else end
+    first = to_epoch_minutes(datetime.combine(start, datetime.min.time()))
+    last = to_epoch_minutes(datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    windows = []
+    for year in range(start.year, end.year + 1):
+        windows.extend(window for window in _year_daylight(icao, year, margin)
+                       if first <= window[0] < last and window[0] < window[1])
+    return windows
@@ -0,0 +1,197 @@
+from bisect import bisect_right
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Offsets are sampled this often when looking for a zone's transitions, so
+# two changes less than this far apart could be missed; no zone does that
+TRANSITION_SCAN_STEP = 7 * 1440
+
+
+def _zone_state(tz, minutes):
+    local = (EPOCH + timedelta(minutes=minutes)).replace(tzinfo=timezone.utc).astimezone(tz)
+    return local.utcoffset() // timedelta(minutes=1)
+
+
+@lru_cache(maxsize=64)
+def offset_segments(tz_name, year):
+    '''
+    The UTC offsets in force in a zone over a year (with a couple of days'
+    margin), found from its transitions rather than day by day.
+    :return: Tuple of (utc start in epoch minutes, offset in minutes,
+        summer) from each transition on, summer meaning ahead of the zone's
+        lowest offset of the year. That, unlike dst(), also holds for zones
+        such as Europe/Dublin whose tz data puts the saving in winter.'''
+    tz = ZoneInfo(tz_name)
+    begin = to_epoch_minutes(datetime(year, 1, 1)) - 2 * 1440
+    end = to_epoch_minutes(datetime(year + 1, 1, 1)) + 2 * 1440
+    changes = [(begin, _zone_state(tz, begin))]
+    t = begin
+    while t < end:
+        step = min(t + TRANSITION_SCAN_STEP, end)
+        offset = _zone_state(tz, step)
+        if offset == changes[-1][1]:
+            t = step
+            continue
+        # Bisect down to the first minute of the new offset
+        lo, hi = t, step
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if _zone_state(tz, mid) == changes[-1][1]:
+                lo = mid
+            else:
+                hi = mid
+        changes.append((hi, _zone_state(tz, hi)))
+        t = hi
+    standard = min(offset for _, offset in changes)
+    return tuple((start, offset, offset > standard) for start, offset in changes)
+
+
+def _local_to_utc(segments, starts, local):
+    # Epoch minutes and summer flag for a local wall time given in epoch
+    # minutes. A local time repeated when clocks go back takes the later
+    # (standard) offset, one skipped when they go forward the earlier.
+    i = max(bisect_right(starts, local - 1440) - 1, 0)
+    while i + 1 < len(segments) and local - segments[i + 1][1] >= segments[i + 1][0]:
+        i += 1
+    return local - segments[i][1], segments[i][2]
+
+
+@lru_cache(maxsize=256)
+def year_windows(tz_name, hours, year):
+    '''
+    The daily local-hours windows of every day of a year as epoch-minute
+    (utc_start, utc_end) pairs, computed once per zone, hours and year.
+    :param hours: (local_start_hour, local_end_hour, local_start_hour_summer,
+        local_end_hour_summer).'''
+    segments = offset_segments(tz_name, year)
+    starts = [segment[0] for segment in segments]
+    start_hour, end_hour, summer_start_hour, summer_end_hour = hours
+    first_day = to_epoch_minutes(datetime(year, 1, 1))
+    days = (date(year + 1, 1, 1) - date(year, 1, 1)).days
+    windows = []
+    for day in range(days):
+        midnight = first_day + day * 1440
+        begin, summer = _local_to_utc(segments, starts, midnight + start_hour * 60)
+        if summer:
+            begin, _ = _local_to_utc(segments, starts, midnight + summer_start_hour * 60)
+            end, _ = _local_to_utc(segments, starts, midnight + summer_end_hour * 60)
+        else:
+            end, _ = _local_to_utc(segments, starts, midnight + end_hour * 60)
+        windows.append((begin, end))
+    return tuple(windows)
+
+
+def epoch_windows(start, end, hours, tz_name="Europe/London"):
+    '''
+    Like build_utc_windows, in epoch minutes, sliced from the cached
+    year_windows.'''
+    start = start.date() if isinstance(start, datetime) else start
+    end = end.date() if isinstance(end, datetime) else end
+    hours = tuple(hours)
+    windows = []
+    for year in range(start.year, end.year + 1):
+        jan1 = date(year, 1, 1)
+        first = (max(start, jan1) - jan1).days
+        last = (min(end, date(year, 12, 31)) - jan1).days
+        windows.extend(year_windows(tz_name, hours, year)[first:last + 1])
+    return windows
+
+
+def build_utc_windows(start, end, local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer, tz_name="Europe/London"):
+    '''
+    Builds the daily local-hours windows between two dates as UTC intervals.
+    :param start: First day (datetime or date).
+    :param end: Last day, inclusive.
+    :param tz_name: IANA zone of the local hours, see metar_stations.station_timezone.
+    :return: List of (utc_start, utc_end) naive UTC datetimes, sorted and
+        non-overlapping. Summer hours are used on days where DST is in force.'''
+    hours = (local_start_hour, local_end_hour, local_start_hour_summer, local_end_hour_summer)
+    return [(EPOCH + timedelta(minutes=begin), EPOCH + timedelta(minutes=finish))
+            for begin, finish in epoch_windows(start, end, hours, tz_name)]
+
+
+def filter_to_windows(items, windows, key=lambda item: item):
+    '''
+    Yields the items whose key falls inside one of the windows (bounds
+    inclusive). Both items and windows must be sorted ascending, so this is a
+    single merge pass over the two sequences.'''
+    windows = iter(windows)
+    window = next(windows, None)
+    for item in items:
+        k = key(item)
+        while window is not None and k > window[1]:
+            window = next(windows, None)
+        if window is None:
+            return
+        if k >= window[0]:
+            yield item
+
+
+def windows_to_epoch(windows):
+    '''Converts (begin, end) datetime windows to epoch minutes, as stored in the DB.'''
+    return [(to_epoch_minutes(s), to_epoch_minutes(e)) for s, e in windows]
+
+
+def merge_intervals(intervals, tolerance=timedelta(minutes=1)):
+    '''
+    Merges (begin, end) intervals that overlap or are within tolerance of each
+    other. Returns a new sorted list.'''
+    merged = []
+    for begin, end in sorted(intervals):
+        if merged and begin <= merged[-1][1] + tolerance:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((begin, end))
+    return merged
+
+
+def interval_gaps(begin, end, covered, step=timedelta(minutes=1), lo=0):
+    '''
+    Returns the parts of the closed interval [begin, end] that are not inside
+    any of the covered intervals. covered must be sorted and merged, step is
+    the resolution of the timestamps and lo is the first index of covered
+    worth looking at.'''
+    gaps = []
+    cursor = begin
+    for i in range(lo, len(covered)):
+        cov_begin, cov_end = covered[i]
+        if cov_end < cursor:
+            continue
+        if cov_begin > end:
+            break
+        if cov_begin > cursor:
+            gaps.append((cursor, cov_begin - step))
+        cursor = cov_end + step
+        if cursor > end:
+            return gaps
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def window_gaps(windows, covered, step=timedelta(minutes=1)):
+    '''
+    Returns the uncovered parts of every window, in order. windows and
+    covered must both be sorted, with covered merged, so the two lists are
+    walked together once.'''
+    gaps = []
+    lo = 0
+    for begin, end in windows:
+        while lo < len(covered) and covered[lo][1] < begin:
+            lo += 1
+        gaps.extend(interval_gaps(begin, end, covered, step, lo))
+    return gaps
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_minutes(dt):
+    '''Minutes since 1970-01-01 for a naive UTC datetime.'''
+    return (dt - EPOCH) // timedelta(minutes=1)
+
+
+def from_epoch_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
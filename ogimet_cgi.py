@@ -1,4 +1,84 @@
+import os
+import re
+import threading
+from datetime import datetime, timedelta, timezone
 import requests
+from requests.adapters import HTTPAdapter
+import metar_metrics
+
+
+_RETRY_IN_RE = re.compile(r"(\d+)\s*(second|sec|minute|min|hour)s?\b", re.IGNORECASE)
+_RETRY_AT_RE = re.compile(r"\b(\d{1,2}):(\d{2})(?::\d{2})?\s*(?:UTC|GMT|Z)\b", re.IGNORECASE)
+_UNIT_SECONDS = {"sec": 1, "second": 1, "min": 60, "minute": 60, "hour": 3600}
+
+
+def quota_retry_delay(message, now=None):
+    '''
+    Reads how long to wait from a quota message, which either says how long
+    ("try again in 5 minutes") or when the quota resets ("at 14:00 UTC").
+    :return: Seconds to wait, or None if the message does not say.'''
+    m = _RETRY_IN_RE.search(message)
+    if m:
+        return int(m.group(1)) * _UNIT_SECONDS[m.group(2).lower()]
+    m = _RETRY_AT_RE.search(message)
+    if m:
+        now = now or datetime.now(timezone.utc)
+        reset = now.replace(hour=int(m.group(1)), minute=int(m.group(2)), second=0, microsecond=0)
+        if reset <= now:
+            reset += timedelta(days=1)
+        return (reset - now).total_seconds()
+    return None
+
+
+class OgimetQuotaError(Exception):
+    '''
+    Ogimet refused a request because the quota is used up. retry_after is the
+    wait in seconds the message asked for, or None.'''
+
+    def __init__(self, message=""):
+        super().__init__(message)
+        self.retry_after = quota_retry_delay(message)
+
+
+# Longest quota wait a fetch sleeps through before giving up on the request
+MAX_QUOTA_WAIT = 15 * 60
+
+# Errors after which a request is worth retrying
+RETRYABLE_ERRORS = (OgimetQuotaError, requests.RequestException)
+
+
+# Server every Ogimet request goes to. The OGIMET_URL environment variable
+# or set_base_url can point it elsewhere, e.g. at the benchmark stand-in in
+# benchmarks/ogimet_standin.py.
+DEFAULT_BASE_URL = "http://www.ogimet.com"
+
+_base_url = None
+_session = None
+_session_lock = threading.Lock()
+
+
+def set_base_url(url):
+    global _base_url
+    _base_url = url.rstrip("/") if url else None
+
+
+def base_url():
+    return _base_url or os.environ.get("OGIMET_URL", "").rstrip("/") or DEFAULT_BASE_URL
+
+
+def get_session(pool_size=16):
+    '''
+    Returns the keep-alive session shared by all fetches, creating it on first
+    use with a connection pool large enough for pool_size threads.'''
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
 
 
 def fetch_metar(
@@ -7,39 +87,135 @@ def fetch_metar(
     begin="202405010000",
     end="202405012359",
     lang="eng",
-    header="no"
+    header="no",
+    session=None,
+    timeout=60
+):
+    url, params = _getmetar_request(icao, state, begin, end, lang, header)
+
+    # print(f"Fetching METAR data with params: {params}")
+    if session is None:
+        session = get_session()
+    with metar_metrics.timer("http.request"):
+        response = session.get(url, params=params, timeout=timeout)
+        response.raise_for_status()
+    metar_metrics.count("http.bytes", len(response.content))
+    if "quota limit" in response.text:
+        metar_metrics.count("http.quota_responses")
+        # Ogimet answers 200 with a message when the quota is exhausted; an
+        # empty result here must not be mistaken for "no reports"
+        raise OgimetQuotaError(response.text.strip())
+
+    lines = response.text.strip().split("\n")
+
+    # Skip header if present
+    if header == "yes":
+        lines = lines[1:]
+
+    formatted_lines = []
+    for line in lines:
+        formatted_line = format_getmetar_line(line)
+        if formatted_line is not None:
+            formatted_lines.append(formatted_line)
+    return formatted_lines
+
+
+def iter_metar(
+    icao=None,
+    state=None,
+    begin="202405010000",
+    end="202405012359",
+    lang="eng",
+    header="no",
+    session=None,
+    timeout=60
 ):
-    base_url = "http://www.ogimet.com/cgi-bin/getmetar"
+    '''
+    Streaming fetch_metar. Yields (icao, stamp, body) for each report as the
+    response arrives, stamp being the "YYYYmmddHHMM" UTC time and body the
+    report text, ready for Metar.from_parts. Only one line is held at a time, so
+    large state= requests can be parsed while they download.
+    Raises OgimetQuotaError if Ogimet answers with the quota message.'''
+    url, params = _getmetar_request(icao, state, begin, end, lang, header)
+    if session is None:
+        session = get_session()
+    with metar_metrics.timer("http.request"):
+        response = session.get(url, params=params, timeout=timeout, stream=True)
+        response.raise_for_status()
+    received = 0
+
+    def chunks():
+        # Counted as they arrive, in the same bytes fetch_metar reports
+        nonlocal received
+        for chunk in response.iter_content(chunk_size=65536):
+            received += len(chunk)
+            yield chunk
+
+    try:
+        for line in _decoded_lines(chunks(), response.encoding or "utf-8"):
+            report = parse_getmetar_line(line)
+            if report is not None:
+                yield report
+            elif "quota limit" in line:
+                metar_metrics.count("http.quota_responses")
+                raise OgimetQuotaError(line.strip())
+    finally:
+        response.close()
+        metar_metrics.count("http.bytes", received)
+
+
+def _decoded_lines(chunks, encoding):
+    # Splits a stream of byte chunks into decoded lines without their line ends
+    pending = b""
+    for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip(b"\r").decode(encoding, "replace")
+    if pending:
+        yield pending.rstrip(b"\r").decode(encoding, "replace")
+
+
+def _getmetar_request(icao, state, begin, end, lang, header):
     params = {
         "begin": begin,
         "end": end,
         "lang": lang,
         "header": header,
     }
-
     if icao:
         params["icao"] = icao
     if state:
         params["state"] = state
+    return f"{base_url()}/cgi-bin/getmetar", params
 
-    # print(f"Fetching METAR data with params: {params}")
-    response = requests.get(base_url, params=params)
 
-    lines = response.text.strip().split("\n")
+def parse_getmetar_line(line):
+    '''
+    Splits one "icao,year,month,day,hour,minute,metar" line of getmetar
+    output into (icao, stamp, body), stamp being "YYYYmmddHHMM". Returns None
+    for lines that are not reports, such as headers, messages or blank lines.'''
+    parts = line.split(",", 6)
+    if len(parts) != 7:
+        return None
+    icao_code, year, month, day, hour, minute, body = parts
+    stamp = year + month + day + hour + minute
+    if len(stamp) != 12 or not stamp.isdigit():
+        return None
+    return icao_code, stamp, body
 
-    # Skip header if present
-    if header == "yes":
-        lines = lines[1:]
 
-    formatted_lines = []
-    for line in lines:
-        parts = line.split(",")
-        if len(parts) == 7:
-            icao_code, year, month, day, hour, minute, metar = parts
-            timestamp = f"{year}{month}{day}{hour}{minute}"
-            formatted_line = f"{timestamp} {metar}"
-            formatted_lines.append(formatted_line)
-    return formatted_lines
+def format_getmetar_line(line):
+    '''
+    Turns one "icao,year,month,day,hour,minute,metar" line of getmetar output
+    into the "YYYYmmddHHMM METAR..." form Metar expects. Returns None for
+    lines that are not reports, such as headers or blank lines.'''
+    parts = line.split(",")
+    if len(parts) == 7:
+        icao_code, year, month, day, hour, minute, metar = parts
+        timestamp = f"{year}{month}{day}{hour}{minute}"
+        return f"{timestamp} {metar}"
+    return None
 
 
 # Example usage
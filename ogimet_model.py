@@ -1,8 +1,65 @@
 import re
 from datetime import datetime
-from ast import literal_eval
+from metar_time import to_epoch_minutes, from_epoch_minutes
+import metar_metrics
+
+_REPORT_TYPES = frozenset(('METAR', 'SPECI'))
+_DIGITS = frozenset('0123456789')
+_CLOUD_START = frozenset('FSBO')
+_WIND_RE = re.compile(r'(\d{3}|VRB)(\d{2,3})G?(\d{2,3})?KT')
+_CLOUD_RE = re.compile(r'(FEW|SCT|BKN|OVC)(\d{3})')
+_QNH_RE = re.compile(r'Q(\d{4})')
+_TEMP_DEW_RE = re.compile(r'(\d{2}|M\d{2})/(\d{2}|M\d{2})$')
+_WEATHER_RE = re.compile(r'[-+]?(?:VC)?(?:RA|SN|BR|FG|HZ|TS|DZ|SH|PL|GR|GS|UP)')
+
+
+def _station_tokens(parts):
+    # The station and the groups after it, from a report split after its timestamp
+    i = 0
+    if parts[i] in _REPORT_TYPES:
+        i += 1
+    if parts[i] == 'COR':
+        i += 1
+    station = parts[i]
+    tokens = parts[i + 1:]
+    if tokens:
+        tokens[-1] = tokens[-1].rstrip('=')
+        if not tokens[-1]:
+            del tokens[-1]
+    return station, tokens
+
+
+def encode_clouds(clouds):
+    '''Stores cloud layers as e.g. "SCT012 BKN020", or None for no layers.'''
+    if not clouds:
+        return None
+    return " ".join(cover + height for cover, height in clouds)
+
+
+def decode_clouds(text):
+    if not text:
+        return None
+    return [(layer[:3], layer[3:]) for layer in text.split()]
+
+
+def encode_weather(weather):
+    '''Stores weather groups space-separated, e.g. "-RA BR", or None.'''
+    if not weather:
+        return None
+    return " ".join(weather)
+
+
+def decode_weather(text):
+    if not text:
+        return None
+    return text.split()
+
 
 class Metar:
+    __slots__ = ('raw', 'station', 'time', 'wind_speed', 'wind_direction', 'wind_gust',
+                 'visibility', 'clouds', 'base', 'ceiling', 'weather', 'qnh',
+                 'temperature', 'dewpoint')
+
     def __init__(self, raw: str, parse: bool = True):
         self.raw = raw
         self.station = None
@@ -20,65 +77,159 @@ class Metar:
         self.dewpoint = None
 
         if parse and raw is not None:
-            self.parse()
+            if metar_metrics.enabled:
+                with metar_metrics.timer("parse"):
+                    self.parse()
+            else:
+                self.parse()
 
     @classmethod
-    def from_db_row(cls, row):
+    def from_parts(cls, stamp, body):
+        '''
+        Builds and parses a Metar from a "YYYYmmddHHMM" timestamp and the
+        report text ("METAR EGKA 010000Z ..."), as ogimet_cgi.iter_metar
+        yields them, without joining them into one string to split again.'''
+        obj = cls(raw=None, parse=False)
+        obj.raw = stamp + " " + body
+        obj.time = datetime(int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                            int(stamp[8:10]), int(stamp[10:12]))
+        if metar_metrics.enabled:
+            with metar_metrics.timer("parse"):
+                obj._parse_groups(body.split())
+        else:
+            obj._parse_groups(body.split())
+        return obj
+
+    @classmethod
+    def lazy(cls, raw):
+        '''
+        A LazyMetar for the raw "YYYYmmddHHMM METAR ..." string: the station
+        now, every other field group when it is first read.'''
+        return LazyMetar(raw)
+
+    @classmethod
+    def from_db_row(cls, row, lazy=False):
+        '''
+        Builds a Metar from a metars table row. With lazy=True the fields are
+        only converted from the row when they are first read.'''
+        if lazy:
+            return LazyMetar.from_db_row(row)
         obj = cls(raw=row['raw'], parse=False)
         obj.station = row['station']
-        obj.time = datetime.fromisoformat(row['time']) if isinstance(row['time'], str) else row['time']
+        obj.time = from_epoch_minutes(row['time'])
         obj.wind_speed = row['wind_speed']
         obj.wind_direction = row['wind_direction']
         obj.wind_gust = row['wind_gust']
         obj.visibility = row['visibility']
-        obj.clouds = literal_eval(row['clouds']) if row['clouds'] != "null" else None
+        obj.clouds = decode_clouds(row['clouds'])
         obj.base = row['base']
         obj.ceiling = row['ceiling']
-        obj.weather = literal_eval(row['weather']) if row['weather'] != "null" else None
-        obj.qnh = [row['qnh']] if row['qnh'] else None
+        obj.weather = decode_weather(row['weather'])
+        obj.qnh = row['qnh']
         obj.temperature = row['temperature']
         obj.dewpoint = row['dewpoint']
         return obj
 
+    def to_db_row(self):
+        '''
+        Returns the values for a row of the metars table, in the column order
+        used by ogimet_utils.INSERT_METAR_SQL.'''
+        return (
+            self.station,
+            to_epoch_minutes(self.time),
+            self.raw,
+            self.wind_direction,
+            self.wind_speed,
+            self.wind_gust,
+            self.visibility,
+            encode_clouds(self.clouds),
+            self.ceiling,
+            self.base,
+            encode_weather(self.weather),
+            self.qnh,
+            self.temperature,
+            self.dewpoint
+        )
+
     def parse(self):
+        '''
+        Fills the fields from the raw "YYYYmmddHHMM METAR ..." string in one
+        pass over its whitespace-separated groups, dispatching on the shape of
+        each group. Where a group can appear more than once the first one wins,
+        except for clouds and weather, which collect every match.'''
         parts = self.raw.split()
-        if parts[2] == 'COR':
-            parts.pop(2)
-
-        self.station = parts[2]
-        self.time = datetime.strptime(parts[0], '%Y%m%d%H%M')
-
-        wind_match = re.findall(
-            r'(\d{3}|VRB)(\d{2,3})G?(\d{2,3})?KT', self.raw)
-        if wind_match:
-            self.wind_direction = wind_match[0][0] if wind_match[0][0] != 'VRB' else 'VRB'
-            self.wind_speed = int(wind_match[0][1])
-            if wind_match[0][2]:
-                self.wind_gust = int(wind_match[0][2])
-
-        vis_match = re.search(r'\s(\d{4})\s', self.raw)
-        if vis_match:
-            self.visibility = int(vis_match.group(1))
-
-        clouds = re.findall(r'(FEW|SCT|BKN|OVC)(\d{3})', self.raw)
-        if clouds != []:
+        stamp = parts[0]
+        self.time = datetime(int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                             int(stamp[8:10]), int(stamp[10:12]))
+        del parts[0]
+        self._parse_groups(parts)
+
+    def _parse_groups(self, parts):
+        # Everything after the timestamp: report type, station and groups
+        self.station, tokens = _station_tokens(parts)
+
+        clouds = []
+        weather = []
+        temp_dew = None
+        for token in tokens:
+            first = token[0]
+            if first in _DIGITS:
+                if self.wind_speed is None and token.endswith('KT'):
+                    m = _WIND_RE.match(token)
+                    if m:
+                        self._set_wind(m)
+                        continue
+                if len(token) == 4:
+                    if self.visibility is None and token.isdigit():
+                        self.visibility = int(token)
+                    continue
+                if temp_dew is None and '/' in token:
+                    m = _TEMP_DEW_RE.match(token)
+                    if m:
+                        temp_dew = m.groups()
+                continue
+            if first in _CLOUD_START:
+                m = _CLOUD_RE.match(token)
+                if m:
+                    clouds.append(m.groups())
+                    continue
+            elif first == 'Q':
+                if self.qnh is None:
+                    m = _QNH_RE.match(token)
+                    if m:
+                        self.qnh = int(m.group(1))
+                continue
+            elif first == 'M':
+                if temp_dew is None:
+                    m = _TEMP_DEW_RE.match(token)
+                    if m:
+                        temp_dew = m.groups()
+                continue
+            elif first == 'V' and self.wind_speed is None and token.endswith('KT'):
+                m = _WIND_RE.match(token)
+                if m:
+                    self._set_wind(m)
+                    continue
+            m = _WEATHER_RE.match(token)
+            if m:
+                weather.append(m.group(0))
+
+        if clouds:
             self.clouds = clouds
         self.base = self.get_base()
         self.ceiling = self.get_ceiling()
+        if temp_dew is not None:
+            self.temperature = self.get_temperature(temp_dew)
+            self.dewpoint = self.get_dewpoint(temp_dew)
+        if weather:
+            self.weather = weather
 
-        self.qnh = re.findall(r'Q(\d{4})', self.raw)
-
-        temp_dew = re.findall(r'(\d{2}|M\d{2})\/(\d{2}|M\d{2})', self.raw)
-        if temp_dew and temp_dew[0][0] != '//' and temp_dew[0][1] != '//':
-            self.temperature = self.get_temperature(temp_dew[0])
-            self.dewpoint = self.get_dewpoint(temp_dew[0])
-
-        wx_match = re.findall(r'\s(-|\+)?(VC)?(RA|SN|BR|FG|HZ|TS|DZ|SH|PL|GR|GS|UP)', self.raw)
-        if wx_match:
-            merged_wx = []
-            for wx in wx_match:
-                merged_wx.append(f'{wx[0]}{wx[1]}{wx[2]}')
-            self.weather = merged_wx
+    def _set_wind(self, match):
+        direction, speed, gust = match.groups()
+        self.wind_direction = direction
+        self.wind_speed = int(speed)
+        if gust:
+            self.wind_gust = int(gust)
 
     def get_temperature(self, temp_dew):
         t = temp_dew[0]
@@ -164,4 +315,166 @@ class Metar:
         else:
             max_temp_ok = True  
 
-        return vis_ok and ceiling_ok and wind_ok and gust_ok and base_ok and weather_ok and min_temp_ok and max_temp_ok
\ No newline at end of file
+        return vis_ok and ceiling_ok and wind_ok and gust_ok and base_ok and weather_ok and min_temp_ok and max_temp_ok
+
+# Decoders for LazyMetar, one per field group, each setting every field of its
+# group. Each picks out the groups Metar._parse_groups would have given that
+# field, so a lazy Metar reads the same as an eagerly parsed one.
+
+def _decode_time(m, tokens):
+    stamp = m.raw
+    m.time = datetime(int(stamp[0:4]), int(stamp[4:6]), int(stamp[6:8]),
+                      int(stamp[8:10]), int(stamp[10:12]))
+
+
+def _decode_wind(m, tokens):
+    m.wind_direction = m.wind_speed = m.wind_gust = None
+    for token in tokens:
+        if (token[0] in _DIGITS or token[0] == 'V') and token.endswith('KT'):
+            match = _WIND_RE.match(token)
+            if match:
+                m._set_wind(match)
+                return
+
+
+def _decode_visibility(m, tokens):
+    m.visibility = None
+    for token in tokens:
+        if len(token) == 4 and token[0] in _DIGITS and token.isdigit():
+            m.visibility = int(token)
+            return
+
+
+def _decode_clouds(m, tokens):
+    clouds = [match.groups() for match in
+              (_CLOUD_RE.match(token) for token in tokens if token[0] in _CLOUD_START) if match]
+    m.clouds = clouds or None
+    m.base = m.get_base()
+    m.ceiling = m.get_ceiling()
+
+
+def _decode_temperature(m, tokens):
+    m.temperature = m.dewpoint = None
+    for token in tokens:
+        if token[0] in _DIGITS or token[0] == 'M':
+            match = _TEMP_DEW_RE.match(token)
+            if match:
+                temp_dew = match.groups()
+                m.temperature = m.get_temperature(temp_dew)
+                m.dewpoint = m.get_dewpoint(temp_dew)
+                return
+
+
+def _decode_weather(m, tokens):
+    weather = []
+    for token in tokens:
+        first = token[0]
+        if first in _DIGITS or first == 'Q' or first == 'M':
+            continue
+        if first in _CLOUD_START and _CLOUD_RE.match(token):
+            continue
+        match = _WEATHER_RE.match(token)
+        if match:
+            weather.append(match.group(0))
+    m.weather = weather or None
+
+
+def _decode_qnh(m, tokens):
+    m.qnh = None
+    for token in tokens:
+        if token[0] == 'Q':
+            match = _QNH_RE.match(token)
+            if match:
+                m.qnh = int(match.group(1))
+                return
+
+
+def _row_time(m, row):
+    m.time = from_epoch_minutes(row['time'])
+
+
+def _row_wind(m, row):
+    m.wind_direction = row['wind_direction']
+    m.wind_speed = row['wind_speed']
+    m.wind_gust = row['wind_gust']
+
+
+def _row_visibility(m, row):
+    m.visibility = row['visibility']
+
+
+def _row_clouds(m, row):
+    m.clouds = decode_clouds(row['clouds'])
+    m.base = row['base']
+    m.ceiling = row['ceiling']
+
+
+def _row_temperature(m, row):
+    m.temperature = row['temperature']
+    m.dewpoint = row['dewpoint']
+
+
+def _row_weather(m, row):
+    m.weather = decode_weather(row['weather'])
+
+
+def _row_qnh(m, row):
+    m.qnh = row['qnh']
+
+
+_FIELD_GROUPS = {
+    'time': 'time',
+    'wind_direction': 'wind', 'wind_speed': 'wind', 'wind_gust': 'wind',
+    'visibility': 'visibility',
+    'clouds': 'clouds', 'base': 'clouds', 'ceiling': 'clouds',
+    'temperature': 'temperature', 'dewpoint': 'temperature',
+    'weather': 'weather',
+    'qnh': 'qnh',
+}
+_TOKEN_DECODERS = {
+    'time': _decode_time, 'wind': _decode_wind, 'visibility': _decode_visibility, 'clouds': _decode_clouds,
+    'temperature': _decode_temperature, 'weather': _decode_weather, 'qnh': _decode_qnh,
+}
+_ROW_DECODERS = {
+    'time': _row_time, 'wind': _row_wind, 'visibility': _row_visibility, 'clouds': _row_clouds,
+    'temperature': _row_temperature, 'weather': _row_weather, 'qnh': _row_qnh,
+}
+
+
+class LazyMetar(Metar):
+    '''
+    A Metar that decodes its field groups (time, wind, visibility, clouds with
+    base and ceiling, temperature with dewpoint, weather, QNH) from the raw
+    report or database row the first time one of their fields is read, and
+    keeps them. Only raw and station are set up front. Anything written to a
+    field sticks, as with Metar.'''
+    __slots__ = ('_tokens', '_row')
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._row = None
+        parts = raw.split()
+        del parts[0]
+        self.station, self._tokens = _station_tokens(parts)
+
+    @classmethod
+    def from_db_row(cls, row):
+        obj = cls.__new__(cls)
+        obj.raw = row['raw']
+        obj._row = row
+        obj._tokens = None
+        obj.station = row['station']
+        return obj
+
+    def __getattr__(self, name):
+        # Only called for slots that are still unset, i.e. fields whose group
+        # has not been decoded yet; once set they are read like any slot
+        group = _FIELD_GROUPS.get(name)
+        if group is None:
+            raise AttributeError(name)
+        if self._row is not None:
+            _ROW_DECODERS[group](self, self._row)
+        else:
+            _TOKEN_DECODERS[group](self, self._tokens)
+        return object.__getattribute__(self, name)
+
@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+import metar_metrics
+
+
+class TokenBucket:
+    '''
+    Thread-safe token bucket shared by every thread talking to Ogimet.
+    :param rate: Tokens added per second (sustained requests per second).
+    :param capacity: Maximum burst size.'''
+
+    def __init__(self, rate=0.2, capacity=3):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        '''Blocks until a token is available, then takes it. Returns the time waited.'''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        if waited:
+                            metar_metrics.add_time("throttle.wait", waited)
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+                else:
+                    delay = self.paused_until - now
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds):
+        '''Stops every caller from acquiring for the given time, e.g. after a quota error.'''
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated = self.paused_until
+
+
+def backoff_delays(retries=5, base_delay=2.0, max_delay=120.0, jitter=0.25):
+    '''Yields exponentially growing delays with +/- jitter, one per retry.'''
+    delay = base_delay
+    for _ in range(retries):
+        yield min(max_delay, delay) * random.uniform(1 - jitter, 1 + jitter)
+        delay *= 2
+
+
+def call_with_retry(func, retry_on=(Exception,), retries=5, base_delay=2.0, max_delay=120.0, on_retry=None,
+                    max_wait=None):
+    '''
+    Calls func() and retries it with exponential backoff when it raises one
+    of retry_on. The last error is re-raised once the retries are used up.
+    Errors with a retry_after attribute (seconds, e.g. parsed from a quota
+    message) are waited out for that long instead of the backoff delay.
+    :param on_retry: Optional callback(error, delay) run before each wait.
+    :param max_wait: Longest retry_after to wait out, max_delay by default.
+        Errors asking for longer are re-raised straight away, leaving it to
+        the caller whether to wait that long.'''
+    if max_wait is None:
+        max_wait = max_delay
+    for delay in backoff_delays(retries, base_delay, max_delay):
+        try:
+            return func()
+        except retry_on as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                if retry_after > max_wait:
+                    raise
+                delay = retry_after
+            if on_retry is not None:
+                on_retry(e, delay)
+            metar_metrics.add_time("retry.wait", delay)
+            time.sleep(delay)
+    return func()
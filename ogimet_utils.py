@@ -1,5 +1,5 @@
-import sqlite3
 import json
+import threading
 import time
 import requests
 from selenium import webdriver
@@ -8,7 +8,14 @@ from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
 import os
+from datetime import datetime, timedelta, timezone
+from metar_time import merge_intervals, interval_gaps, to_epoch_minutes, from_epoch_minutes
+from ogimet_model import encode_clouds, encode_weather
+from ogimet_cgi import OgimetQuotaError, MAX_QUOTA_WAIT, base_url
+from ogimet_throttle import call_with_retry
+import metar_metrics
 
 class MetarScraper:
     def __init__(self, headless=True, wait_timeout=40):
@@ -33,9 +40,13 @@ class MetarScraper:
         # self.driver.get('https://www.ogimet.com/metars.phtml.en') 
         # time.sleep(.5)
         self.driver.get(url)
-        WebDriverWait(self.driver, self.wait_timeout).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, wait_for_selector))
-        )
+        # Empty results and quota pages have no <pre>, so stop waiting as soon
+        # as either message shows up rather than running into the timeout
+        WebDriverWait(self.driver, self.wait_timeout).until(EC.any_of(
+            EC.presence_of_element_located((By.CSS_SELECTOR, wait_for_selector)),
+            EC.text_to_be_present_in_element((By.TAG_NAME, "body"), NO_METARS_MESSAGE),
+            EC.text_to_be_present_in_element((By.TAG_NAME, "body"), QUOTA_MESSAGE),
+        ))
         return self.driver.page_source
 
     def close(self):
@@ -47,122 +58,557 @@ class MetarScraper:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
-def create_db():
-    conn = sqlite3.connect("metars.db")
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS metars (
-            station TEXT,
-            time TEXT,
-            raw TEXT,
-            wind_direction TEXT,
-            wind_speed INTEGER,
-            wind_gust INTEGER,
-            visibility INTEGER,
-            clouds TEXT,
-            base INTEGER,
-            ceiling INTEGER,
-            weather TEXT,
-            qnh INTEGER,
-            temperature INTEGER,
-            dewpoint INTEGER,
-            PRIMARY KEY (station, time)
-        )
-    """)
-    c.execute("""CREATE TABLE IF NOT EXISTS metar_analysis (
+
+NO_METARS_MESSAGE = "No METARs found"
+QUOTA_MESSAGE = "quota limit"
+
+
+def _usable_page(html):
+    # A page with reports, or one of Ogimet's own answers. Anything else, e.g.
+    # a script challenge, needs a real browser.
+    return "<pre" in html or NO_METARS_MESSAGE in html or QUOTA_MESSAGE in html
+
+
+class ScraperPool:
+    '''
+    Shares up to size warm MetarScraper browsers between concurrent jobs.
+    Each page is first tried with plain requests, and only handed to a
+    browser when that does not give a usable page. Browsers are started on
+    first need and kept until close(). Safe to use from several threads.
+    :param use_requests: Try requests first. Turn off to always use a browser.
+    :param scraper_factory: Callable returning a new scraper, MetarScraper by default.'''
+
+    def __init__(self, size=2, use_requests=True, scraper_factory=MetarScraper):
+        self.size = size
+        self.use_requests = use_requests
+        self.scraper_factory = scraper_factory
+        # Most recently used last, so warm browsers are reused first
+        self.idle = []
+        self.started = 0
+        self.scrapers = []
+        # Signalled whenever a browser is returned or a slot to start one frees up
+        self.available = threading.Condition()
+
+    def _checkout(self):
+        with self.available:
+            while not self.idle and self.started >= self.size:
+                self.available.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            with metar_metrics.timer("scraper.browser_start"):
+                scraper = self.scraper_factory()
+        except BaseException:
+            with self.available:
+                self.started -= 1
+                self.available.notify()
+            raise
+        with self.available:
+            self.scrapers.append(scraper)
+        return scraper
+
+    def _checkin(self, scraper):
+        with self.available:
+            # Browsers that close() shut down meanwhile are not reused
+            if scraper in self.scrapers:
+                self.idle.append(scraper)
+                self.available.notify()
+
+    def _discard(self, scraper):
+        with self.available:
+            if scraper in self.scrapers:
+                self.scrapers.remove(scraper)
+                self.started -= 1
+                self.available.notify()
+        try:
+            scraper.close()
+        except Exception:
+            pass
+
+    def fetch_html(self, url, wait_for_selector='pre'):
+        if self.use_requests:
+            try:
+                with metar_metrics.timer("scraper.requests"):
+                    response = _request_page(url)
+                if response.ok and _usable_page(response.text):
+                    return response.text
+            except requests.RequestException:
+                pass
+            metar_metrics.count("scraper.browser_fallbacks")
+
+        scraper = self._checkout()
+        dead = False
+        try:
+            with metar_metrics.timer("scraper.browser"):
+                return scraper.fetch_html(url, wait_for_selector)
+        except WebDriverException:
+            # The session may be dead; start a fresh one next time
+            dead = True
+            raise
+        finally:
+            if dead:
+                self._discard(scraper)
+            else:
+                self._checkin(scraper)
+
+    def close(self):
+        with self.available:
+            scrapers, self.scrapers = self.scrapers, []
+            self.idle = []
+            self.started = 0
+            self.available.notify_all()
+        for scraper in scrapers:
+            scraper.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Version of the database layout, kept in PRAGMA user_version. Version 1 is
+# the original layout with ISO text times and JSON clouds/weather; version 2
+# stores times as integer minutes since 1970 and clouds/weather as
+# space-separated groups. Version 3 adds the metar_rollup table and version 4
+# the metar_export_state table. Version 5 buckets rollups by each station's
+# own time zone rather than always by Europe/London, and version 6 records
+# whether exported partitions include the raw report text.
+SCHEMA_VERSION = 6
+
+SCHEMA = [
+    # Clustered on (station, time) so a station's range scan reads
+    # neighbouring pages instead of seeking row by row
+    """CREATE TABLE IF NOT EXISTS metars (
         station TEXT,
-        time TEXT,
+        time INTEGER,
+        raw TEXT,
+        wind_direction TEXT,
+        wind_speed INTEGER,
+        wind_gust INTEGER,
+        visibility INTEGER,
+        clouds TEXT,
+        base INTEGER,
+        ceiling INTEGER,
+        weather TEXT,
+        qnh INTEGER,
+        temperature INTEGER,
+        dewpoint INTEGER,
+        PRIMARY KEY (station, time)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS rulesets (
+        name TEXT,
+        version INTEGER,
+        params TEXT,
+        description TEXT,
+        created TEXT,
+        PRIMARY KEY (name, version)
+    )""",
+    # Clustered on the key the analysis joins and aggregates look up, so the
+    # primary key covers those queries
+    """CREATE TABLE IF NOT EXISTS metar_analysis (
+        station TEXT,
+        time INTEGER,
+        ruleset TEXT DEFAULT 'default',
+        ruleset_version INTEGER DEFAULT 1,
         vfr INTEGER,
         flyable INTEGER,
-        ruleset TEXT DEFAULT 'default',
-        PRIMARY KEY (station, time, ruleset),
-        FOREIGN KEY (station, time) REFERENCES metars(station, time)
-    )""")
-    conn.commit()
-    return conn
+        failed INTEGER,
+        PRIMARY KEY (station, ruleset, ruleset_version, time),
+        FOREIGN KEY (station, time) REFERENCES metars(station, time),
+        FOREIGN KEY (ruleset, ruleset_version) REFERENCES rulesets(name, version)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS metar_coverage (
+        station TEXT,
+        begin_time INTEGER,
+        end_time INTEGER,
+        PRIMARY KEY (station, begin_time)
+    ) WITHOUT ROWID""",
+    # Observation counts per local hour, kept up to date by metar_rollup
+    """CREATE TABLE IF NOT EXISTS metar_rollup (
+        station TEXT,
+        ruleset TEXT,
+        ruleset_version INTEGER,
+        local_date TEXT,
+        local_hour INTEGER,
+        total INTEGER,
+        flyable INTEGER,
+        vfr INTEGER,
+        PRIMARY KEY (station, ruleset, ruleset_version, local_date, local_hour)
+    ) WITHOUT ROWID""",
+    # What metar_export last wrote to each Parquet partition, so an export
+    # only rewrites the station-years that changed since
+    """CREATE TABLE IF NOT EXISTS metar_export_state (
+        target TEXT,
+        dataset TEXT,
+        station TEXT,
+        year INTEGER,
+        rows INTEGER,
+        last_time INTEGER,
+        exported TEXT,
+        raw INTEGER DEFAULT 0,
+        PRIMARY KEY (target, dataset, station, year)
+    ) WITHOUT ROWID""",
+]
 
-def save_metars_from_objects(conn, metar_objs):
+
+def create_db(path=None):
+    '''
+    Opens a new connection with the schema set up. Prefer
+    metar_db.get_connection, which reuses one connection per thread.'''
+    import metar_db
+    return metar_db.connect(path)
+
+
+def migrate_db(conn):
+    '''Brings the database up to SCHEMA_VERSION, creating it if empty.'''
     c = conn.cursor()
-    for m in metar_objs:
-        try:
-            c.execute("""
-                INSERT OR IGNORE INTO metars (
-                    station, time, raw, wind_direction, wind_speed, wind_gust,
-                    visibility, clouds, ceiling, base, weather, qnh, temperature, dewpoint
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                m.station,
-                m.time.isoformat(),
-                m.raw,
-                m.wind_direction,
-                m.wind_speed,
-                m.wind_gust,
-                m.visibility,
-                json.dumps(m.clouds),
-                m.ceiling,
-                m.base,
-                json.dumps(m.weather),
-                int(m.qnh[0]) if m.qnh else None,
-                m.temperature,
-                m.dewpoint
-            ))
-        except Exception as e:
-            print(f"Error saving METAR: {m.raw} -> {e}")
-    conn.commit()
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    if version == SCHEMA_VERSION:
+        return
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})")
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'metars'")
+    with conn:
+        if version == 0 and c.fetchone() is not None:
+            _migrate_v1_to_v2(conn)
+            version = 2
+        if version == 2:
+            _migrate_v2_to_v3(conn)
+        else:
+            for statement in SCHEMA:
+                c.execute(statement)
+            if version in (3, 4):
+                _migrate_v4_to_v5(conn)
+            if version in (4, 5):
+                _migrate_v5_to_v6(conn)
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def _table_columns(c, table):
+    return [row[1] for row in c.execute(f"PRAGMA table_info({table})")]
+
+
+def _migrate_v1_to_v2(conn, chunk_size=10000):
+    c = conn.cursor()
+    legacy_tables = {}
+    for table in ("metars", "metar_analysis", "metar_coverage", "rulesets"):
+        columns = _table_columns(c, table)
+        if columns:
+            legacy_tables[table] = columns
+            if table != "rulesets":
+                c.execute(f"ALTER TABLE {table} RENAME TO {table}_v1")
+    for statement in SCHEMA:
+        c.execute(statement)
+
+    def epoch(text):
+        return to_epoch_minutes(datetime.fromisoformat(text).replace(tzinfo=None))
+
+    # Each distinct JSON value is only decoded once
+    clouds_cache = {}
+    weather_cache = {}
+
+    def clouds(text):
+        if text not in clouds_cache:
+            clouds_cache[text] = encode_clouds(json.loads(text)) if text else None
+        return clouds_cache[text]
+
+    def weather(text):
+        if text not in weather_cache:
+            weather_cache[text] = encode_weather(json.loads(text)) if text else None
+        return weather_cache[text]
+
+    read = conn.cursor()
+    read.execute("""
+        SELECT station, time, raw, wind_direction, wind_speed, wind_gust, visibility,
+               clouds, ceiling, base, weather, qnh, temperature, dewpoint
+        FROM metars_v1
+    """)
+    while True:
+        rows = read.fetchmany(chunk_size)
+        if not rows:
+            break
+        c.executemany(INSERT_METAR_SQL, [
+            (r[0], epoch(r[1]), r[2], r[3], r[4], r[5], r[6], clouds(r[7]), r[8], r[9],
+             weather(r[10]), r[11], r[12], r[13])
+            for r in rows
+        ])
+    c.execute("DROP TABLE metars_v1")
+
+    if "ruleset_version" in legacy_tables.get("metar_analysis", []):
+        read.execute("""
+            SELECT station, time, ruleset, ruleset_version, vfr, flyable, failed FROM metar_analysis_v1
+        """)
+        for rows in iter(lambda: read.fetchmany(chunk_size), []):
+            c.executemany("""
+                INSERT OR IGNORE INTO metar_analysis (
+                    station, time, ruleset, ruleset_version, vfr, flyable, failed
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [(r[0], epoch(r[1])) + tuple(r[2:]) for r in rows])
+    if "metar_analysis" in legacy_tables:
+        # Layouts without ruleset_version could never be written to
+        c.execute("DROP TABLE metar_analysis_v1")
+
+    # Databases filled before coverage was tracked get none: which hours the
+    # old fetcher asked for is not recorded, so the planner refetches them
+    # and the reports already stored are ignored on insert
+    if "metar_coverage" in legacy_tables:
+        read.execute("SELECT station, begin_time, end_time FROM metar_coverage_v1")
+        c.executemany("INSERT OR IGNORE INTO metar_coverage (station, begin_time, end_time) VALUES (?, ?, ?)",
+                      [(r[0], epoch(r[1]), epoch(r[2])) for r in read.fetchall()])
+        c.execute("DROP TABLE metar_coverage_v1")
+
+
+def _migrate_v2_to_v3(conn):
+    import metar_rollup
+    for statement in SCHEMA:
+        conn.execute(statement)
+    metar_rollup.rebuild_rollup(conn, commit=False)
+
+
+def _migrate_v4_to_v5(conn):
+    # Rollups of stations outside the UK were bucketed by London dates and
+    # hours; recount them in their own zone
+    import metar_rollup
+    from metar_stations import DEFAULT_TIMEZONE, station_timezone
+    c = conn.cursor()
+    c.execute("SELECT DISTINCT station FROM metar_rollup")
+    for (station,) in c.fetchall():
+        if station_timezone(station) != DEFAULT_TIMEZONE:
+            c.execute("DELETE FROM metar_rollup WHERE station = ?", (station,))
+            metar_rollup.rebuild_rollup(conn, station, commit=False)
+
+
+def _migrate_v5_to_v6(conn):
+    # Earlier exports did not record whether they included the raw text;
+    # they are taken as plain, so the next raw export rewrites them
+    c = conn.cursor()
+    if "raw" not in _table_columns(c, "metar_export_state"):
+        c.execute("ALTER TABLE metar_export_state ADD COLUMN raw INTEGER DEFAULT 0")
+
+
+INSERT_METAR_SQL = """
+    INSERT OR IGNORE INTO metars (
+        station, time, raw, wind_direction, wind_speed, wind_gust,
+        visibility, clouds, ceiling, base, weather, qnh, temperature, dewpoint
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+REPLACE_METAR_SQL = INSERT_METAR_SQL.replace("INSERT OR IGNORE", "INSERT OR REPLACE")
+
+
+def save_metars_bulk(conn, metar_objs, batch_size=500):
+    '''
+    Writes an iterable of parsed METARs to the metars table in batches of
+    batch_size rows, all inside a single transaction.
+    :param conn: Open sqlite3 connection.
+    :param metar_objs: Iterable of Metar objects, may be a generator.
+    :param batch_size: Number of rows handed to each executemany call.
+    :return: Tuple of (inserted, ignored) row counts. Rows already present
+        for the same (station, time) are ignored.'''
+    def rows():
+        for m in metar_objs:
+            try:
+                yield m.to_db_row()
+            except Exception as e:
+                print(f"Error saving METAR: {m.raw} -> {e}")
+
+    return save_metar_rows_bulk(conn, rows(), batch_size)
+
+
+def save_metar_rows_bulk(conn, rows, batch_size=500, replace=False):
+    '''
+    Same as save_metars_bulk, for rows already in Metar.to_db_row form.
+    With replace=True existing rows are overwritten instead of ignored.'''
+    sql = REPLACE_METAR_SQL if replace else INSERT_METAR_SQL
+    c = conn.cursor()
+    inserted = 0
+    ignored = 0
+    batch = []
+
+    def flush():
+        nonlocal inserted, ignored
+        before = conn.total_changes
+        c.executemany(sql, batch)
+        changed = conn.total_changes - before
+        inserted += changed
+        ignored += len(batch) - changed
+        batch.clear()
+
+    with metar_metrics.timer("db.insert"), conn:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+    metar_metrics.count("db.rows_inserted", inserted)
+    metar_metrics.count("db.rows_ignored", ignored)
+    return inserted, ignored
+
+
+def save_metars_from_objects(conn, metar_objs):
+    return save_metars_bulk(conn, metar_objs)
 
 def get_cached_metars(conn, station, start_dt, end_dt):
     c = conn.cursor()
     c.execute("""
         SELECT raw FROM metars
         WHERE station = ? AND time BETWEEN ? AND ?
-    """, (station, start_dt.isoformat(), end_dt.isoformat()))
+    """, (station, to_epoch_minutes(start_dt), to_epoch_minutes(end_dt)))
+    return [row[0] for row in c.fetchall()]
+
+def get_cached_times(conn, station, start_dt, end_dt):
+    '''
+    Returns the sorted times, in epoch minutes, of every cached METAR for a
+    station in [start_dt, end_dt], using one query on the (station, time) key.'''
+    c = conn.cursor()
+    c.execute("""
+        SELECT time FROM metars
+        WHERE station = ? AND time BETWEEN ? AND ?
+        ORDER BY time
+    """, (station, to_epoch_minutes(start_dt), to_epoch_minutes(end_dt)))
     return [row[0] for row in c.fetchall()]
 
+def iter_metar_rows(conn, station, start_dt, end_dt, chunk_size=1000):
+    '''
+    Streams the metars rows for a station in [start_dt, end_dt] in time order
+    from a single range query, fetching chunk_size rows at a time.'''
+    c = conn.cursor()
+    with metar_metrics.timer("db.query"):
+        c.execute("""
+            SELECT * FROM metars
+            WHERE station = ? AND time BETWEEN ? AND ?
+            ORDER BY time
+        """, (station, to_epoch_minutes(start_dt), to_epoch_minutes(end_dt)))
+    while True:
+        with metar_metrics.timer("db.fetch"):
+            rows = c.fetchmany(chunk_size)
+        if not rows:
+            break
+        metar_metrics.count("db.rows_read", len(rows))
+        yield from rows
+
+
+def get_coverage(conn, station, start_dt, end_dt):
+    '''
+    Returns the merged (begin, end) intervals already fetched from Ogimet for
+    a station that touch [start_dt, end_dt], as naive UTC datetimes.'''
+    c = conn.cursor()
+    with metar_metrics.timer("db.query"):
+        c.execute("""
+            SELECT begin_time, end_time FROM metar_coverage
+            WHERE station = ? AND end_time >= ? AND begin_time <= ?
+            ORDER BY begin_time
+        """, (station, to_epoch_minutes(start_dt), to_epoch_minutes(end_dt)))
+        rows = c.fetchall()
+    return merge_intervals((from_epoch_minutes(b), from_epoch_minutes(e)) for b, e in rows)
+
+def get_coverage_gaps(conn, station, start_dt, end_dt):
+    '''
+    Returns the sub-ranges of [start_dt, end_dt] that have not been fetched
+    for a station, including ones fetched and found empty.'''
+    return interval_gaps(start_dt, end_dt, get_coverage(conn, station, start_dt, end_dt))
+
+def record_coverage(conn, station, intervals, commit=True):
+    '''
+    Marks (begin, end) intervals as fetched for a station, merging them with
+    any stored intervals they overlap or adjoin so the table stays compact.'''
+    intervals = [(b, e) for b, e in intervals if e >= b]
+    c = conn.cursor()
+    if intervals:
+        lo = min(b for b, e in intervals) - timedelta(minutes=1)
+        hi = max(e for b, e in intervals) + timedelta(minutes=1)
+        c.execute("""
+            SELECT begin_time, end_time FROM metar_coverage
+            WHERE station = ? AND end_time >= ? AND begin_time <= ?
+        """, (station, to_epoch_minutes(lo), to_epoch_minutes(hi)))
+    else:
+        c.execute("SELECT begin_time, end_time FROM metar_coverage WHERE station = ?", (station,))
+    stored = [(from_epoch_minutes(b), from_epoch_minutes(e)) for b, e in c.fetchall()]
+    merged = merge_intervals(stored + intervals)
+    c.executemany("DELETE FROM metar_coverage WHERE station = ? AND begin_time = ?",
+                  [(station, to_epoch_minutes(b)) for b, e in stored])
+    c.executemany("INSERT INTO metar_coverage (station, begin_time, end_time) VALUES (?, ?, ?)",
+                  [(station, to_epoch_minutes(b), to_epoch_minutes(e)) for b, e in merged])
+    if commit:
+        conn.commit()
+
+
+# Reports can reach Ogimet some time after their observation time, so the
+# most recent part of a request is not recorded as covered
+COVERAGE_SETTLE_TIME = timedelta(hours=2)
+
+
+def settled_range(begin, end):
+    '''
+    Returns the (begin, end) datetimes of a fetched request range, with end
+    clipped to COVERAGE_SETTLE_TIME before now.'''
+    begin_dt = datetime.strptime(begin, "%Y%m%d%H%M")
+    end_dt = datetime.strptime(end, "%Y%m%d%H%M")
+    now = datetime.now(timezone.utc).replace(tzinfo=None, second=0, microsecond=0)
+    return begin_dt, min(end_dt, now - COVERAGE_SETTLE_TIME)
+
+
+_page_session = None
+_page_session_lock = threading.Lock()
+
+
+def _request_page(url):
+    # One keep-alive session for every page fetched without a browser
+    global _page_session
+    with _page_session_lock:
+        if _page_session is None:
+            session = requests.Session()
+            session.headers.update({
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:124.0) Gecko/20100101 Firefox/124.0",
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+                "Accept-Language": "en-US,en;q=0.5",
+                "Connection": "keep-alive",
+                "Upgrade-Insecure-Requests": "1",
+            })
+            _page_session = session
+    return _page_session.get(url, headers={"Referer": f"{base_url()}/"}, timeout=15)
+
 
 def fetch_metars_with_requests(url):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:124.0) Gecko/20100101 Firefox/124.0",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Referer": "https://www.ogimet.com/",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-    }
-    session = requests.Session()
-    session.headers.update(headers)
-    response = session.get(url, timeout=15)
-    return response.text
+    return _request_page(url).text
 
 def get_metar_from_ogimet(station, start_date, end_date, scraper, use_requests=False):
+    '''
+    :param scraper: A MetarScraper, or a ScraperPool shared by concurrent
+        callers, which tries requests itself before using a browser.'''
     print(
         f"Fetching METARs for {station} from {start_date} to {end_date} from Ogimet")
     # time.sleep(1)  # To avoid hitting the server too fast
-    url = (f"https://www.ogimet.com/display_metars2.php?lang=en&lugar={station}"
+    url = (f"{base_url()}/display_metars2.php?lang=en&lugar={station}"
            f"&tipo=SA&ord=REV&nil=NO&fmt=txt&ano={start_date.year}&mes={start_date.month}"
            f"&day={start_date.day}&hora={start_date.hour}&anof={end_date.year}&mesf={end_date.month}"
            f"&dayf={end_date.day}&horaf={end_date.hour}&minf=59&send=send")
-    if use_requests == True:
-        time.sleep(1)
-        response = fetch_metars_with_requests(url)
-    else:
-        # time.sleep(1)
-        response = scraper.fetch_html(url, wait_for_selector='pre')
-
-    if "No METARs found" in response:
-        return []
-
-    lines = response.splitlines()
-    while 'quota limit' in lines[-1]:
-        print("Quota limit reached, waiting for reset...")
-        time.sleep(18)  # Wait for quota reset
-        response = scraper.fetch_html(url, wait_for_selector='pre')
-        if "No METARs found" in response:
+
+    def load():
+        if use_requests == True:
+            time.sleep(1)
+            response = fetch_metars_with_requests(url)
+        else:
+            response = scraper.fetch_html(url, wait_for_selector='pre')
+        if NO_METARS_MESSAGE in response:
             return []
         lines = response.splitlines()
+        for line in reversed(lines):
+            if QUOTA_MESSAGE in line:
+                # The message may say when the quota resets, which then sets
+                # the wait before the retry
+                raise OgimetQuotaError(line.strip())
+        return lines
+
+    def on_retry(error, delay):
+        print(f"Quota limit reached, retrying in {delay:.0f}s...")
+
+    lines = call_with_retry(load, retry_on=(OgimetQuotaError,), base_delay=10.0, retries=8, on_retry=on_retry,
+                            max_wait=MAX_QUOTA_WAIT)
     metars = []
     for line in lines:
         if (str(f'{start_date.year}{start_date.month:02d}{start_date.day:02d}')) in line:
             if 'METAR' in line:
                 metars.append(line.strip())
-    return metars
\ No newline at end of file
+    return metars
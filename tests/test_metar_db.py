@@ -0,0 +1,44 @@
+import sqlite3
+import pytest
+import metar_db
+from ogimet_utils import SCHEMA_VERSION
+
+
+def test_readonly_missing_file_raises(tmp_path):
+    path = tmp_path / "missing.db"
+    with pytest.raises(sqlite3.OperationalError):
+        metar_db.connect(str(path), readonly=True)
+    assert not path.exists()
+
+
+def test_readonly_leaves_file_alone(tmp_path):
+    path = str(tmp_path / "plain.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE notes (text TEXT)")
+    conn.execute("INSERT INTO notes VALUES ('kept')")
+    conn.commit()
+    conn.close()
+
+    metar_db._prepared.discard(path)
+    conn = metar_db.connect(path, readonly=True)
+    try:
+        assert conn.execute("SELECT text FROM notes").fetchone()[0] == "kept"
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == 0
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal"
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("INSERT INTO notes VALUES ('written')")
+    finally:
+        conn.close()
+
+
+def test_readwrite_prepares_once(tmp_path):
+    path = str(tmp_path / "new.db")
+    metar_db._prepared.discard(path)
+    conn = metar_db.connect(path)
+    conn.close()
+    conn = metar_db.connect(path, readonly=True)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        conn.close()
@@ -0,0 +1,98 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from ogimet_model import Metar
+from metar_batch import MetarBatch
+from metar_eval import CRITERIA, evaluate_flyable, evaluate_rulesets, evaluate_vfr, failure_masks
+from metar_rulesets import DEFAULT_RULESET
+
+WINDS = ["27010KT", "VRB03KT", "24018G32KT", "09025G40KT", "00000KT", "/////KT"]
+VISIBILITIES = ["9999", "6000", "3000", "0800", "CAVOK", ""]
+WEATHER = ["", "-RA", "BR", "+TSRA", "FG", "-SHRA VCSH", "TS", "FZFG"]
+CLOUDS = ["", "FEW030", "SCT012 BKN020", "OVC005", "BKN045", "NCD", "VV002"]
+TEMPERATURES = ["08/03", "M02/M03", "31/18", "00/M01", "22/19", ""]
+
+# Single criteria at limits the reports above land on both sides of, plus
+# the default ruleset with all of them
+RULESETS = {
+    "visibility": {"min_visibility": 5000},
+    "ceiling": {"min_ceiling": 1500},
+    "base": {"min_base": 1000},
+    "wind": {"max_wind_speed": 14},
+    "gust": {"max_wind_gust": 25},
+    "weather": {"bad_weather": ["+TS", "TS", "FG", "FZFG"]},
+    "cold": {"min_temperature": 1},
+    "hot": {"max_temperature": 30},
+    "default": DEFAULT_RULESET.flyable,
+}
+
+
+def _reports(count=400, seed=3):
+    rng = random.Random(seed)
+    t = datetime(2024, 1, 1)
+    reports = []
+    for _ in range(count):
+        visibility = rng.choice(VISIBILITIES)
+        groups = [rng.choice(WINDS), visibility]
+        if visibility != "CAVOK":
+            groups += [rng.choice(WEATHER), rng.choice(CLOUDS)]
+        groups += [rng.choice(TEMPERATURES), "Q1013"]
+        body = " ".join(group for group in groups if group)
+        reports.append(Metar(f"{t:%Y%m%d%H%M} METAR EGKA {t:%d%H%M}Z {body}="))
+        t += timedelta(minutes=30)
+    return reports
+
+
+@pytest.fixture(scope="module")
+def metars():
+    return _reports()
+
+
+@pytest.fixture(scope="module")
+def batch(metars):
+    return MetarBatch.from_metars(metars)
+
+
+@pytest.mark.parametrize("name", sorted(RULESETS))
+def test_evaluate_flyable_matches_is_flyable(metars, batch, name):
+    rules = RULESETS[name]
+    flags, failures = evaluate_flyable(batch, **rules)
+    expected = [m.is_flyable(**rules) for m in metars]
+    assert flags.tolist() == expected
+    # Every ruleset is picked to pass some reports and fail others
+    assert 0 < sum(expected) < len(expected)
+    assert sum(failures.values()) >= expected.count(False)
+
+
+def test_failure_masks_match_single_criteria(metars, batch):
+    failed = failure_masks(batch, **DEFAULT_RULESET.flyable)
+    assert set(failed) == set(DEFAULT_RULESET.flyable)
+    for criterion, mask in failed.items():
+        limit = DEFAULT_RULESET.flyable[criterion]
+        assert mask.tolist() == [not m.is_flyable(**{criterion: limit}) for m in metars], criterion
+
+
+def test_evaluate_vfr_matches_is_vfr(metars, batch):
+    assert evaluate_vfr(batch).tolist() == [m.is_vfr() for m in metars]
+    assert evaluate_vfr(batch, 5000, 1000).tolist() == [m.is_vfr(5000, 1000) for m in metars]
+
+
+def test_evaluate_rulesets_matches_separate_runs(batch):
+    results = evaluate_rulesets(batch, RULESETS)
+    for name, rules in RULESETS.items():
+        flags, failures = evaluate_flyable(batch, **rules)
+        assert results[name][0].tolist() == flags.tolist()
+        assert results[name][1] == failures
+
+
+def test_missing_values_never_fail():
+    metar = Metar("202401010000 METAR EGKA 010000Z Q1013=")
+    batch = MetarBatch.from_metars([metar])
+    rules = {criterion: 0 for criterion in CRITERIA if criterion != "bad_weather"}
+    assert metar.is_flyable(**rules)
+    assert evaluate_flyable(batch, **rules)[0].tolist() == [True]
+
+
+def test_unknown_criterion():
+    with pytest.raises(TypeError):
+        failure_masks(MetarBatch.from_metars(_reports(1)), min_qnh=1000)
@@ -0,0 +1,60 @@
+from datetime import datetime
+import pytest
+import metar_db
+from ogimet_model import Metar
+from ogimet_utils import save_metars_bulk
+
+pytest.importorskip("pyarrow")
+import metar_export  # noqa: E402
+
+REPORTS = [
+    "202312311820 METAR EGKA 311820Z 27010KT 9999 FEW030 08/03 Q1013=",
+    "202401150920 METAR EGKA 150920Z 24018G32KT 3000 +TSRA SCT012CB BKN025 22/19 Q1008=",
+    "202401150950 METAR EGKA 150950Z VRB03KT 0800 FG BKN002 M02/M03 Q1025=",
+    "202401151020 METAR LFPG 151020Z 00000KT CAVOK 11/10 Q1019=",
+]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    path = str(tmp_path / "metars.db")
+    metar_db._prepared.discard(path)
+    conn = metar_db.connect(path)
+    save_metars_bulk(conn, [Metar(report) for report in REPORTS])
+    yield conn
+    conn.close()
+
+
+def test_unchanged_partitions_are_skipped(conn, tmp_path):
+    target = str(tmp_path / "export")
+    assert metar_export.export(conn, target) == {"metars": (3, 4)}
+    assert metar_export.export(conn, target) == {"metars": (0, 0)}
+    save_metars_bulk(conn, [Metar("202401151050 METAR EGKA 151050Z 27005KT 9999 12/08 Q1020=")])
+    assert metar_export.export(conn, target) == {"metars": (1, 3)}
+
+
+def test_raw_export_after_plain_rewrites_partitions(conn, tmp_path):
+    target = str(tmp_path / "export")
+    metar_export.export(conn, target)
+    assert metar_export.export(conn, target, raw=True) == {"metars": (3, 4)}
+    assert metar_export.export(conn, target, raw=True) == {"metars": (0, 0)}
+    table = metar_export.load_metars(target, columns=["time", "raw"])
+    assert sorted(table["raw"].to_pylist()) == sorted(REPORTS)
+
+
+def test_mixed_raw_partitions_load_together(conn, tmp_path):
+    target = str(tmp_path / "export")
+    metar_export.export(conn, target, stations=["LFPG"])
+    metar_export.export(conn, target, stations=["EGKA"], raw=True)
+    table = metar_export.load_metars(target, columns=["station", "raw"])
+    raw = dict(zip(table["raw"].to_pylist(), table["station"].to_pylist()))
+    assert raw.pop(None) == "LFPG"
+    assert sorted(raw) == sorted(report for report in REPORTS if " EGKA " in report)
+
+
+def test_load_filters_by_station_and_time(conn, tmp_path):
+    target = str(tmp_path / "export")
+    metar_export.export(conn, target)
+    table = metar_export.load_metars(target, stations=["EGKA"], start_dt=datetime(2024, 1, 1),
+                                     columns=["time", "visibility"])
+    assert table["visibility"].to_pylist() == [3000, 800]
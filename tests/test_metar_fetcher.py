@@ -0,0 +1,47 @@
+from datetime import date, datetime, timedelta
+import pytest
+from metar_fetcher import merge_consecutive_metar_requests
+from metar_stations import DAYLIGHT, station_utc_windows
+
+
+def _requests(station, windows):
+    return [{"icao": station, "begin": f"{begin:%Y%m%d%H%M}", "end": f"{end:%Y%m%d%H%M}", "header": "no"}
+            for begin, end in windows]
+
+
+def _ranges(requests):
+    return [(datetime.strptime(r["begin"], "%Y%m%d%H%M"), datetime.strptime(r["end"], "%Y%m%d%H%M"))
+            for r in requests]
+
+
+@pytest.mark.parametrize("hours", [(9, 17, 9, 19), (0, 23, 0, 23), DAYLIGHT])
+def test_merged_requests_do_not_overlap(hours):
+    windows = station_utc_windows("EGKA", date(2024, 1, 1), date(2024, 6, 30), hours)
+    merged = _ranges(merge_consecutive_metar_requests(_requests("EGKA", windows)))
+    assert len(merged) > 1
+    for (_, end), (begin, _) in zip(merged, merged[1:]):
+        assert end < begin
+    for begin, end in merged:
+        assert end - begin <= timedelta(weeks=4)
+    # Every window is still requested, possibly split over two requests
+    for begin, end in windows:
+        pieces = [(b, e) for b, e in merged if b <= end and e >= begin]
+        assert pieces[0][0] <= begin and end <= pieces[-1][1]
+        for (_, piece_end), (piece_begin, _) in zip(pieces, pieces[1:]):
+            assert piece_begin == piece_end + timedelta(minutes=1)
+
+
+def test_long_groups_continue_the_minute_after():
+    windows = [(datetime(2024, 1, 1) + timedelta(days=day), datetime(2024, 1, 1, 23, 59) + timedelta(days=day))
+               for day in range(60)]
+    merged = _ranges(merge_consecutive_metar_requests(_requests("EGKA", windows)))
+    assert merged[0] == (datetime(2024, 1, 1), datetime(2024, 1, 29))
+    assert merged[1][0] == datetime(2024, 1, 29, 0, 1)
+    assert merged[-1][1] == datetime(2024, 2, 29, 23, 59)
+
+
+def test_stations_are_not_merged():
+    requests = (_requests("EGKA", [(datetime(2024, 1, 1, 9), datetime(2024, 1, 1, 17))])
+                + _requests("EGLL", [(datetime(2024, 1, 1, 10), datetime(2024, 1, 1, 12))]))
+    merged = merge_consecutive_metar_requests(requests)
+    assert sorted(r["icao"] for r in merged) == ["EGKA", "EGLL"]
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+import pytest
+import metar_db
+import metar_live
+from ogimet_model import Metar
+from ogimet_utils import save_metars_bulk
+
+NOW = datetime(2024, 6, 3, 12, 0)
+LAST = datetime(2024, 6, 1, 9, 50)
+
+
+def _report(station, t):
+    return Metar(f"{t:%Y%m%d%H%M} METAR {station} {t:%d%H%M}Z 27010KT 9999 FEW030 18/10 Q1013=")
+
+
+class FakeOgimet:
+    '''Stands in for metar_pipeline.ingest, storing one report at the end of each job.'''
+
+    def __init__(self, fail_before=None):
+        self.fail_before = fail_before
+        self.jobs = []
+
+    def __call__(self, conn, jobs, workers=4, limiter=None, retries=5):
+        for job in jobs:
+            self.jobs.append(job)
+            begin = datetime.strptime(job["begin"], "%Y%m%d%H%M")
+            if self.fail_before is not None and begin < self.fail_before:
+                yield job, {"error": RuntimeError("Ogimet unavailable")}
+                continue
+            end = datetime.strptime(job["end"], "%Y%m%d%H%M")
+            inserted, ignored = save_metars_bulk(conn, [_report(job["icao"], end)])
+            yield job, {"inserted": inserted, "ignored": ignored, "unparsed": 0, "seconds": 0.0}
+
+
+@pytest.fixture
+def updater(tmp_path, monkeypatch):
+    path = str(tmp_path / "live.db")
+    metar_db._prepared.discard(path)
+    conn = metar_db.connect(path)
+    save_metars_bulk(conn, [_report("EGKA", LAST)])
+    monkeypatch.setattr(metar_live, "_utc_now", lambda: NOW)
+    statuses = []
+    updater = metar_live.LiveUpdater(["EGKA"], conn=conn, on_update=statuses.append)
+    updater.statuses = statuses
+    yield updater
+    conn.close()
+
+
+def test_failed_backfill_is_requested_again(updater, monkeypatch):
+    floor = NOW - metar_live.INITIAL_LOOKBACK
+    failing = FakeOgimet(fail_before=floor)
+    monkeypatch.setattr(metar_live, "ingest", failing)
+    status, = updater.poll()
+
+    # The lookback request got the latest report, but the backfill failed
+    assert [job["begin"] for job in failing.jobs][-1] == f"{floor:%Y%m%d%H%M}"
+    assert status["time"] == NOW
+    assert status["errors"] == ["Ogimet unavailable"] * (len(failing.jobs) - 1)
+    assert updater.statuses == [status]
+    assert updater.latest["EGKA"] == metar_live.to_epoch_minutes(LAST)
+
+    working = FakeOgimet()
+    monkeypatch.setattr(metar_live, "ingest", working)
+    status, = updater.poll()
+    assert working.jobs[0]["begin"] == f"{LAST + timedelta(minutes=1):%Y%m%d%H%M}"
+    assert status["errors"] == []
+    assert updater.latest["EGKA"] == metar_live.to_epoch_minutes(NOW)
+
+
+def test_failed_lookback_is_requested_again(updater, monkeypatch):
+    save_metars_bulk(updater.conn, [_report("EGKA", NOW - timedelta(hours=1))])
+    updater.latest["EGKA"] = metar_live.to_epoch_minutes(NOW - timedelta(hours=1))
+    failing = FakeOgimet(fail_before=NOW)
+    monkeypatch.setattr(metar_live, "ingest", failing)
+    status, = updater.poll()
+    assert status["new"] == 0 and len(status["errors"]) == 1
+    assert updater.latest["EGKA"] == metar_live.to_epoch_minutes(NOW - timedelta(hours=1))
+    assert failing.jobs[0]["begin"] == f"{NOW - timedelta(minutes=59):%Y%m%d%H%M}"
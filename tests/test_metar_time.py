@@ -0,0 +1,94 @@
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from metar_stations import DAYLIGHT, daylight_windows, station_utc_windows
+from metar_time import build_utc_windows, epoch_windows, from_epoch_minutes, to_epoch_minutes
+
+HOURS = (9, 17, 9, 19)
+
+
+def reference_windows(start, end, hours, tz_name):
+    # Localises every day's hours one by one, summer being any offset ahead
+    # of the zone's January one. The hours must not fall in a transition.
+    tz = ZoneInfo(tz_name)
+    start_hour, end_hour, summer_start_hour, summer_end_hour = hours
+    windows = []
+    day = start
+    while day <= end:
+        winter_offset = datetime(day.year, 1, 1, tzinfo=tz).utcoffset()
+        local = datetime(day.year, day.month, day.day, start_hour, tzinfo=tz)
+        if local.utcoffset() > winter_offset:
+            start_hour_today, end_hour_today = summer_start_hour, summer_end_hour
+        else:
+            start_hour_today, end_hour_today = start_hour, end_hour
+        windows.append(tuple(
+            datetime(day.year, day.month, day.day, hour, tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+            for hour in (start_hour_today, end_hour_today)))
+        day += timedelta(days=1)
+    return windows
+
+
+@pytest.mark.parametrize("tz_name", ["Europe/London", "Europe/Paris", "Europe/Dublin", "Europe/Helsinki"])
+@pytest.mark.parametrize("hours", [HOURS, (8, 18, 7, 20), (6, 12, 5, 11)])
+def test_windows_match_per_day_localisation(tz_name, hours):
+    start, end = date(2023, 12, 20), date(2025, 1, 10)
+    assert build_utc_windows(start, end, *hours, tz_name=tz_name) == reference_windows(start, end, hours, tz_name)
+
+
+@pytest.mark.parametrize("tz_name, day, expected", [
+    # Clocks go forward on 31 March 2024 and back on 27 October 2024
+    ("Europe/London", date(2024, 3, 30), ((9, 0), (17, 0))),
+    ("Europe/London", date(2024, 3, 31), ((8, 0), (18, 0))),
+    ("Europe/London", date(2024, 10, 26), ((8, 0), (18, 0))),
+    ("Europe/London", date(2024, 10, 27), ((9, 0), (17, 0))),
+    ("Europe/Paris", date(2024, 3, 30), ((8, 0), (16, 0))),
+    ("Europe/Paris", date(2024, 3, 31), ((7, 0), (17, 0))),
+    ("Europe/Paris", date(2024, 10, 27), ((8, 0), (16, 0))),
+    # Dublin's tz data has its saving in winter, but winter is still winter
+    ("Europe/Dublin", date(2024, 1, 10), ((9, 0), (17, 0))),
+    ("Europe/Dublin", date(2024, 7, 10), ((8, 0), (18, 0))),
+])
+def test_windows_on_transition_days(tz_name, day, expected):
+    (begin, end), = build_utc_windows(day, day, *HOURS, tz_name=tz_name)
+    assert (begin.time().hour, begin.time().minute) == expected[0]
+    assert (end.time().hour, end.time().minute) == expected[1]
+    assert begin.date() == end.date() == day
+
+
+def test_windows_span_years():
+    windows = epoch_windows(date(2023, 12, 30), date(2024, 1, 2), HOURS, "Europe/London")
+    assert [from_epoch_minutes(begin).date() for begin, _ in windows] == [
+        date(2023, 12, 30), date(2023, 12, 31), date(2024, 1, 1), date(2024, 1, 2)]
+    assert epoch_windows(datetime(2024, 1, 1, 12), datetime(2024, 1, 1, 23), HOURS, "Europe/London") == [
+        (to_epoch_minutes(datetime(2024, 1, 1, 9)), to_epoch_minutes(datetime(2024, 1, 1, 17)))]
+
+
+def test_empty_range():
+    assert build_utc_windows(date(2024, 6, 2), date(2024, 6, 1), *HOURS) == []
+    assert station_utc_windows("EGKA", date(2024, 6, 2), date(2024, 6, 1), DAYLIGHT) == []
+
+
+def test_station_windows_use_station_zone():
+    assert station_utc_windows("LFPG", date(2024, 7, 1), date(2024, 7, 1), HOURS) == [
+        (datetime(2024, 7, 1, 7), datetime(2024, 7, 1, 17))]
+    assert station_utc_windows("LFPG", date(2024, 7, 1), date(2024, 7, 1), HOURS, tz_name="Europe/London") == [
+        (datetime(2024, 7, 1, 8), datetime(2024, 7, 1, 18))]
+
+
+@pytest.mark.parametrize("day, sunrise, sunset", [
+    (date(2024, 6, 21), datetime(2024, 6, 21, 3, 47), datetime(2024, 6, 21, 20, 18)),
+    (date(2024, 12, 21), datetime(2024, 12, 21, 8, 1), datetime(2024, 12, 21, 15, 58)),
+])
+def test_daylight_windows(day, sunrise, sunset):
+    (begin, end), = daylight_windows("EGKA", day, day, margin=0)
+    assert abs(from_epoch_minutes(begin) - sunrise) <= timedelta(minutes=3)
+    assert abs(from_epoch_minutes(end) - sunset) <= timedelta(minutes=3)
+    (begin_margin, end_margin), = daylight_windows("EGKA", day, day)
+    assert (begin_margin - begin, end - end_margin) == (30, 30)
+    assert station_utc_windows("EGKA", day, day, DAYLIGHT) == [
+        (from_epoch_minutes(begin_margin), from_epoch_minutes(end_margin))]
+
+
+def test_daylight_needs_coordinates():
+    with pytest.raises(ValueError):
+        daylight_windows("EGZZ", date(2024, 6, 21), date(2024, 6, 21))
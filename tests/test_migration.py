@@ -0,0 +1,178 @@
+import json
+import sqlite3
+from datetime import datetime
+import pytest
+import metar_db
+from metar_rulesets import get_ruleset
+from metar_time import to_epoch_minutes
+from ogimet_utils import SCHEMA_VERSION
+
+# The original layout: ISO text times, JSON clouds and weather, and analysis
+# results without a ruleset version
+V1_SCHEMA = [
+    """CREATE TABLE metars (
+        station TEXT,
+        time TEXT,
+        raw TEXT,
+        wind_direction TEXT,
+        wind_speed INTEGER,
+        wind_gust INTEGER,
+        visibility INTEGER,
+        clouds TEXT,
+        base INTEGER,
+        ceiling INTEGER,
+        weather TEXT,
+        qnh INTEGER,
+        temperature INTEGER,
+        dewpoint INTEGER,
+        PRIMARY KEY (station, time)
+    )""",
+    """CREATE TABLE metar_analysis (
+        station TEXT,
+        time TEXT,
+        vfr INTEGER,
+        flyable INTEGER,
+        ruleset TEXT DEFAULT 'default',
+        PRIMARY KEY (station, time, ruleset),
+        FOREIGN KEY (station, time) REFERENCES metars(station, time)
+    )""",
+]
+
+V1_METARS = [
+    ("EGKA", datetime(2024, 3, 1, 9, 20), "METAR EGKA 010920Z 27010KT 9999 FEW030 08/03 Q1013=", "270", 10, None,
+     9999, [["FEW", "030"]], None, 3000, None, 1013, 8, 3),
+    ("EGKA", datetime(2024, 3, 1, 9, 50), "METAR EGKA 010950Z 24018G32KT 3000 +TSRA SCT012CB BKN025 22/19 Q1008=",
+     "240", 18, 32, 3000, [["SCT", "012"], ["BKN", "025"]], 2500, 1200, ["+TS"], 1008, 22, 19),
+    ("EGKA", datetime(2024, 3, 1, 10, 20), "METAR EGKA 011020Z 00000KT CAVOK 11/10 Q1019=", "000", 0, None,
+     None, None, None, None, None, 1019, 11, 10),
+]
+
+
+def _prepare_fresh(path):
+    # metar_db only migrates a path the first time it sees it in a process
+    metar_db._prepared.discard(str(path))
+
+
+def _create_v1(path):
+    conn = sqlite3.connect(path)
+    for statement in V1_SCHEMA:
+        conn.execute(statement)
+    conn.executemany("""
+        INSERT INTO metars (
+            station, time, raw, wind_direction, wind_speed, wind_gust,
+            visibility, clouds, ceiling, base, weather, qnh, temperature, dewpoint
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        row[:1] + (row[1].isoformat(),) + row[2:7] + (json.dumps(row[7]),) + row[8:10] + (json.dumps(row[10]),)
+        + row[11:] for row in V1_METARS
+    ])
+    conn.executemany("INSERT INTO metar_analysis (station, time, vfr, flyable) VALUES (?, ?, 1, 1)",
+                     [(row[0], row[1].isoformat()) for row in V1_METARS])
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def migrated(tmp_path):
+    path = tmp_path / "v1.db"
+    _create_v1(path)
+    _prepare_fresh(path)
+    conn = metar_db.connect(str(path))
+    yield conn
+    conn.close()
+
+
+def test_v1_is_brought_up_to_date(migrated):
+    assert migrated.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    tables = {row[0] for row in migrated.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"metars", "metar_analysis", "metar_coverage", "metar_rollup", "metar_export_state",
+            "rulesets"} <= tables
+    assert not any(table.endswith("_v1") for table in tables)
+
+
+def test_v1_reports_are_converted(migrated):
+    rows = migrated.execute("SELECT station, time, clouds, weather, base, ceiling, qnh FROM metars ORDER BY time")
+    assert [tuple(row) for row in rows] == [
+        ("EGKA", to_epoch_minutes(datetime(2024, 3, 1, 9, 20)), "FEW030", None, 3000, None, 1013),
+        ("EGKA", to_epoch_minutes(datetime(2024, 3, 1, 9, 50)), "SCT012 BKN025", "+TS", 1200, 2500, 1008),
+        ("EGKA", to_epoch_minutes(datetime(2024, 3, 1, 10, 20)), None, None, None, None, 1019),
+    ]
+
+
+def test_v1_gets_no_coverage_or_unversioned_results(migrated):
+    # Nothing records which hours the old fetcher asked for, and results
+    # without a ruleset version are dropped to be evaluated again
+    assert migrated.execute("SELECT COUNT(*) FROM metar_coverage").fetchone()[0] == 0
+    assert migrated.execute("SELECT COUNT(*) FROM metar_analysis").fetchone()[0] == 0
+    assert migrated.execute("SELECT COUNT(*) FROM metar_rollup").fetchone()[0] == 0
+
+
+def test_migration_runs_once(tmp_path, migrated):
+    path = str(tmp_path / "v1.db")
+    again = metar_db.connect(path)
+    try:
+        assert again.execute("SELECT COUNT(*) FROM metars").fetchone()[0] == len(V1_METARS)
+    finally:
+        again.close()
+
+
+def test_v4_rollups_move_to_station_zone(tmp_path):
+    path = str(tmp_path / "v4.db")
+    _prepare_fresh(path)
+    conn = metar_db.connect(path)
+    ruleset = get_ruleset(conn, "default")
+    noon = to_epoch_minutes(datetime(2024, 6, 1, 12, 0))
+    for station in ("EGKA", "LFPG"):
+        conn.execute("INSERT INTO metar_analysis (station, time, ruleset, ruleset_version, vfr, flyable, failed) "
+                     "VALUES (?, ?, ?, ?, 1, 0, 0)", (station, noon, ruleset.name, ruleset.version))
+        # Both bucketed by London time, as version 4 did
+        conn.execute("INSERT INTO metar_rollup VALUES (?, ?, ?, '2024-06-01', 13, 1, 0, 1)",
+                     (station, ruleset.name, ruleset.version))
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+
+    _prepare_fresh(path)
+    conn = metar_db.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        rows = conn.execute("SELECT station, local_date, local_hour, total, flyable, vfr FROM metar_rollup "
+                            "ORDER BY station")
+        assert [tuple(row) for row in rows] == [
+            ("EGKA", "2024-06-01", 13, 1, 0, 1),
+            ("LFPG", "2024-06-01", 14, 1, 0, 1),
+        ]
+    finally:
+        conn.close()
+
+
+def test_newer_schema_is_refused(tmp_path):
+    path = str(tmp_path / "future.db")
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION + 1}")
+    conn.close()
+    _prepare_fresh(path)
+    with pytest.raises(RuntimeError):
+        metar_db.connect(path)
+
+
+def test_v5_export_state_gets_raw_flag(tmp_path):
+    path = str(tmp_path / "v5.db")
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE metars (station TEXT, time INTEGER, PRIMARY KEY (station, time)) WITHOUT ROWID""")
+    conn.execute("""CREATE TABLE metar_export_state (
+        target TEXT, dataset TEXT, station TEXT, year INTEGER, rows INTEGER, last_time INTEGER, exported TEXT,
+        PRIMARY KEY (target, dataset, station, year)
+    ) WITHOUT ROWID""")
+    conn.execute("INSERT INTO metar_export_state VALUES ('/export', 'metars', 'EGKA', 2024, 3, 0, '')")
+    conn.execute("PRAGMA user_version = 5")
+    conn.commit()
+    conn.close()
+
+    _prepare_fresh(path)
+    conn = metar_db.connect(path)
+    try:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert tuple(conn.execute("SELECT station, rows, raw FROM metar_export_state").fetchone()) == ("EGKA", 3, 0)
+    finally:
+        conn.close()
@@ -0,0 +1,67 @@
+import pytest
+import metar_metrics
+import ogimet_cgi
+
+BODY = ("EGKA,2024,03,01,09,20,METAR EGKA 010920Z 27010KT 9999 FEW030 08/03 Q1013=\n"
+        "EGKA,2024,03,01,09,50,METAR EGKA 010950Z 27012KT 9999 SCT030 09/03 Q1013=\n"
+        "LFPG,2024,03,01,10,00,METAR LFPG 011000Z 24008KT CAVOK 11/04 Q1015 NOSIG=\n"
+        "# Relevé à 10:00\n").encode("utf-8")
+
+
+class FakeResponse:
+    def __init__(self, content, chunk_size):
+        self.content = content
+        self.text = content.decode("utf-8")
+        self.encoding = "utf-8"
+        self.chunk_size = chunk_size
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.content), self.chunk_size):
+            yield self.content[i:i + self.chunk_size]
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, content, chunk_size=7):
+        self.content = content
+        self.chunk_size = chunk_size
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        return FakeResponse(self.content, self.chunk_size)
+
+
+@pytest.fixture
+def metrics():
+    metar_metrics.enable()
+    yield metar_metrics
+    metar_metrics.disable()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 65536])
+def test_streamed_and_buffered_reports_agree(metrics, chunk_size):
+    session = FakeSession(BODY, chunk_size)
+    streamed = list(ogimet_cgi.iter_metar("EGKA", session=session))
+    buffered = ogimet_cgi.fetch_metar("EGKA", session=session)
+    assert [f"{stamp} {body}" for _, stamp, body in streamed] == buffered
+    assert streamed[-1] == ("LFPG", "202403011000", "METAR LFPG 011000Z 24008KT CAVOK 11/04 Q1015 NOSIG=")
+
+
+def test_streamed_bytes_match_buffered(metrics):
+    session = FakeSession(BODY)
+    list(ogimet_cgi.iter_metar("EGKA", session=session))
+    assert metrics.summary()["counters"]["http.bytes"] == len(BODY)
+    metrics.reset()
+    ogimet_cgi.fetch_metar("EGKA", session=session)
+    assert metrics.summary()["counters"]["http.bytes"] == len(BODY)
+
+
+def test_streamed_quota_message(metrics):
+    session = FakeSession(b"Sorry, your quota limit for slow queries rate has been reached\n")
+    with pytest.raises(ogimet_cgi.OgimetQuotaError):
+        list(ogimet_cgi.iter_metar("EGKA", session=session))
+    assert metrics.summary()["counters"]["http.quota_responses"] == 1
@@ -0,0 +1,63 @@
+from datetime import datetime
+import pytest
+from ogimet_model import Metar
+
+FIELDS = ("station", "time", "wind_direction", "wind_speed", "wind_gust", "visibility", "clouds",
+          "base", "ceiling", "weather", "qnh", "temperature", "dewpoint")
+# Column order of Metar.to_db_row
+DB_COLUMNS = ("station", "time", "raw", "wind_direction", "wind_speed", "wind_gust", "visibility", "clouds",
+              "ceiling", "base", "weather", "qnh", "temperature", "dewpoint")
+
+# Raw "YYYYmmddHHMM body" reports and the fields Metar.parse gives them, as
+# the regex parser it replaced did
+REPORTS = [
+    ("202403010920 METAR EGKA 010920Z 27010KT 9999 FEW030 08/03 Q1013 =", {
+        "station": "EGKA", "time": datetime(2024, 3, 1, 9, 20), "wind_direction": "270", "wind_speed": 10,
+        "wind_gust": None, "visibility": 9999, "clouds": [("FEW", "030")], "base": 3000, "ceiling": None,
+        "weather": None, "qnh": 1013, "temperature": 8, "dewpoint": 3}),
+    ("202403010920 METAR EGKA 010920Z 27010KT 9999 FEW030 08/03 Q1013=", {
+        "station": "EGKA", "qnh": 1013, "temperature": 8, "dewpoint": 3}),
+    ("202403010920 EGKA 010920Z 27010KT 9999 FEW030 08/03 Q1013", {
+        "station": "EGKA", "wind_speed": 10, "qnh": 1013}),
+    ("202401151250 METAR COR EGLL 151250Z VRB03KT 0800 R27L/1100 FG BKN002 OVC010 M02/M03 Q1025=", {
+        "station": "EGLL", "time": datetime(2024, 1, 15, 12, 50), "wind_direction": "VRB", "wind_speed": 3,
+        "wind_gust": None, "visibility": 800, "clouds": [("BKN", "002"), ("OVC", "010")], "base": 200,
+        "ceiling": 200, "weather": ["FG"], "qnh": 1025, "temperature": -2, "dewpoint": -3}),
+    ("202407221420 SPECI EGKK 221420Z 24018G32KT 3000 +TSRA SCT012CB BKN025 22/19 Q1008", {
+        "station": "EGKK", "wind_direction": "240", "wind_speed": 18, "wind_gust": 32, "visibility": 3000,
+        "clouds": [("SCT", "012"), ("BKN", "025")], "base": 1200, "ceiling": 2500, "weather": ["+TS"],
+        "qnh": 1008, "temperature": 22, "dewpoint": 19}),
+    ("202410050650 METAR EGHI 050650Z 00000KT CAVOK 11/10 Q1019 NOSIG=", {
+        "station": "EGHI", "wind_direction": "000", "wind_speed": 0, "visibility": None, "clouds": None,
+        "base": None, "ceiling": None, "weather": None, "qnh": 1019, "temperature": 11, "dewpoint": 10}),
+    ("202402101150 METAR EIDW 101150Z 31012KT 280V350 9999 -SHRA VCSH FEW018 SCT030 07/02 Q1002 =", {
+        "station": "EIDW", "wind_direction": "310", "wind_speed": 12, "visibility": 9999,
+        "clouds": [("FEW", "018"), ("SCT", "030")], "base": 1800, "ceiling": None,
+        "weather": ["-SH", "VCSH"], "qnh": 1002, "temperature": 7, "dewpoint": 2}),
+]
+
+
+@pytest.mark.parametrize("raw, expected", REPORTS)
+def test_parse(raw, expected):
+    metar = Metar(raw)
+    for field, value in expected.items():
+        assert getattr(metar, field) == value, field
+
+
+@pytest.mark.parametrize("raw", [raw for raw, _ in REPORTS])
+def test_lazy_and_from_parts_match_parse(raw):
+    metar = Metar(raw)
+    stamp, body = raw.split(" ", 1)
+    for other in (Metar.lazy(raw), Metar.from_parts(stamp, body)):
+        assert {field: getattr(other, field) for field in FIELDS} == \
+            {field: getattr(metar, field) for field in FIELDS}
+
+
+def test_db_row_round_trip():
+    for raw, _ in REPORTS:
+        metar = Metar(raw)
+        row = dict(zip(DB_COLUMNS, metar.to_db_row()))
+        for lazy in (False, True):
+            loaded = Metar.from_db_row(row, lazy=lazy)
+            assert {field: getattr(loaded, field) for field in FIELDS} == \
+                {field: getattr(metar, field) for field in FIELDS}